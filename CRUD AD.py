@@ -1,10 +1,22 @@
 import getpass
 import os
 from datetime import datetime, timedelta
-from ldap3 import Server, Connection, NTLM, ALL, MODIFY_REPLACE
+from ldap3 import Server, Connection, NTLM, ALL, BASE, ASYNC, MODIFY_REPLACE, MODIFY_ADD, MODIFY_DELETE
+from ldap3.core.exceptions import LDAPException
+from ldap3.utils.dn import to_dn
+from pyasn1.type import univ, namedtype, tag
+from pyasn1.codec.ber import encoder, decoder
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import bisect
+import gzip
 import holidays
+import json
+import sqlite3
 import subprocess
 import sys
+import unicodedata
+import uuid
 
 # Lista de pacotes obrigatórios
 pacotes_necessarios = [
@@ -34,6 +46,43 @@ instalar_pacotes()
 feriados_sp = holidays.Brazil(prov='SP')
 # Armazena cada busca de usuário
 usuarios_encontrados = {}
+# Quantidade de usuários exibidos por página nas listagens interativas
+TAMANHO_JANELA = 20
+# Controles de ordenação no servidor (RFC 2891) e Virtual List View
+OID_ORDENACAO = '1.2.840.113556.1.4.473'
+OID_VLV = '2.16.840.1.113730.3.4.9'
+OID_VLV_RESPOSTA = '2.16.840.1.113730.3.4.10'
+ATRIBUTOS_LISTAGEM = ['distinguishedName', 'displayName', 'sAMAccountName', 'memberOf',
+                      'info', 'physicalDeliveryOfficeName', 'accountExpires']
+# Diário local (SQLite) com todas as ações feitas pelo menu
+ARQUIVO_DIARIO = 'diario_acoes.db'
+diario_acoes = None
+# Códigos LDAP de conflito na troca atômica do campo 'info' (o valor mudou desde a busca):
+# noSuchAttribute, constraintViolation (campo de valor único) e attributeOrValueExists
+CONFLITOS_INFO = {16, 19, 20}
+# Índice local de contas por data de expiração, atualizado de forma incremental pelo uSNChanged
+ARQUIVO_INDICE_EXPIRACAO = 'indice_expiracao.json'
+FILTRO_EXPIRACAO = '(&(objectClass=user)(objectCategory=person)(accountExpires>=1)(!(accountExpires=9223372036854775807)))'
+ATRIBUTOS_EXPIRACAO = ['objectGUID', 'sAMAccountName', 'displayName', 'accountExpires', 'memberOf', 'info']
+# accountExpires = 0 ou o maior inteiro de 64 bits: a conta nunca expira
+TICKS_NUNCA = 9223372036854775807
+# Controle que inclui os objetos excluídos na busca incremental
+OID_MOSTRAR_EXCLUIDOS = '1.2.840.113556.1.4.417'
+# Desativação em lote de contas inativas: OU de quarentena (padrão: OU=Quarentena na raiz do domínio)
+OU_QUARENTENA = os.environ.get('AD_OU_QUARENTENA')
+DIAS_INATIVIDADE = 90
+# Conexões paralelas e requisições pendentes por conexão (pipeline) na aplicação do lote
+TAMANHO_POOL_DESATIVACAO = 8
+JANELA_PIPELINE = 32
+ESTRATEGIA_LOTE = ASYNC
+# Planos e dados de reversão de cada lote
+PASTA_DESATIVACOES = 'desativacoes'
+# Snapshots gravados pelo List_AD.py (opção de origem em cache para a seleção)
+PASTA_SNAPSHOTS = 'snapshots'
+ATRIBUTOS_DESATIVACAO = ['objectGUID', 'sAMAccountName', 'displayName', 'userAccountControl', 'info',
+                         'lastLogonTimestamp', 'whenCreated', 'accountExpires']
+# Bit ACCOUNTDISABLE do userAccountControl
+UAC_DESATIVADA = 2
 
 
 # Obtém o nome do usuário logado no sistema
@@ -76,6 +125,184 @@ def get_conexao():
 def get_base_dn(conexao):
     return conexao.server.info.other['defaultNamingContext'][0]
 
+# Estruturas ASN.1 dos controles de ordenação e VLV (o ldap3 não traz esses controles prontos)
+class ChaveOrdenacao(univ.Sequence):
+    componentType = namedtype.NamedTypes(
+        namedtype.NamedType('attributeType', univ.OctetString()),
+        namedtype.OptionalNamedType('orderingRule', univ.OctetString().subtype(
+            implicitTag=tag.Tag(tag.tagClassContext, tag.tagFormatSimple, 0))),
+        namedtype.DefaultedNamedType('reverseOrder', univ.Boolean(False).subtype(
+            implicitTag=tag.Tag(tag.tagClassContext, tag.tagFormatSimple, 1))))
+
+class ListaOrdenacao(univ.SequenceOf):
+    componentType = ChaveOrdenacao()
+
+class DeslocamentoVLV(univ.Sequence):
+    componentType = namedtype.NamedTypes(
+        namedtype.NamedType('offset', univ.Integer()),
+        namedtype.NamedType('contentCount', univ.Integer()))
+
+class AlvoVLV(univ.Choice):
+    componentType = namedtype.NamedTypes(
+        namedtype.NamedType('byOffset', DeslocamentoVLV().subtype(
+            implicitTag=tag.Tag(tag.tagClassContext, tag.tagFormatConstructed, 0))),
+        namedtype.NamedType('greaterThanOrEqual', univ.OctetString().subtype(
+            implicitTag=tag.Tag(tag.tagClassContext, tag.tagFormatSimple, 1))))
+
+class RequisicaoVLV(univ.Sequence):
+    componentType = namedtype.NamedTypes(
+        namedtype.NamedType('beforeCount', univ.Integer()),
+        namedtype.NamedType('afterCount', univ.Integer()),
+        namedtype.NamedType('target', AlvoVLV()),
+        namedtype.OptionalNamedType('contextID', univ.OctetString()))
+
+class RespostaVLV(univ.Sequence):
+    componentType = namedtype.NamedTypes(
+        namedtype.NamedType('targetPosition', univ.Integer()),
+        namedtype.NamedType('contentCount', univ.Integer()),
+        namedtype.NamedType('virtualListViewResult', univ.Enumerated()),
+        namedtype.OptionalNamedType('contextID', univ.OctetString()))
+
+# Monta os controles de ordenação por displayName + VLV para buscar apenas uma janela da lista
+# A janela é posicionada pelo deslocamento (1 = primeiro) ou pelo primeiro nome >= letra
+def montar_controles_vlv(estado, deslocamento=None, letra=None):
+    chave = ChaveOrdenacao()
+    chave['attributeType'] = 'displayName'
+    ordenacao = ListaOrdenacao()
+    ordenacao.append(chave)
+
+    requisicao = RequisicaoVLV()
+    requisicao['beforeCount'] = 0
+    requisicao['afterCount'] = TAMANHO_JANELA - 1
+    if letra is not None:
+        requisicao['target']['greaterThanOrEqual'] = letra
+    else:
+        requisicao['target']['byOffset']['offset'] = deslocamento
+        requisicao['target']['byOffset']['contentCount'] = estado['total']
+    if estado['contexto']:
+        requisicao['contextID'] = estado['contexto']
+
+    return [(OID_ORDENACAO, True, encoder.encode(ordenacao)),
+            (OID_VLV, True, encoder.encode(requisicao))]
+
+# Converte uma entrada do AD no dicionário usado em usuarios_encontrados
+def dados_usuario(entry):
+    return {
+        'sAMAccountName': entry.sAMAccountName.value,
+        'distinguishedName': entry.entry_dn,
+        'displayName': entry.displayName.value if 'displayName' in entry and entry.displayName.value else entry.sAMAccountName.value,
+        'grupos': entry.memberOf.values if 'memberOf' in entry else [],
+        'info': entry.info.value if 'info' in entry else None,
+        'escritorio': entry.physicalDeliveryOfficeName.value if 'physicalDeliveryOfficeName' in entry else None,
+        'expiracao': entry.accountExpires.value if 'accountExpires' in entry else None
+    }
+
+# Chave de ordenação dos nomes sem acentos e maiúsculas ('Álvaro' junto de 'Alvaro'), a mesma colação dos relatórios do List_AD.py
+def chave_nome(texto):
+    decomposto = unicodedata.normalize('NFKD', (texto or '').casefold())
+    return ' '.join(''.join(c for c in decomposto if not unicodedata.combining(c)).split())
+
+# Busca uma janela da listagem ordenada. Com VLV o servidor devolve só TAMANHO_JANELA usuários por requisição;
+# sem suporte a VLV, a lista é carregada uma única vez com paginação e ordenada localmente
+def buscar_janela(conexao, estado, deslocamento=None, letra=None):
+    if estado['vlv']:
+        conexao.search(estado['base_dn'], estado['filtro'], attributes=ATRIBUTOS_LISTAGEM,
+                       controls=montar_controles_vlv(estado, deslocamento, letra))
+        controle = conexao.result.get('controls', {}).get(OID_VLV_RESPOSTA)
+        if not controle:
+            print("Erro na listagem:", conexao.result.get('description'), conexao.result.get('message'))
+            return []
+        resposta, _ = decoder.decode(controle['value'], asn1Spec=RespostaVLV())
+        if int(resposta['virtualListViewResult']) != 0:
+            print(f"Erro na listagem (VLV {int(resposta['virtualListViewResult'])}):", conexao.result.get('message'))
+            return []
+        estado['total'] = int(resposta['contentCount'])
+        estado['posicao'] = int(resposta['targetPosition'])
+        estado['contexto'] = bytes(resposta['contextID']) if resposta['contextID'].isValue else None
+        return [dados_usuario(entry) for entry in conexao.entries]
+
+    if estado['lista'] is None:
+        print("Servidor sem suporte a VLV; carregando a lista completa com paginação...")
+        entradas = conexao.extend.standard.paged_search(estado['base_dn'], estado['filtro'], attributes=ATRIBUTOS_LISTAGEM,
+                                                        paged_size=1000, generator=True)
+        lista = []
+        for resposta in entradas:
+            if resposta.get('type') == 'searchResEntry':
+                atributos = resposta['attributes']
+                lista.append({
+                    'sAMAccountName': atributos.get('sAMAccountName'),
+                    'distinguishedName': atributos.get('distinguishedName') or resposta['dn'],
+                    'displayName': atributos.get('displayName') or atributos.get('sAMAccountName'),
+                    'grupos': atributos.get('memberOf') or [],
+                    'info': atributos.get('info') or None,
+                    'escritorio': atributos.get('physicalDeliveryOfficeName') or None,
+                    'expiracao': atributos.get('accountExpires') or None
+                })
+        # Chaves calculadas uma vez; a permutação ordenada serve às páginas e ao salto por prefixo
+        chaves = [chave_nome(dados['displayName']) for dados in lista]
+        ordem = sorted(range(len(lista)), key=chaves.__getitem__)
+        estado['lista'] = [lista[i] for i in ordem]
+        estado['chaves'] = [chaves[i] for i in ordem]
+        estado['total'] = len(lista)
+
+    if letra is not None:
+        deslocamento = bisect.bisect_left(estado['chaves'], chave_nome(letra)) + 1
+    estado['posicao'] = min(max(deslocamento, 1), max(estado['total'], 1))
+    return estado['lista'][estado['posicao'] - 1:estado['posicao'] - 1 + TAMANHO_JANELA]
+
+# Navegação interativa por uma listagem de usuários ordenada por nome
+# 'P' próxima página, 'A' página anterior, '/prefixo' salta para os nomes que começam pelo prefixo
+# Com selecionar=True, digitar o número do usuário o seleciona e o retorna ('R' retorna 'R' para refazer a busca)
+def navegar_usuarios(conexao, filtro, titulo, selecionar=False):
+    suportados = conexao.server.info.supported_controls if conexao.server.info else []
+    estado = {
+        'base_dn': get_base_dn(conexao),
+        'filtro': filtro,
+        'vlv': any(controle[0] == OID_VLV for controle in suportados),
+        'total': 0,
+        'posicao': 1,
+        'contexto': None,
+        'lista': None,
+    }
+
+    janela = buscar_janela(conexao, estado, deslocamento=1)
+    while True:
+        if not janela:
+            print("Nenhum usuário encontrado.")
+            return None
+
+        fim = estado['posicao'] + len(janela) - 1
+        print(f"\n{titulo} ({estado['posicao']}-{fim} de {estado['total']}):")
+        for i, dados in enumerate(janela, start=estado['posicao']):
+            print(f"{i}. {dados['displayName']} ({dados['sAMAccountName']})")
+
+        opcoes = "'P' próxima, 'A' anterior, '/letra' para saltar"
+        if selecionar:
+            opcoes = "o número do usuário para selecionar, 'R' para refazer a busca, " + opcoes
+        escolha = input(f"\nDigite {opcoes} ou 'C' para cancelar: ").strip()
+
+        if escolha.upper() == 'C' or escolha == '':
+            return None
+        elif escolha.upper() == 'P':
+            if fim >= estado['total']:
+                print("Você já está na última página.")
+                continue
+            janela = buscar_janela(conexao, estado, deslocamento=estado['posicao'] + TAMANHO_JANELA)
+        elif escolha.upper() == 'A':
+            if estado['posicao'] <= 1:
+                print("Você já está na primeira página.")
+                continue
+            janela = buscar_janela(conexao, estado, deslocamento=max(1, estado['posicao'] - TAMANHO_JANELA))
+        elif selecionar and escolha.upper() == 'R':
+            return 'R'
+        elif selecionar and escolha.isdigit() and estado['posicao'] <= int(escolha) <= fim:
+            return janela[int(escolha) - estado['posicao']]
+        elif escolha.startswith('/') and escolha[1:].strip():
+            janela = buscar_janela(conexao, estado, letra=escolha[1:].strip())
+        else:
+            print("Entrada inválida. Tente novamente.")
+
+
 # Busca um usuário no Active Directory e armazena os dados encontrados em um dicionário global
 def buscar_usuario(conexao):
     base_dn = get_base_dn(conexao)
@@ -83,17 +310,11 @@ def buscar_usuario(conexao):
 
     # Busca por login 
     filtro_login = f'(sAMAccountName={login_name})'
-    conexao.search(base_dn, filtro_login, attributes=['distinguishedName', 'displayName', 'sAMAccountName', 'memberOf'])
+    conexao.search(base_dn, filtro_login, attributes=ATRIBUTOS_LISTAGEM)
 
     # Se encontrou o usuário pelo login, armazena os dados
     if conexao.entries:
-        entry = conexao.entries[0]
-        dados = {
-            'sAMAccountName': entry.sAMAccountName.value,
-            'distinguishedName': entry.distinguishedName.value,
-            'displayName': entry.displayName.value if 'displayName' in entry else entry.sAMAccountName.value,
-            'grupos': entry.memberOf.values if 'memberOf' in entry else []
-        }
+        dados = dados_usuario(conexao.entries[0])
         usuarios_encontrados[dados['sAMAccountName']] = dados
         print(f"\nUsuário encontrado:")
         print(f"  Nome de login : {dados['sAMAccountName']}")
@@ -108,54 +329,20 @@ def buscar_usuario(conexao):
         filtro_nome += f'(displayName=*{palavra}*)'
     filtro_nome += ')'
 
-    conexao.search(base_dn, filtro_nome, attributes=['distinguishedName', 'displayName', 'sAMAccountName', 'memberOf'])
-
-    if not conexao.entries:
-        print("Nenhum usuário encontrado.")
-        return
-
-    print("\nUsuários encontrados:")
-    for i, entry in enumerate(conexao.entries, start=1):
-        print(f"{i}. {entry.displayName.value} ({entry.sAMAccountName.value})")
-
-    # Seleção do usuário da lista
-    while True:
-        escolha = input("\nDigite o número do usuário para selecionar, 'R' para refazer a busca ou 'C' para cancelar: ").strip().upper()
-        if escolha == 'R':
-            return buscar_usuario(conexao)
-        elif escolha == 'C':
-            return
-        elif escolha.isdigit() and 1 <= int(escolha) <= len(conexao.entries):
-            entry = conexao.entries[int(escolha) - 1]
-            dados = {
-                'sAMAccountName': entry.sAMAccountName.value,
-                'distinguishedName': entry.distinguishedName.value,
-                'displayName': entry.displayName.value if 'displayName' in entry else entry.sAMAccountName.value,
-                'grupos': entry.memberOf.values if 'memberOf' in entry else []
-            }
-            usuarios_encontrados[dados['sAMAccountName']] = dados
-            print(f"\nUsuário selecionado:")
-            print(f"  Nome de login : {dados['sAMAccountName']}")
-            print(f"  Nome exibido  : {dados['displayName']}")
-            print(f"  DN            : {dados['distinguishedName']}")
-            return
-        else:
-            print("Entrada inválida. Tente novamente.")
+    dados = navegar_usuarios(conexao, filtro_nome, "Usuários encontrados", selecionar=True)
+    if dados == 'R':
+        return buscar_usuario(conexao)
+    if dados:
+        usuarios_encontrados[dados['sAMAccountName']] = dados
+        print(f"\nUsuário selecionado:")
+        print(f"  Nome de login : {dados['sAMAccountName']}")
+        print(f"  Nome exibido  : {dados['displayName']}")
+        print(f"  DN            : {dados['distinguishedName']}")
 
-# Lista todos os usuários ativos do Active Directory
+# Lista todos os usuários ativos do Active Directory, página a página e ordenados por nome
 def lista_usuarios_ativos(conexao):
-    base_dn = get_base_dn(conexao)
     filtro = '(&(objectClass=user)(objectCategory=person)(userAccountControl:1.2.840.113556.1.4.803:=512))'
-    
-    conexao.search(base_dn, filtro, attributes=['sAMAccountName', 'displayName', 'distinguishedName'])
-    
-    if not conexao.entries:
-        print("Nenhum usuário ativo encontrado.")
-        return
-
-    print("\nUsuários ativos encontrados:")
-    for entry in conexao.entries:
-        print(f"{entry.displayName.value} ({entry.sAMAccountName.value}) - DN: {entry.distinguishedName.value}")
+    navegar_usuarios(conexao, filtro, "Usuários ativos")
 
 # Altera o campo 'escritório' de um usuário previamente buscado
 def alterar_escritorio(conexao):
@@ -186,7 +373,8 @@ def alterar_escritorio(conexao):
 
     if resultado:
         print(f"Escritório alterado para: {novo_valor}")
-        registrar_log_acao(conexao, usuario['distinguishedName'], "Alteração")
+        registrar_log_acao(conexao, usuario, "Alteração", usuario['escritorio'], novo_valor)
+        usuario['escritorio'] = novo_valor
     else:
         print("Erro ao alterar:", conexao.result)
 
@@ -244,8 +432,22 @@ def ajustar_dia_util(data: datetime) -> datetime:
     return data
 
 
-# Renova a conta de um usuário previamente buscado, adicionando 90 ou 180 dias
+# Converte uma data para o formato do AD (intervalo de 100 nanossegundos desde 1601-01-01) e vice-versa
+def data_para_ticks(data):
+    return int((data - datetime(1601, 1, 1)).total_seconds() * 10**7)
+
+def ticks_para_data(ticks):
+    return datetime(1601, 1, 1) + timedelta(microseconds=ticks // 10)
+
+# Calcula a renovação de uma conta a partir dos grupos do usuário
 # Se o usuário for membro do grupo "12 - Prestadores", adiciona 90 dias. Se não, adiciona 180 dias.
+def calcular_renovacao(grupos):
+    membro_prestador = any("12 - Prestadores" in grupo for grupo in grupos)
+    dias_para_adicionar = 90 if membro_prestador else 180
+    data_futura = datetime.today() + timedelta(days=dias_para_adicionar)
+    return dias_para_adicionar, ajustar_dia_util(data_futura)
+
+# Renova a conta de um usuário previamente buscado, adicionando 90 ou 180 dias
 def renovar_conta(conexao):
     if not usuarios_encontrados:
         print("Nenhum usuário foi buscado ainda.")
@@ -267,15 +469,8 @@ def renovar_conta(conexao):
     login_selecionado = list(usuarios_encontrados.keys())[escolha - 1]
     usuario = usuarios_encontrados[login_selecionado]
 
-    # Verifica se está no grupo "12 - Prestadores"
-    membro_prestador = any("12 - Prestadores" in grupo for grupo in usuario['grupos'])
-    dias_para_adicionar = 90 if membro_prestador else 180
-
-    data_futura = datetime.today() + timedelta(days=dias_para_adicionar)
-    data_ajustada = ajustar_dia_util(data_futura)
-
-    # Converte para formato do AD (intervalo de 100 nanossegundos desde 1601-01-01)
-    ticks = int((data_ajustada - datetime(1601, 1, 1)).total_seconds() * 10**7)
+    dias_para_adicionar, data_ajustada = calcular_renovacao(usuario['grupos'])
+    ticks = data_para_ticks(data_ajustada)
 
     resultado = conexao.modify(usuario['distinguishedName'], {
         'accountExpires': [(MODIFY_REPLACE, [str(ticks)])]
@@ -283,33 +478,681 @@ def renovar_conta(conexao):
 
     if resultado:
         print(f"Conta {usuario['sAMAccountName']} renovada até {data_ajustada.strftime('%d/%m/%Y')} ({dias_para_adicionar} dias).")
-        registrar_log_acao(conexao, usuario['distinguishedName'], "Renovação")
+        registrar_log_acao(conexao, usuario, "Renovação", usuario['expiracao'], data_ajustada)
+        usuario['expiracao'] = data_ajustada
     else:
         print("Erro ao renovar conta:", conexao.result)
 
 
-def registrar_log_acao(conexao, dn, tipo_acao):
-    chamado = input("Informe o número do chamado: ").strip()
-    data_hoje = datetime.today().strftime('%d/%m/%Y')
-    nova_linha = f"{data_hoje} - {tipo_acao} - {chamado}"
+# Abre (e cria, se necessário) o diário local de ações
+# A tabela é somente de inclusão: os gatilhos impedem alterar ou apagar registros
+def get_diario():
+    global diario_acoes
+    if diario_acoes is None:
+        diario_acoes = sqlite3.connect(ARQUIVO_DIARIO, check_same_thread=False)
+        diario_acoes.executescript("""
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS acoes (
+                id INTEGER PRIMARY KEY,
+                data_hora TEXT NOT NULL,
+                operador TEXT NOT NULL,
+                dn TEXT NOT NULL COLLATE NOCASE,
+                acao TEXT NOT NULL,
+                chamado TEXT,
+                valor_anterior TEXT,
+                valor_novo TEXT,
+                resultado TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_acoes_dn ON acoes (dn, data_hora);
+            CREATE INDEX IF NOT EXISTS idx_acoes_chamado ON acoes (chamado, data_hora);
+            CREATE INDEX IF NOT EXISTS idx_acoes_data ON acoes (data_hora);
+            CREATE TRIGGER IF NOT EXISTS acoes_sem_alteracao BEFORE UPDATE ON acoes
+                BEGIN SELECT RAISE(ABORT, 'o diário de ações é somente de inclusão'); END;
+            CREATE TRIGGER IF NOT EXISTS acoes_sem_exclusao BEFORE DELETE ON acoes
+                BEGIN SELECT RAISE(ABORT, 'o diário de ações é somente de inclusão'); END;
+        """)
+    return diario_acoes
 
-    # Lê o conteúdo atual do campo 'info'
-    conexao.search(dn, '(objectClass=*)', attributes=['info'])
-    atual = conexao.entries[0]['info'].value if 'info' in conexao.entries[0] else ""
+# Acrescenta uma ação ao diário local
+def registrar_no_diario(operador, dn, acao, chamado, valor_anterior, valor_novo, resultado):
+    diario = get_diario()
+    with diario:
+        diario.execute(
+            "INSERT INTO acoes (data_hora, operador, dn, acao, chamado, valor_anterior, valor_novo, resultado) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (datetime.now().isoformat(timespec='seconds'), operador, dn, acao, chamado,
+             None if valor_anterior is None else str(valor_anterior),
+             None if valor_novo is None else str(valor_novo), resultado)
+        )
 
-    # Adiciona nova linha ao final
-    novo_conteudo = ( "\r\n" + atual + "\r\n" + nova_linha).strip() if atual else nova_linha
+# Consulta o diário pelos índices de DN, chamado e data (datas no formato AAAA-MM-DD, fim exclusivo)
+def consultar_diario(dn=None, chamado=None, inicio=None, fim=None):
+    condicoes, parametros = [], []
+    if dn:
+        condicoes.append("dn = ?")
+        parametros.append(dn)
+    if chamado:
+        condicoes.append("chamado = ?")
+        parametros.append(chamado)
+    if inicio:
+        condicoes.append("data_hora >= ?")
+        parametros.append(inicio)
+    if fim:
+        condicoes.append("data_hora < ?")
+        parametros.append(fim)
+    where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ""
+    return get_diario().execute(
+        f"SELECT data_hora, operador, dn, acao, chamado, valor_anterior, valor_novo, resultado "
+        f"FROM acoes {where} ORDER BY data_hora", parametros
+    ).fetchall()
 
-    resultado = conexao.modify(dn, {
-        'info': [(MODIFY_REPLACE, [novo_conteudo])]
-    })
+# Registra a ação no diário local e acrescenta uma linha ao campo 'info' (Observação) do usuário
+# A escrita no AD é uma troca atômica (remove o valor antigo e inclui o novo na mesma operação),
+# usando o valor lido na busca do usuário; só há nova leitura se outro operador alterou o campo antes
+def registrar_log_acao(conexao, usuario, tipo_acao, valor_anterior=None, valor_novo=None, chamado=None):
+    if chamado is None:
+        chamado = input("Informe o número do chamado: ").strip()
+    data_hoje = datetime.today().strftime('%d/%m/%Y')
+    nova_linha = f"{data_hoje} - {tipo_acao} - {chamado}"
+    dn = usuario['distinguishedName']
+
+    atual = usuario.get('info')
+    resultado = False
+    falha = "interrompido"
+    # A ação no AD já foi feita: o diário é gravado mesmo que a escrita no 'info' falhe ou seja interrompida
+    try:
+        for tentativa in range(3):
+            # Adiciona nova linha ao final
+            novo_conteudo = (atual.strip() + "\r\n" + nova_linha) if atual else nova_linha
+            if atual:
+                mudanca = [(MODIFY_DELETE, [atual]), (MODIFY_ADD, [novo_conteudo])]
+            else:
+                mudanca = [(MODIFY_ADD, [novo_conteudo])]
+            resultado = conexao.modify(dn, {'info': mudanca})
+            falha = conexao.result['description']
+            if resultado or conexao.result['result'] not in CONFLITOS_INFO:
+                break
+            # O campo mudou desde a busca: relê o valor atual e tenta de novo
+            conexao.search(dn, '(objectClass=*)', attributes=['info'])
+            if not conexao.entries:
+                falha = "usuário não encontrado (movido ou excluído)"
+                break
+            atual = conexao.entries[0]['info'].value if 'info' in conexao.entries[0] else None
+    finally:
+        registrar_no_diario(conexao.user, dn, tipo_acao, chamado, valor_anterior, valor_novo,
+                            "ok" if resultado else f"falha no campo 'info': {falha}")
 
     if resultado:
+        usuario['info'] = novo_conteudo
         print(f"Log adicionado no campo 'Observação': {nova_linha}")
     else:
-        print("Falha ao registrar ação:", conexao.result)
+        print("Falha ao registrar ação:", falha)
+
+# Consulta interativa do diário de ações por login, DN, chamado ou período
+def consultar_acoes(conexao):
+    print("\nFiltros (deixe em branco para ignorar):")
+    login = input("Login ou DN do usuário: ").strip()
+    chamado = input("Número do chamado: ").strip()
+    inicio = input("Data inicial (dd/mm/aaaa): ").strip()
+    fim = input("Data final (dd/mm/aaaa): ").strip()
+
+    dn = login
+    if login and '=' not in login:
+        if login in usuarios_encontrados:
+            dn = usuarios_encontrados[login]['distinguishedName']
+        else:
+            conexao.search(get_base_dn(conexao), f'(sAMAccountName={login})', attributes=['distinguishedName'])
+            if not conexao.entries:
+                print("Nenhum usuário encontrado.")
+                return
+            dn = conexao.entries[0].entry_dn
+
+    try:
+        inicio = datetime.strptime(inicio, '%d/%m/%Y').strftime('%Y-%m-%d') if inicio else None
+        fim = (datetime.strptime(fim, '%d/%m/%Y') + timedelta(days=1)).strftime('%Y-%m-%d') if fim else None
+    except ValueError:
+        print("Data inválida.")
+        return
 
+    acoes = consultar_diario(dn or None, chamado or None, inicio, fim)
+    if not acoes:
+        print("Nenhuma ação encontrada.")
+        return
+
+    print(f"\n{len(acoes)} ação(ões) encontrada(s):")
+    for data_hora, operador, dn_acao, acao, chamado_acao, anterior, novo, resultado in acoes:
+        print(f"{data_hora} | {acao} | chamado {chamado_acao} | {operador} | {dn_acao}")
+        print(f"    {anterior} -> {novo} ({resultado})")
+
+
+# Lê a identidade do DC (invocationId) e o maior USN já gravado nele
+# Os USNs só valem para o DC que os gerou: se o DC mudar, o índice precisa ser reconstruído
+def estado_replicacao(conexao):
+    conexao.search('', '(objectClass=*)', search_scope=BASE, attributes=['highestCommittedUSN', 'dsServiceName'])
+    raiz = conexao.response[0]['raw_attributes']
+    servico = raiz['dsServiceName'][0].decode('utf-8')
+    conexao.search(servico, '(objectClass=*)', search_scope=BASE, attributes=['invocationId'])
+    invocacao = conexao.response[0]['raw_attributes'].get('invocationId') or [b'']
+    return invocacao[0].hex(), int(raiz['highestCommittedUSN'][0])
+
+# Converte a resposta bruta de um usuário no registro guardado no índice de expiração
+def _registro_expiracao(resposta):
+    brutos = resposta['raw_attributes']
+    texto = lambda atributo: brutos[atributo][0].decode('utf-8') if brutos.get(atributo) else None
+    return {
+        'guid': brutos['objectGUID'][0].hex(),
+        'ticks': int(brutos['accountExpires'][0]) if brutos.get('accountExpires') else 0,
+        'dn': resposta['dn'],
+        'sAMAccountName': texto('sAMAccountName'),
+        'displayName': texto('displayName') or texto('sAMAccountName'),
+        'grupos': [grupo.decode('utf-8') for grupo in brutos.get('memberOf') or []],
+        'info': texto('info'),
+    }
 
+# Inclui (ou substitui) um usuário no índice, mantendo a lista ordenada por data de expiração
+def _indice_inserir(indice, registro):
+    _indice_remover(indice, registro['guid'])
+    if registro['ticks'] in (0, TICKS_NUNCA):
+        return
+    indice['registros'][registro['guid']] = registro
+    bisect.insort(indice['ordem'], (registro['ticks'], registro['guid']))
+
+def _indice_remover(indice, guid):
+    registro = indice['registros'].pop(guid, None)
+    if registro:
+        posicao = bisect.bisect_left(indice['ordem'], (registro['ticks'], guid))
+        if posicao < len(indice['ordem']) and indice['ordem'][posicao] == (registro['ticks'], guid):
+            del indice['ordem'][posicao]
+
+# Aplica ao índice as respostas de uma busca (carga completa ou incremental); devolve quantas mudaram
+def _indice_aplicar_respostas(indice, respostas):
+    total = 0
+    for resposta in respostas:
+        if resposta.get('type') != 'searchResEntry':
+            continue
+        brutos = resposta['raw_attributes']
+        if brutos.get('isDeleted') and brutos['isDeleted'][0].upper() == b'TRUE':
+            _indice_remover(indice, brutos['objectGUID'][0].hex())
+        else:
+            _indice_inserir(indice, _registro_expiracao(resposta))
+        total += 1
+    return total
+
+# Grava o índice em disco para que a próxima execução só busque as mudanças
+def salvar_indice_expiracao(indice):
+    with open(ARQUIVO_INDICE_EXPIRACAO, 'w', encoding='utf-8') as arquivo:
+        json.dump({'dc': indice['dc'], 'usn': indice['usn'], 'registros': indice['registros']}, arquivo)
+
+# Carga completa: todos os usuários com data de expiração definida
+def reconstruir_indice_expiracao(conexao):
+    dc, usn = estado_replicacao(conexao)
+    indice = {'dc': dc, 'usn': usn, 'registros': {}, 'ordem': []}
+    print("Carregando usuários com data de expiração...")
+    respostas = conexao.extend.standard.paged_search(get_base_dn(conexao), FILTRO_EXPIRACAO, attributes=ATRIBUTOS_EXPIRACAO,
+                                                     paged_size=1000, generator=True)
+    _indice_aplicar_respostas(indice, respostas)
+    print(f"Índice de expiração criado: {len(indice['ordem'])} contas.")
+    return indice
+
+# Atualização incremental: busca apenas os usuários alterados (ou excluídos) desde o último USN visto
+def atualizar_indice_expiracao(conexao, indice):
+    dc, usn = estado_replicacao(conexao)
+    if dc != indice['dc']:
+        print("Conectado a outro controlador de domínio; reconstruindo o índice.")
+        return reconstruir_indice_expiracao(conexao)
+    if usn > indice['usn']:
+        filtro = f"(&(objectClass=user)(!(objectClass=computer))(uSNChanged>={indice['usn'] + 1}))"
+        respostas = conexao.extend.standard.paged_search(get_base_dn(conexao), filtro, attributes=ATRIBUTOS_EXPIRACAO + ['isDeleted'],
+                                                         controls=[(OID_MOSTRAR_EXCLUIDOS, True, None)],
+                                                         paged_size=1000, generator=True)
+        alterados = _indice_aplicar_respostas(indice, respostas)
+        print(f"Índice de expiração atualizado: {alterados} usuário(s) alterado(s) desde a última consulta.")
+    indice['usn'] = usn
+    return indice
+
+# Abre o índice salvo e o atualiza de forma incremental; sem índice salvo, faz a carga completa
+def carregar_indice_expiracao(conexao):
+    if os.path.exists(ARQUIVO_INDICE_EXPIRACAO):
+        with open(ARQUIVO_INDICE_EXPIRACAO, encoding='utf-8') as arquivo:
+            salvo = json.load(arquivo)
+        indice = {'dc': salvo['dc'], 'usn': salvo['usn'], 'registros': salvo['registros'],
+                  'ordem': sorted((registro['ticks'], guid) for guid, registro in salvo['registros'].items())}
+        indice = atualizar_indice_expiracao(conexao, indice)
+    else:
+        indice = reconstruir_indice_expiracao(conexao)
+    salvar_indice_expiracao(indice)
+    return indice
+
+# Consulta por intervalo: contas que expiram entre hoje (menos os dias já vencidos) e os próximos N dias
+def contas_expirando(indice, dias, vencidas_ha_dias=0):
+    hoje = datetime.today()
+    inicio = data_para_ticks(hoje - timedelta(days=vencidas_ha_dias))
+    fim = data_para_ticks(hoje + timedelta(days=dias))
+    ordem = indice['ordem']
+    return [indice['registros'][guid]
+            for _, guid in ordem[bisect.bisect_left(ordem, (inicio,)):bisect.bisect_left(ordem, (fim,))]]
+
+# Monta a fila de renovação com a nova data já calculada pelas mesmas regras de renovar_conta
+def montar_fila_renovacao(indice, dias, vencidas_ha_dias=0):
+    fila = []
+    for registro in contas_expirando(indice, dias, vencidas_ha_dias):
+        dias_renovacao, nova_data = calcular_renovacao(registro['grupos'])
+        fila.append({
+            'registro': registro,
+            'expira_em': ticks_para_data(registro['ticks']),
+            'dias': dias_renovacao,
+            'nova_expiracao': nova_data,
+        })
+    return fila
+
+# Aplica a fila em lote: um único chamado para todas as renovações, registradas no diário e no campo 'info'
+def aplicar_fila_renovacao(conexao, indice, fila):
+    chamado = input("Informe o número do chamado para o lote: ").strip()
+    renovadas = 0
+    for item in fila:
+        registro = item['registro']
+        ticks = data_para_ticks(item['nova_expiracao'])
+        resultado = conexao.modify(registro['dn'], {'accountExpires': [(MODIFY_REPLACE, [str(ticks)])]})
+        if not resultado:
+            print(f"Erro ao renovar {registro['sAMAccountName']}:", conexao.result['description'])
+            registrar_no_diario(conexao.user, registro['dn'], "Renovação", chamado, item['expira_em'], item['nova_expiracao'],
+                                f"falha: {conexao.result['description']}")
+            continue
+        usuario = {'distinguishedName': registro['dn'], 'info': registro['info']}
+        registrar_log_acao(conexao, usuario, "Renovação", item['expira_em'], item['nova_expiracao'], chamado=chamado)
+        registro['info'] = usuario['info']
+        _indice_inserir(indice, dict(registro, ticks=ticks))
+        renovadas += 1
+    salvar_indice_expiracao(indice)
+    print(f"{renovadas} de {len(fila)} conta(s) renovada(s).")
+
+# Lista as contas que expiram nos próximos dias e permite renová-las em lote
+def fila_de_renovacao(conexao):
+    try:
+        dias = int(input("Expirando nos próximos quantos dias? [30]: ").strip() or 30)
+        vencidas = int(input("Incluir contas vencidas há até quantos dias? [0]: ").strip() or 0)
+    except ValueError:
+        print("Entrada inválida.")
+        return
+
+    indice = carregar_indice_expiracao(conexao)
+    fila = montar_fila_renovacao(indice, dias, vencidas)
+    if not fila:
+        print("Nenhuma conta expirando no período.")
+        return
+
+    print(f"\nFila de renovação ({len(fila)} conta(s)):")
+    for i, item in enumerate(fila, start=1):
+        registro = item['registro']
+        print(f"{i}. {registro['displayName']} ({registro['sAMAccountName']}) - expira em {item['expira_em'].strftime('%d/%m/%Y')}"
+              f" -> {item['nova_expiracao'].strftime('%d/%m/%Y')} ({item['dias']} dias)")
+
+    escolha = input("\nDigite 'T' para renovar todas, números separados por vírgula para renovar algumas ou 'C' para cancelar: ").strip().upper()
+    if escolha == 'T':
+        selecionados = fila
+    elif escolha and escolha != 'C':
+        try:
+            selecionados = [fila[int(numero) - 1] for numero in escolha.split(',')]
+        except (ValueError, IndexError):
+            print("Entrada inválida.")
+            return
+    else:
+        return
+    aplicar_fila_renovacao(conexao, indice, selecionados)
+
+
+# Filtro das contas ativas sem logon desde o corte (ou nunca usadas e criadas antes dele) e, opcionalmente, das vencidas
+# O lastLogonTimestamp é replicado com atraso de até 14 dias, margem irrelevante para janelas de inatividade usuais
+# Objetos críticos do sistema e contas administrativas (adminCount=1) ficam de fora: devem ser tratados manualmente
+def filtro_inativas(corte, incluir_vencidas, agora):
+    criterios = (f"(lastLogonTimestamp<={data_para_ticks(corte)})"
+                 f"(&(!(lastLogonTimestamp=*))(whenCreated<={corte.strftime('%Y%m%d%H%M%S')}.0Z))")
+    if incluir_vencidas:
+        criterios += f"(&(accountExpires>=1)(accountExpires<={data_para_ticks(agora)}))"
+    return ("(&(objectClass=user)(objectCategory=person)(!(userAccountControl:1.2.840.113556.1.4.803:=2))"
+            f"(!(isCriticalSystemObject=TRUE))(!(adminCount=1))(|{criterios}))")
+
+# Converte o objectGUID bruto na forma aceita pelo AD como DN de busca (<GUID=...>)
+def guid_texto(bruto):
+    return str(uuid.UUID(bytes_le=bruto)) if len(bruto) == 16 else bruto.decode('utf-8').strip('{}')
+
+# Monta o item do plano de desativação a partir da resposta bruta de uma busca
+def _item_desativacao(resposta, motivo):
+    brutos = resposta['raw_attributes']
+    texto = lambda atributo: brutos[atributo][0].decode('utf-8') if brutos.get(atributo) else None
+    logon = int(brutos['lastLogonTimestamp'][0]) if brutos.get('lastLogonTimestamp') else 0
+    return {
+        'guid': guid_texto(brutos['objectGUID'][0]),
+        'login': texto('sAMAccountName'),
+        'nome': texto('displayName') or texto('sAMAccountName'),
+        'dn': resposta['dn'],
+        'uac': int(brutos['userAccountControl'][0]),
+        'info': texto('info'),
+        'ultimo_logon': ticks_para_data(logon).strftime('%d/%m/%Y') if logon else 'nunca',
+        'motivo': motivo,
+    }
+
+# Motivo da seleção de uma conta (inatividade tem precedência sobre vencimento)
+def _motivo_desativacao(logon, criacao, expira, corte, agora):
+    if (logon and logon <= corte) or (not logon and criacao and criacao <= corte):
+        return 'inatividade'
+    if expira and expira <= agora:
+        return 'conta vencida'
+    return None
+
+# Seleção direto no AD: uma busca paginada com o filtro de inatividade
+def selecionar_inativas_ad(conexao, dias, incluir_vencidas):
+    agora = datetime.now()
+    corte = agora - timedelta(days=dias)
+    respostas = conexao.extend.standard.paged_search(get_base_dn(conexao), filtro_inativas(corte, incluir_vencidas, agora),
+                                                     attributes=ATRIBUTOS_DESATIVACAO, paged_size=1000, generator=True)
+    itens = []
+    for resposta in respostas:
+        if resposta.get('type') != 'searchResEntry':
+            continue
+        brutos = resposta['raw_attributes']
+        logon = int(brutos['lastLogonTimestamp'][0]) if brutos.get('lastLogonTimestamp') else 0
+        expira = int(brutos['accountExpires'][0]) if brutos.get('accountExpires') else 0
+        criacao = brutos['whenCreated'][0].decode('utf-8') if brutos.get('whenCreated') else None
+        motivo = _motivo_desativacao(logon and ticks_para_data(logon),
+                                     criacao and datetime.strptime(criacao[:14], '%Y%m%d%H%M%S'),
+                                     expira not in (0, TICKS_NUNCA) and ticks_para_data(expira), corte, agora)
+        itens.append(_item_desativacao(resposta, motivo or 'inatividade'))
+    return itens
+
+# Seleção pelo snapshot mais recente do List_AD.py, sem consultar o AD
+# O snapshot não guarda DN nem 'info': cada conta é relida pelo GUID e reavaliada na aplicação
+def selecionar_inativas_snapshot(caminho, dias, incluir_vencidas):
+    agora = datetime.now()
+    corte = agora - timedelta(days=dias)
+    data = lambda valor: datetime.fromisoformat(valor) if valor else None
+    itens = []
+    with gzip.open(caminho, 'rt', encoding='utf-8') as arquivo:
+        next(arquivo)  # cabeçalho
+        for texto in arquivo:
+            linha = json.loads(texto)
+            if linha.get('userAccountControl') is None or linha['userAccountControl'] & UAC_DESATIVADA:
+                continue
+            motivo = _motivo_desativacao(data(linha.get('lastLogonTimestamp')), data(linha.get('whenCreated')),
+                                         incluir_vencidas and data(linha.get('accountExpires')), corte, agora)
+            if motivo:
+                itens.append({
+                    'guid': linha['objectGUID'].strip('{}'), 'login': linha.get('sAMAccountName'),
+                    'nome': linha.get('displayName') or linha.get('sAMAccountName'), 'dn': None,
+                    'uac': linha['userAccountControl'], 'info': None,
+                    'ultimo_logon': data(linha['lastLogonTimestamp']).strftime('%d/%m/%Y') if linha.get('lastLogonTimestamp') else 'nunca',
+                    'motivo': motivo,
+                })
+    return itens
+
+# Abre uma conexão extra com as mesmas credenciais, na estratégia assíncrona (várias requisições em trânsito)
+def _conexao_lote(conexao):
+    return Connection(conexao.server, user=conexao.user, password=conexao.password, authentication=conexao.authentication,
+                      client_strategy=ESTRATEGIA_LOTE, auto_bind=True)
+
+# Executa uma operação por item em pipeline: cada conexão do pool atende uma fatia dos itens
+# e mantém até JANELA_PIPELINE requisições pendentes antes de ler a resposta mais antiga
+# enviar(conexao, item) dispara a requisição e devolve o id da mensagem; devolve (respostas, resultado) de cada item
+def executar_em_pipeline(conexoes, itens, enviar):
+    resultados = [None] * len(itens)
+
+    def trabalhar(numero):
+        conexao = conexoes[numero]
+        pendentes = deque()
+
+        def receber():
+            posicao, mensagem = pendentes.popleft()
+            try:
+                resultados[posicao] = conexao.get_response(mensagem)
+            except LDAPException as e:
+                resultados[posicao] = (None, {'result': -1, 'description': str(e)})
+
+        for posicao in range(numero, len(itens), len(conexoes)):
+            try:
+                pendentes.append((posicao, enviar(conexao, itens[posicao])))
+            except LDAPException as e:
+                resultados[posicao] = (None, {'result': -1, 'description': str(e)})
+                continue
+            if len(pendentes) >= JANELA_PIPELINE:
+                receber()
+        while pendentes:
+            receber()
+
+    with ThreadPoolExecutor(max_workers=len(conexoes)) as executor:
+        list(executor.map(trabalhar, range(len(conexoes))))
+    return resultados
+
+# Relê pelo GUID as contas selecionadas no snapshot (com o mesmo filtro) e descarta as que deixaram de atender aos critérios
+def revalidar_itens(conexoes, itens, dias, incluir_vencidas):
+    agora = datetime.now()
+    filtro = filtro_inativas(agora - timedelta(days=dias), incluir_vencidas, agora)
+    respostas = executar_em_pipeline(conexoes, itens, lambda conexao, item: conexao.search(
+        f"<GUID={item['guid']}>", filtro, search_scope=BASE, attributes=ATRIBUTOS_DESATIVACAO))
+    validos = []
+    for item, (entradas, _) in zip(itens, respostas):
+        entradas = [entrada for entrada in entradas or [] if entrada.get('type') == 'searchResEntry']
+        if entradas:
+            validos.append(_item_desativacao(entradas[0], item['motivo']))
+    return validos
+
+# Nova linha do campo 'info' e novo DN (mesmo RDN dentro da OU de quarentena) de um item do plano
+def _destino_desativacao(item, quarentena, linha):
+    rdn = to_dn(item['dn'])[0]
+    info = (item['info'].strip() + "\r\n" + linha) if item['info'] else linha
+    return info, f"{rdn},{quarentena}"
+
+# Troca atômica do userAccountControl e do 'info': só grava se nenhum dos dois mudou desde a leitura
+def _mudanca_com_troca(anterior, novo):
+    if anterior is None:
+        return [(MODIFY_ADD, [novo])]
+    return [(MODIFY_DELETE, [anterior]), (MODIFY_ADD, [novo])]
+
+# Grava o arquivo de reversão do lote (substituição atômica, para nunca deixar um arquivo pela metade)
+def _gravar_lote_desativacao(caminho, conexao, chamado, quarentena, itens):
+    temporario = caminho + '.tmp'
+    with open(temporario, 'w', encoding='utf-8') as arquivo:
+        json.dump({'chamado': chamado, 'operador': conexao.user, 'quarentena': quarentena, 'itens': itens},
+                  arquivo, ensure_ascii=False, indent=1)
+    os.replace(temporario, caminho)
+
+# Aplica o plano em duas fases pelo pool: 1) desativa e registra no 'info'; 2) move para a quarentena
+# O arquivo de reversão é gravado antes da fase 1 (contas 'pendente') e atualizado após cada fase; se o lote
+# for interrompido, o estado conhecido é gravado no arquivo e no diário e as contas pendentes são tratadas na reversão
+def aplicar_desativacao(conexao, itens, quarentena, chamado):
+    linha = f"{datetime.today().strftime('%d/%m/%Y')} - Desativação por inatividade - {chamado}"
+    for item in itens:
+        item['info_novo'], item['dn_novo'] = _destino_desativacao(item, quarentena, linha)
+        item['uac_novo'] = item['uac'] | UAC_DESATIVADA
+        item['desativacao'] = 'pendente'
+
+    os.makedirs(PASTA_DESATIVACOES, exist_ok=True)
+    caminho = os.path.join(PASTA_DESATIVACOES, f"Desativacao_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    _gravar_lote_desativacao(caminho, conexao, chamado, quarentena, itens)
+
+    conexoes = []
+    desativados = []
+    try:
+        for _ in range(min(TAMANHO_POOL_DESATIVACAO, len(itens))):
+            conexoes.append(_conexao_lote(conexao))
+        inicio = datetime.now()
+        desativacoes = executar_em_pipeline(conexoes, itens, lambda c, item: c.modify(item['dn'], {
+            'userAccountControl': _mudanca_com_troca(str(item['uac']), str(item['uac_novo'])),
+            'info': _mudanca_com_troca(item['info'], item['info_novo']),
+        }))
+        for item, (_, resultado) in zip(itens, desativacoes):
+            item['desativacao'] = 'ok' if resultado['result'] == 0 else f"falha: {resultado['description']}"
+
+        desativados = [item for item in itens if item['desativacao'] == 'ok']
+        for item in desativados:
+            item['movimento'] = 'pendente'
+        _gravar_lote_desativacao(caminho, conexao, chamado, quarentena, itens)
+
+        movimentos = executar_em_pipeline(conexoes, desativados, lambda c, item: c.modify_dn(
+            item['dn'], to_dn(item['dn'])[0], new_superior=quarentena))
+        for item, (_, resultado) in zip(desativados, movimentos):
+            item['movimento'] = 'ok' if resultado['result'] == 0 else f"falha: {resultado['description']}"
+        duracao = (datetime.now() - inicio).total_seconds()
+    finally:
+        # Mesmo com o lote interrompido (Ctrl-C, falha de bind, erro inesperado), o estado conhecido é registrado
+        for conexao_lote in conexoes:
+            try:
+                conexao_lote.unbind()
+            except LDAPException:
+                pass
+        _gravar_lote_desativacao(caminho, conexao, chamado, quarentena, itens)
+        diario = get_diario()
+        agora = datetime.now().isoformat(timespec='seconds')
+        with diario:
+            diario.executemany(
+                "INSERT INTO acoes (data_hora, operador, dn, acao, chamado, valor_anterior, valor_novo, resultado) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(agora, conexao.user, item['dn'], "Desativação por inatividade", chamado, str(item['uac']), item['dn_novo'],
+                  item['desativacao'] if item['desativacao'] != 'ok' else
+                  'ok' if item.get('movimento') == 'ok' else f"desativada; movimento {item.get('movimento')}")
+                 for item in itens]
+            )
+
+    movidas = sum(1 for item in itens if item.get('movimento') == 'ok')
+    print(f"{len(desativados)} de {len(itens)} conta(s) desativada(s), {movidas} movida(s) para a quarentena em {duracao:.1f}s.")
+    for item in itens:
+        if item['desativacao'] != 'ok' or item.get('movimento') != 'ok':
+            print(f"  {item['login']}: desativação {item['desativacao']}; movimento {item.get('movimento', '-')}")
+    print(f"Dados para reversão salvos em: {caminho}")
+    return caminho
+
+# Desfaz um lote a partir do arquivo de reversão: devolve as contas à OU original e restaura o userAccountControl
+# (trocas atômicas sobre os valores gravados pelo lote; contas alteradas depois disso são apontadas como conflito)
+# Contas 'pendente' (lote interrompido) podem ou não ter sido alteradas: a reversão é tentada e, se a conta
+# não chegou a mudar, a troca atômica falha sem alterar nada
+def reverter_desativacao(conexao, caminho, chamado):
+    with open(caminho, encoding='utf-8') as arquivo:
+        lote = json.load(arquivo)
+    linha = f"{datetime.today().strftime('%d/%m/%Y')} - Reversão de desativação - {chamado}"
+    itens = [item for item in lote['itens'] if item['desativacao'] in ('ok', 'pendente')]
+    if not itens:
+        print("Nenhuma conta desse lote foi desativada.")
+        return
+
+    conexoes = []
+    try:
+        for _ in range(min(TAMANHO_POOL_DESATIVACAO, len(itens))):
+            conexoes.append(_conexao_lote(conexao))
+        movidos = [item for item in itens if item.get('movimento') in ('ok', 'pendente')]
+        retornos = executar_em_pipeline(conexoes, movidos, lambda c, item: c.modify_dn(
+            item['dn_novo'], to_dn(item['dn'])[0], new_superior=','.join(to_dn(item['dn'])[1:])))
+        for item, (_, resultado) in zip(movidos, retornos):
+            item['reversao_movimento'] = 'ok' if resultado['result'] == 0 else f"falha: {resultado['description']}"
+
+        # Contas que não voltaram à OU original são reativadas na quarentena mesmo; com o movimento pendente,
+        # noSuchObject indica que a conta nunca saiu da OU original, e nos demais casos ela é endereçada pelo GUID
+        def local(item):
+            if item.get('reversao_movimento', 'ok') == 'ok':
+                return item['dn']
+            if item['movimento'] == 'ok':
+                return item['dn_novo']
+            return item['dn'] if 'noSuchObject' in item['reversao_movimento'] else f"<GUID={item['guid']}>"
+        reativacoes = executar_em_pipeline(conexoes, itens, lambda c, item: c.modify(local(item), {
+            'userAccountControl': _mudanca_com_troca(str(item['uac_novo']), str(item['uac'])),
+            'info': _mudanca_com_troca(item['info_novo'], item['info_novo'].strip() + "\r\n" + linha),
+        }))
+        for item, (_, resultado) in zip(itens, reativacoes):
+            item['reversao'] = 'ok' if resultado['result'] == 0 else f"falha: {resultado['description']}"
+    finally:
+        for conexao_lote in conexoes:
+            conexao_lote.unbind()
+
+    diario = get_diario()
+    agora = datetime.now().isoformat(timespec='seconds')
+    with diario:
+        diario.executemany(
+            "INSERT INTO acoes (data_hora, operador, dn, acao, chamado, valor_anterior, valor_novo, resultado) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(agora, conexao.user, item['dn'], "Reversão de desativação", chamado, str(item['uac_novo']), str(item['uac']),
+              item['reversao'] if item.get('reversao_movimento', 'ok') == 'ok' else
+              f"{item['reversao']}; retorno à OU {item['reversao_movimento']}")
+             for item in itens]
+        )
+    revertidas = sum(1 for item in itens if item['reversao'] == 'ok')
+    print(f"{revertidas} de {len(itens)} conta(s) reativada(s).")
+    for item in itens:
+        if item['reversao'] != 'ok' or item.get('reversao_movimento', 'ok') != 'ok':
+            print(f"  {item['login']}: {item['reversao']}; retorno à OU {item.get('reversao_movimento', '-')}")
+
+# Seleciona as contas inativas (no AD ou no último snapshot), mostra o plano e, com confirmação, aplica o lote
+def desativar_contas_inativas(conexao):
+    try:
+        dias = int(input(f"Sem logon há quantos dias? [{DIAS_INATIVIDADE}]: ").strip() or DIAS_INATIVIDADE)
+    except ValueError:
+        print("Entrada inválida.")
+        return
+    incluir_vencidas = input("Incluir contas vencidas (accountExpires no passado)? (S/N) [S]: ").strip().upper() != 'N'
+    quarentena = OU_QUARENTENA or f"OU=Quarentena,{get_base_dn(conexao)}"
+
+    snapshots = sorted(nome for nome in os.listdir(PASTA_SNAPSHOTS) if nome.endswith('.jsonl.gz')) \
+        if os.path.isdir(PASTA_SNAPSHOTS) else []
+    origem = 'A'
+    if snapshots:
+        origem = input(f"Origem: 'A' para consultar o AD agora ou 'S' para o snapshot {snapshots[-1]} [A]: ").strip().upper() or 'A'
+
+    if origem == 'S':
+        itens = selecionar_inativas_snapshot(os.path.join(PASTA_SNAPSHOTS, snapshots[-1]), dias, incluir_vencidas)
+        print(f"{len(itens)} conta(s) no snapshot; revalidando no AD...")
+        if itens:
+            conexoes = [_conexao_lote(conexao) for _ in range(min(TAMANHO_POOL_DESATIVACAO, len(itens)))]
+            try:
+                itens = revalidar_itens(conexoes, itens, dias, incluir_vencidas)
+            finally:
+                for conexao_lote in conexoes:
+                    conexao_lote.unbind()
+    else:
+        itens = selecionar_inativas_ad(conexao, dias, incluir_vencidas)
+    itens = [item for item in itens if not item['dn'].lower().endswith(quarentena.lower())]
+    if not itens:
+        print("Nenhuma conta a desativar.")
+        return
+
+    # Simulação: o que muda em cada conta, sem gravar nada no AD
+    print(f"\nPlano de desativação ({len(itens)} conta(s)) - nada foi alterado ainda:")
+    linha = f"{datetime.today().strftime('%d/%m/%Y')} - Desativação por inatividade - <chamado>"
+    for item in itens:
+        _, dn_novo = _destino_desativacao(item, quarentena, linha)
+        print(f"- {item['nome']} ({item['login']}) | {item['motivo']} | último logon: {item['ultimo_logon']}")
+        print(f"    userAccountControl: {item['uac']} -> {item['uac'] | UAC_DESATIVADA}")
+        print(f"    info: + \"{linha}\"")
+        print(f"    DN: {item['dn']} -> {dn_novo}")
+
+    os.makedirs(PASTA_DESATIVACOES, exist_ok=True)
+    plano = os.path.join(PASTA_DESATIVACOES, f"Plano_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(plano, 'w', encoding='utf-8') as arquivo:
+        json.dump({'dias': dias, 'incluir_vencidas': incluir_vencidas, 'quarentena': quarentena, 'itens': itens},
+                  arquivo, ensure_ascii=False, indent=1)
+    print(f"\nPlano salvo em: {plano}")
+
+    if input("Digite 'APLICAR' para executar o plano (qualquer outra coisa cancela): ").strip() != 'APLICAR':
+        print("Nenhuma alteração feita.")
+        return
+    chamado = input("Informe o número do chamado para o lote: ").strip()
+    aplicar_desativacao(conexao, itens, quarentena, chamado)
+
+# Lista os lotes de desativação salvos e reverte o escolhido
+def reverter_lote_desativacao(conexao):
+    lotes = sorted(nome for nome in os.listdir(PASTA_DESATIVACOES) if nome.startswith('Desativacao_') and nome.endswith('.json')) \
+        if os.path.isdir(PASTA_DESATIVACOES) else []
+    if not lotes:
+        print("Nenhum lote de desativação salvo.")
+        return
+    for i, nome in enumerate(lotes, start=1):
+        print(f"{i}. {nome}")
+    try:
+        escolha = int(input("Selecione o número do lote para reverter: "))
+        if escolha < 1 or escolha > len(lotes):
+            print("Número inválido.")
+            return
+    except ValueError:
+        print("Entrada inválida.")
+        return
+    chamado = input("Informe o número do chamado da reversão: ").strip()
+    reverter_desativacao(conexao, os.path.join(PASTA_DESATIVACOES, lotes[escolha - 1]), chamado)
 
 def menu():
     conexao = get_conexao()
@@ -320,7 +1163,11 @@ def menu():
         print("3. Renovar conta de usuário")
         print("4. Contar membros dos grupos principais")
         print("5. Listar usuários ativos")
-        print("5. Sair")
+        print("6. Consultar diário de ações")
+        print("7. Contas a expirar / renovação em lote")
+        print("8. Desativar contas inativas em lote")
+        print("9. Reverter desativação em lote")
+        print("10. Sair")
 
         opcao = input("Escolha uma opção: ")
         if opcao == '1':
@@ -334,6 +1181,14 @@ def menu():
         elif opcao == '5':
             lista_usuarios_ativos(conexao)
         elif opcao == '6':
+            consultar_acoes(conexao)
+        elif opcao == '7':
+            fila_de_renovacao(conexao)
+        elif opcao == '8':
+            desativar_contas_inativas(conexao)
+        elif opcao == '9':
+            reverter_lote_desativacao(conexao)
+        elif opcao == '10':
             print("Encerrando...")
             break
         else:
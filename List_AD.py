@@ -1,15 +1,43 @@
 from datetime import datetime, timedelta
-from ldap3 import Server, Connection, NTLM, ALL, MODIFY_REPLACE, Tls
+from ldap3 import Server, Connection, NTLM, ALL, NONE, MODIFY_REPLACE, Tls, BASE, LEVEL, SUBTREE, ASYNC_STREAM
+from ldap3.core.exceptions import LDAPException
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import array
+import asyncio
+import base64
+import bisect
+import collections
+import contextlib
+import csv
+import functools
+import gzip
+import hashlib
+import heapq
+import io
+import json
+import pickle
+import queue
+import re
+import threading
+import time
+import unicodedata
+import urllib.parse
+import uuid
 import os
 import getpass
 import socket
+import sqlite3
 import ssl
 import sys
 import subprocess
+import tempfile
 
 # Tenta importar openpyxl e instala se necessário
 try:
     from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
     from openpyxl.styles import Font, PatternFill, Alignment
     OPENPYXL_DISPONIVEL = True
 except ImportError:
@@ -18,6 +46,7 @@ except ImportError:
     try:
         subprocess.check_call([sys.executable, "-m", "pip", "install", "openpyxl"])
         from openpyxl import Workbook
+        from openpyxl.cell import WriteOnlyCell
         from openpyxl.styles import Font, PatternFill, Alignment
         OPENPYXL_DISPONIVEL = True
         print("✓ Biblioteca openpyxl instalada com sucesso!")
@@ -60,6 +89,11 @@ def _testar_conectividade_rede(dominio_dns):
     
     return True
 
+# Número de partições (OUs) buscadas em paralelo; 1 mantém a busca sequencial original
+CONCORRENCIA_BUSCA = int(os.environ.get('AD_CONCORRENCIA', '1'))
+# Tempo máximo (segundos) de espera por uma resposta do servidor
+TEMPO_LIMITE_RECEBIMENTO = int(os.environ.get('AD_TIMEOUT', '10'))
+
 # Obtém a conexão com o Active Directory baseado no usuário logado
 def get_conexao():
     usuario = get_usuario_logado()
@@ -136,7 +170,7 @@ def _tentar_conexao(servidor, usuario_completo, config):
                 password=senha, 
                 authentication=NTLM, 
                 auto_bind=True,
-                receive_timeout=10
+                receive_timeout=TEMPO_LIMITE_RECEBIMENTO
             )
             
             # Verifica se precisa fazer StartTLS
@@ -174,393 +208,1428 @@ def _tentar_conexao(servidor, usuario_completo, config):
 def get_base_dn(conexao):
     return conexao.server.info.other['defaultNamingContext'][0]
 
-def gerar_contas_ativas(conexao):
-    """Gera relatório com todas as contas ativas"""
-    if not OPENPYXL_DISPONIVEL:
-        print("❌ ERRO: Biblioteca openpyxl não está disponível.")
-        return
-    
-    base_dn = get_base_dn(conexao)
-    print("\n📊 GERANDO RELATÓRIO - CONTAS ATIVAS")
-    
-    # Busca todos os usuários ativos
-    filtro = '(&(objectClass=user)(!(sAMAccountName=*$))(!(userAccountControl:1.2.840.113556.1.4.803:=2)))'
-    atributos = ['sAMAccountName', 'displayName', 'title', 'mail', 'whenCreated', 'lastLogon', 'lastLogonTimestamp']
+# ============================================================
+# ORDENAÇÃO POR CHAVE DE COLAÇÃO COM DESCARGA EM DISCO
+# ============================================================
+
+# Linhas mantidas em memória pela ordenação; acima disso, blocos ordenados vão para arquivos temporários
+LIMITE_ORDENACAO_MEMORIA = int(os.environ.get('AD_ORDENACAO_MEMORIA', '200000'))
+
+def _sem_acentos(texto):
+    """Minúsculas sem acentos e com espaços normalizados ('  José  Silva' == 'jose silva')"""
+    if texto.isascii():
+        return ' '.join(texto.lower().split())
+    decomposto = unicodedata.normalize('NFKD', texto.casefold())
+    return ' '.join(''.join(c for c in decomposto if not unicodedata.combining(c)).split())
+
+def chave_colacao(valor):
+    """Chave de ordenação sem acentos e maiúsculas ('Álvaro' junto de 'Alvaro'), desempatada pelo texto original; vazios no fim"""
+    if valor is None or valor == '':
+        return (1, '', '')
+    texto = str(valor)
+    return (0, _sem_acentos(texto), texto)
+
+def _descarregar_bloco(bloco):
+    """Ordena um bloco (chave, sequência, linha) e o grava em um arquivo temporário, pronto para leitura"""
+    bloco.sort()
+    arquivo = tempfile.TemporaryFile(prefix='ordenacao_')
+    for item in bloco:
+        pickle.dump(item, arquivo, protocol=pickle.HIGHEST_PROTOCOL)
+    arquivo.seek(0)
+    return arquivo
+
+def _ler_bloco(arquivo):
+    while True:
+        try:
+            yield pickle.load(arquivo)
+        except EOFError:
+            return
+
+def ordenar_linhas(linhas, chave, limite=None):
+    """
+    Ordena um fluxo de linhas pela chave, devolvendo-as em ordem como gerador.
+
+    Cada chave é calculada uma única vez e guardada junto da linha com um
+    número de sequência (ordenação estável, linhas nunca comparadas entre si).
+    Enquanto o fluxo couber em `limite` linhas tudo é ordenado em memória;
+    acima disso cada bloco cheio é ordenado e descarregado em disco, e a
+    saída é a intercalação (k-way merge) dos blocos.
+    """
+    limite = limite or LIMITE_ORDENACAO_MEMORIA
+    bloco = []
+    arquivos = []
+    try:
+        for sequencia, linha in enumerate(linhas):
+            bloco.append((chave(linha), sequencia, linha))
+            if len(bloco) >= limite:
+                arquivos.append(_descarregar_bloco(bloco))
+                bloco = []
+        bloco.sort()
+        if arquivos:
+            print(f"   ↕ Ordenação externa: {len(arquivos) + 1} blocos intercalados")
+        for _, _, linha in heapq.merge(*(_ler_bloco(arquivo) for arquivo in arquivos), bloco):
+            yield linha
+    finally:
+        for arquivo in arquivos:
+            arquivo.close()
+
+# ============================================================
+# ESPECIFICAÇÃO DECLARATIVA DE RELATÓRIOS
+# ============================================================
+
+# Filtro base de todos os relatórios de usuários (exclui contas de computador)
+FILTRO_USUARIOS = '(&(objectClass=user)(!(sAMAccountName=*$)))'
+
+# Valor máximo de accountExpires/lastLogon no AD (= nunca)
+FILETIME_NUNCA = 9223372036854775807
+
+# Tipo de cada atributo consultado, usado na conversão e na montagem de filtros LDAP
+TIPOS_ATRIBUTOS = {
+    'sAMAccountName': 'texto',
+    'displayName': 'texto',
+    'title': 'texto',
+    'mail': 'texto',
+    'userAccountControl': 'inteiro',
+    'whenCreated': 'data_generalizada',
+    'lastLogon': 'filetime',
+    'lastLogonTimestamp': 'filetime',
+    'accountExpires': 'filetime',
+    'objectGUID': 'guid',
+    'memberOf': 'lista',
+    'member': 'lista',
+    'objectClass': 'lista',
+    'isDeleted': 'booleano',
+    # Senhas: mantidos em ticks para as contas por coluna (0 = troca obrigatória, máximo = nunca expira)
+    'pwdLastSet': 'inteiro',
+    'msDS-UserPasswordExpiryTimeComputed': 'inteiro',
+    'servicePrincipalName': 'lista',
+}
+
+# Campos calculados a partir de outros atributos: nome -> (atributos de origem, função)
+CAMPOS_DERIVADOS = {
+    # lastLogon não é replicado entre DCs; lastLogonTimestamp é, mas com atraso de até 14 dias
+    'ultimoLogon': (
+        ['lastLogon', 'lastLogonTimestamp'],
+        lambda linha: max([d for d in (linha.get('lastLogon'), linha.get('lastLogonTimestamp')) if d], default=None)
+    ),
+}
+
+# Predicados reutilizáveis
+P_DESABILITADA = ('flag', 'userAccountControl', 0x0002)  # Flag ACCOUNTDISABLE
+P_ATIVA = ('nao', P_DESABILITADA)
+
+_EPOCA_FILETIME = datetime(1601, 1, 1)
+
+def filetime_para_datetime(ticks):
+    """Converte ticks do Windows (100ns desde 1601-01-01) em datetime; 0 e o valor máximo significam 'nunca'"""
+    if not ticks or ticks >= FILETIME_NUNCA:
+        return None
+    try:
+        data = _EPOCA_FILETIME + timedelta(microseconds=ticks // 10)
+    except OverflowError:
+        return None
+    if data.year in (1601, 9999):
+        return None
+    return data
+
+def datetime_para_filetime(data):
+    """Converte datetime em ticks do Windows (inverso de filetime_para_datetime)"""
+    return int((data - _EPOCA_FILETIME).total_seconds() * 10**7)
+
+def _formatar_data(data, padrao):
+    return data.strftime('%d/%m/%Y') if data else padrao
+
+# Decodificadores por tipo: recebem a lista de valores brutos (bytes, nunca vazia) de um atributo
+def _decodificar_texto(brutos):
+    return brutos[0].decode('utf-8')
+
+def _decodificar_inteiro(brutos):
+    return int(brutos[0])
+
+def _decodificar_filetime(brutos):
+    return filetime_para_datetime(int(brutos[0]))
+
+def _decodificar_data_generalizada(brutos):
+    # AAAAMMDDhhmmss.0Z, fatiado diretamente (bem mais rápido que strptime)
+    b = brutos[0]
+    return datetime(int(b[0:4]), int(b[4:6]), int(b[6:8]), int(b[8:10]), int(b[10:12]), int(b[12:14]))
+
+def _decodificar_guid(brutos):
+    bruto = brutos[0]
+    return '{' + str(uuid.UUID(bytes_le=bruto)) + '}' if len(bruto) == 16 else bruto.decode('utf-8')
+
+def _decodificar_lista(brutos):
+    return [bruto.decode('utf-8') for bruto in brutos]
+
+def _decodificar_booleano(brutos):
+    return brutos[0].upper() == b'TRUE'
+
+DECODIFICADORES = {
+    'texto': _decodificar_texto,
+    'inteiro': _decodificar_inteiro,
+    'filetime': _decodificar_filetime,
+    'data_generalizada': _decodificar_data_generalizada,
+    'guid': _decodificar_guid,
+    'lista': _decodificar_lista,
+    'booleano': _decodificar_booleano,
+}
+
+@functools.lru_cache(maxsize=64)
+def compilar_decodificador(atributos):
+    """Tabela (atributo, decodificador) pré-compilada para uma tupla de atributos"""
+    return tuple((atributo, DECODIFICADORES[TIPOS_ATRIBUTOS.get(atributo, 'texto')]) for atributo in atributos)
+
+def _converter_brutos(tipo, brutos):
+    """Converte os valores brutos (bytes) de um atributo no tipo Python correspondente"""
+    if not brutos:
+        return None
+    try:
+        return DECODIFICADORES[tipo](brutos)
+    except (ValueError, TypeError):
+        return None
+
+def _valor_atributo(entry, atributo):
+    """Lê um atributo de uma Entry do ldap3 já convertido para o tipo Python (None se ausente)"""
+    if atributo not in entry:
+        return None
+    return _converter_brutos(TIPOS_ATRIBUTOS.get(atributo, 'texto'), entry[atributo].raw_values)
+
+def decodificar_entrada(entry, atributos):
+    """Converte uma Entry do ldap3 em uma linha tipada contendo apenas os atributos pedidos"""
+    return {atributo: _valor_atributo(entry, atributo) for atributo in atributos}
+
+def decodificar_brutos(brutos, decodificador):
+    """Aplica uma tabela de compilar_decodificador aos raw_attributes de uma resposta"""
+    linha = {}
+    for atributo, decodificar in decodificador:
+        valores = brutos.get(atributo)
+        if valores:
+            try:
+                linha[atributo] = decodificar(valores)
+            except (ValueError, TypeError):
+                linha[atributo] = None
+        else:
+            linha[atributo] = None
+    return linha
+
+def decodificar_resposta(resposta, atributos):
+    """Converte uma resposta bruta do ldap3 (dict de conexao.response ou de notificação) em linha tipada"""
+    return decodificar_brutos(resposta.get('raw_attributes', {}), compilar_decodificador(tuple(atributos)))
+
+def valor_campo(linha, campo):
+    """Obtém o valor de um atributo ou de um campo derivado de uma linha tipada"""
+    if campo in CAMPOS_DERIVADOS:
+        return CAMPOS_DERIVADOS[campo][1](linha)
+    return linha.get(campo)
+
+# Colunas disponíveis para os relatórios: nome -> (atributos necessários, formatação)
+COLUNAS = {
+    'Login': (['sAMAccountName'], lambda l: l.get('sAMAccountName') or 'N/A'),
+    'Nome': (['displayName', 'sAMAccountName'], lambda l: l.get('displayName') or l.get('sAMAccountName') or 'N/A'),
+    'E-mail': (['mail'], lambda l: l.get('mail') or 'N/A'),
+    'Cargo': (['title'], lambda l: l.get('title') or 'Não informado'),
+    'Status': (['userAccountControl'], lambda l: 'Inativo' if (l.get('userAccountControl') or 0) & 0x0002 else 'Ativo'),
+    'Data de Criação': (['whenCreated'], lambda l: _formatar_data(l.get('whenCreated'), 'N/A')),
+    'Último Logon': (['lastLogon'], lambda l: _formatar_data(l.get('lastLogon'), 'Nunca')),
+    'Último Logon (consolidado)': (['lastLogon', 'lastLogonTimestamp'], lambda l: _formatar_data(valor_campo(l, 'ultimoLogon'), 'Nunca')),
+    'Data de Expiração': (['accountExpires'], lambda l: _formatar_data(l.get('accountExpires'), 'Nunca expira')),
+}
+
+def _expandir_campo(campo):
+    return CAMPOS_DERIVADOS[campo][0] if campo in CAMPOS_DERIVADOS else [campo]
+
+def campos_predicado(predicado):
+    """Lista os atributos LDAP lidos por um predicado"""
+    operador = predicado[0]
+    if operador in ('e', 'ou'):
+        return [campo for sub in predicado[1:] for campo in campos_predicado(sub)]
+    if operador == 'nao':
+        return campos_predicado(predicado[1])
+    return _expandir_campo(predicado[1])
+
+def avaliar_predicado(predicado, linha):
+    """
+    Avalia um predicado declarativo sobre uma linha tipada. Operadores:
+      ('flag', campo, bits)            todos os bits ligados
+      ('existe', campo)                campo preenchido
+      ('entre', campo, inicio, fim)    inicio <= valor < fim (None = sem limite)
+      ('e', p1, p2, ...) / ('ou', p1, p2, ...) / ('nao', p)
+    """
+    operador = predicado[0]
+    if operador == 'e':
+        return all(avaliar_predicado(sub, linha) for sub in predicado[1:])
+    if operador == 'ou':
+        return any(avaliar_predicado(sub, linha) for sub in predicado[1:])
+    if operador == 'nao':
+        return not avaliar_predicado(predicado[1], linha)
     
-    dados_usuarios = buscar_usuarios_com_paginacao(conexao, base_dn, filtro, atributos)
+    valor = valor_campo(linha, predicado[1])
+    if operador == 'flag':
+        return ((valor or 0) & predicado[2]) == predicado[2]
+    if operador == 'existe':
+        return valor is not None and valor != ''
+    if operador == 'entre':
+        inicio, fim = predicado[2], predicado[3]
+        return valor is not None and (inicio is None or valor >= inicio) and (fim is None or valor < fim)
+    raise ValueError(f"Operador de predicado desconhecido: {operador}")
+
+def _valor_filtro_ldap(atributo, data):
+    """Formata uma data no formato de comparação do atributo (GeneralizedTime ou ticks)"""
+    if TIPOS_ATRIBUTOS.get(atributo) == 'data_generalizada':
+        return data.strftime('%Y%m%d%H%M%S.0Z')
+    return str(datetime_para_filetime(data))
+
+def _juntar_filtros(operador, filtros):
+    if len(filtros) == 1:
+        return filtros[0]
+    return f"({operador}{''.join(filtros)})"
+
+def _filtro_entre(predicado):
+    # Campos derivados são o maior valor entre os atributos de origem
+    atributos = _expandir_campo(predicado[1])
+    inicio, fim = predicado[2], predicado[3]
+    partes = []
+    if inicio is not None:
+        partes.append(_juntar_filtros('|', [f"({a}>={_valor_filtro_ldap(a, inicio)})" for a in atributos]))
+    if fim is not None:
+        partes.append(_juntar_filtros('&', [f"(!({a}>={_valor_filtro_ldap(a, fim)}))" for a in atributos]))
+    return _juntar_filtros('&', partes) if partes else None
+
+def empurrar_predicado(predicado):
+    """
+    Separa um predicado na parte que o servidor avalia (filtro LDAP) e no
+    resíduo que precisa ser avaliado localmente. O filtro é sempre uma
+    condição necessária; quando ele é exato o resíduo é None e os atributos
+    do predicado nem precisam ser buscados.
+    """
+    operador = predicado[0]
+    if operador == 'e':
+        filtros, residuos = [], []
+        for sub in predicado[1:]:
+            filtro, residuo = empurrar_predicado(sub)
+            if filtro:
+                filtros.append(filtro)
+            if residuo:
+                residuos.append(residuo)
+        filtro = _juntar_filtros('&', filtros) if filtros else None
+        if not residuos:
+            return filtro, None
+        return filtro, residuos[0] if len(residuos) == 1 else ('e',) + tuple(residuos)
+    if operador == 'ou':
+        partes = [empurrar_predicado(sub) for sub in predicado[1:]]
+        if any(filtro is None for filtro, _ in partes):
+            return None, predicado
+        filtro = _juntar_filtros('|', [filtro for filtro, _ in partes])
+        return filtro, None if all(residuo is None for _, residuo in partes) else predicado
+    if operador == 'nao':
+        # Só a negação de flags é exata; as demais dependem de atributos ausentes
+        if predicado[1][0] == 'flag':
+            return f"(!{empurrar_predicado(predicado[1])[0]})", None
+        return None, predicado
+    if operador == 'flag':
+        return f"({predicado[1]}:1.2.840.113556.1.4.803:={predicado[2]})", None
+    if operador == 'existe':
+        return _juntar_filtros('|', [f"({a}=*)" for a in _expandir_campo(predicado[1])]), None
+    if operador == 'entre':
+        # Sem limite inferior o filtro também traz contas sem o atributo
+        return _filtro_entre(predicado), None if predicado[2] is not None else predicado
+    return None, predicado
+
+def _colunas_especificacao(especificacao):
+    """Resolve as colunas da especificação: título -> (atributos, formatação)"""
+    resolvidas = {}
+    formatadores = especificacao.get('formatadores', {})
+    fixos = especificacao.get('fixos', {})
+    for coluna in especificacao['colunas']:
+        if coluna in fixos:
+            resolvidas[coluna] = ([], lambda l, valor=fixos[coluna]: valor)
+        elif coluna in formatadores:
+            resolvidas[coluna] = formatadores[coluna]
+        else:
+            resolvidas[coluna] = COLUNAS[coluna]
+    return resolvidas
+
+def atributos_relatorio(especificacao):
+    """Todos os atributos que a especificação lê localmente (colunas + predicado completo)"""
+    atributos = set()
+    for campos, _ in _colunas_especificacao(especificacao).values():
+        atributos.update(campos)
+    if especificacao.get('incluir'):
+        atributos.update(campos_predicado(especificacao['incluir']))
+    return sorted(atributos)
+
+def planejar_relatorio(especificacao):
+    """
+    Deriva da especificação o filtro LDAP, o conjunto mínimo de atributos
+    (colunas emitidas + campos do resíduo do predicado) e o resíduo que
+    ainda precisa ser avaliado localmente.
+    """
+    atributos = set()
+    for campos, _ in _colunas_especificacao(especificacao).values():
+        atributos.update(campos)
     
-    if not dados_usuarios:
-        print("❌ Nenhuma conta ativa encontrada.")
-        return
+    filtros = [especificacao.get('filtro_base', FILTRO_USUARIOS)]
+    residuo = None
+    if especificacao.get('incluir'):
+        filtro_predicado, residuo = empurrar_predicado(especificacao['incluir'])
+        if filtro_predicado:
+            filtros.append(filtro_predicado)
+        if residuo:
+            atributos.update(campos_predicado(residuo))
     
-    # Processa os dados
-    usuarios_processados = []
-    for entry in dados_usuarios:
-        login = entry.sAMAccountName.value if hasattr(entry, 'sAMAccountName') and entry.sAMAccountName.value else 'N/A'
-        nome = entry.displayName.value if hasattr(entry, 'displayName') and entry.displayName.value else login
-        cargo = entry.title.value if hasattr(entry, 'title') and entry.title.value else 'Não informado'
-        email = entry.mail.value if hasattr(entry, 'mail') and entry.mail.value else 'N/A'
-        
-        # Data de criação
-        data_criacao = 'N/A'
-        if hasattr(entry, 'whenCreated') and entry.whenCreated.value:
-            try:
-                created_dt = entry.whenCreated.value.replace(tzinfo=None)
-                data_criacao = created_dt.strftime('%d/%m/%Y')
-            except:
-                data_criacao = 'Erro ao converter'
-        
-        # Data de último logon
-        data_ultimo_logon = 'Nunca'
-        if hasattr(entry, 'lastLogon') and entry.lastLogon.value:
-            try:
-                logon_dt = entry.lastLogon.value.replace(tzinfo=None)
-                data_ultimo_logon = logon_dt.strftime('%d/%m/%Y')
-            except:
-                pass
-        
-        usuarios_processados.append({
-            'Login': login,
-            'Nome': nome,
-            'E-mail': email,
-            'Cargo': cargo,
-            'Status': 'Ativo',
-            'Data de Criação': data_criacao,
-            'Último Logon': data_ultimo_logon
-        })
+    filtro = _juntar_filtros('&', filtros) if len(filtros) > 1 else filtros[0]
+    return filtro, sorted(atributos), residuo
+
+def iterar_linhas_relatorio(especificacao, linhas):
+    """Aplica o predicado de inclusão, formata as colunas e ordena, como fluxo (linhas pode ser um gerador)"""
+    colunas = _colunas_especificacao(especificacao)
+    predicado = especificacao.get('incluir')
     
-    # Ordena por nome
-    usuarios_processados.sort(key=lambda x: x['Nome'] or 'ZZZ')
+    def _formatadas():
+        for linha in linhas:
+            if predicado and not avaliar_predicado(predicado, linha):
+                continue
+            yield {titulo: formatar(linha) for titulo, (_, formatar) in colunas.items()}
     
-    # Gera a planilha
-    nome_arquivo = f"Contas_Ativas_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    colunas = ['Login', 'Nome', 'E-mail', 'Cargo', 'Status', 'Data de Criação', 'Último Logon']
-    gerar_planilha(usuarios_processados, nome_arquivo, "CONTAS ATIVAS", colunas)
+    ordenar = especificacao.get('ordenar')
+    if ordenar:
+        return ordenar_linhas(_formatadas(), lambda x: chave_colacao(x[ordenar]))
+    return _formatadas()
 
-def gerar_contas_desabilitadas_desde_abril(conexao):
-    """Gera relatório com contas desabilitadas a partir de 01/04/2024"""
+def montar_linhas_relatorio(especificacao, linhas):
+    """Aplica o predicado de inclusão, formata as colunas e ordena as linhas tipadas"""
+    return list(iterar_linhas_relatorio(especificacao, linhas))
+
+def gerar_relatorio(conexao, especificacao):
+    """
+    Busca, filtra e exporta para Excel o relatório descrito pela especificação.
+    Se o arquivo em cache ainda vale, devolve o caminho dele em vez das linhas.
+    """
     if not OPENPYXL_DISPONIVEL:
         print("❌ ERRO: Biblioteca openpyxl não está disponível.")
         return
     
     base_dn = get_base_dn(conexao)
-    print("\n📊 GERANDO RELATÓRIO - CONTAS DESABILITADAS A PARTIR DE 01/04/2024")
+    print(f"\n📊 GERANDO RELATÓRIO - {especificacao['titulo']}")
     
-    data_corte = datetime(2024, 4, 1)
+    filtro, atributos, residuo = planejar_relatorio(especificacao)
     
-    # Busca todos os usuários desabilitados
-    filtro = '(&(objectClass=user)(!(sAMAccountName=*$))(userAccountControl:1.2.840.113556.1.4.803:=2))'
-    atributos = ['sAMAccountName', 'displayName', 'title', 'mail', 'whenCreated', 'lastLogon', 'lastLogonTimestamp', 'accountExpires']
+    # Mesma definição e nenhum usuário alterado no AD desde a última geração: reaproveita o arquivo.
+    # Na floresta o USN de um DC não cobre os outros domínios, então não há cache
+    chave = versao = None
+    if not MODO_FLORESTA:
+        chave = chave_relatorio(conexao, base_dn, especificacao, filtro, atributos)
+        filtro_base = especificacao.get('filtro_base', FILTRO_USUARIOS)
+        arquivo_cache = consultar_cache_relatorio(conexao, base_dn, chave, filtro_base)
+        if arquivo_cache:
+            print(f"♻ Nenhuma mudança no AD desde a última geração; reaproveitando {arquivo_cache}")
+            try:
+                os.startfile(arquivo_cache)
+                print("✓ Arquivo aberto")
+            except Exception as e:
+                print(f"❌ Erro ao abrir planilha: {e}")
+            return arquivo_cache
+        versao = versao_diretorio(conexao)
     
-    dados_usuarios = buscar_usuarios_com_paginacao(conexao, base_dn, filtro, atributos)
+    # O servidor já aplicou o filtro; localmente só resta avaliar o resíduo do predicado.
+    # As páginas são decodificadas à medida que chegam: só as linhas formatadas ficam em memória
+    recebidos = [0]
+    def _linhas():
+        for pagina in paginas_usuarios(conexao, base_dn, filtro, atributos):
+            recebidos[0] += len(pagina)
+            for resposta in pagina:
+                yield decodificar_resposta(resposta, atributos)
+    usuarios_processados = montar_linhas_relatorio(dict(especificacao, incluir=residuo), _linhas())
+    if not (MODO_FLORESTA or CONCORRENCIA_BUSCA > 1):  # nesses modos a busca já informa o total
+        print(f"✅ Total de {especificacao.get('objetos', 'usuários')} encontrados: {recebidos[0]}")
     
-    if not dados_usuarios:
-        print("❌ Nenhuma conta desabilitada encontrada.")
+    if not usuarios_processados:
+        print(f"❌ {especificacao.get('vazio', 'Nenhum usuário encontrado.')}")
         return
     
-    # Processa os dados e aplica filtro de data
-    usuarios_processados = []
-    for entry in dados_usuarios:
-        # Verifica se foi desabilitado a partir de abril/2024
-        # (Para isso, vamos usar a lógica de que deve ter tido logon em 2024)
-        data_ultimo_logon = None
-        
-        if hasattr(entry, 'lastLogon') and entry.lastLogon.value:
-            try:
-                data_ultimo_logon = entry.lastLogon.value.replace(tzinfo=None)
-            except:
-                pass
-        
-        if hasattr(entry, 'lastLogonTimestamp') and entry.lastLogonTimestamp.value:
-            try:
-                logon_timestamp = entry.lastLogonTimestamp.value.replace(tzinfo=None)
-                if data_ultimo_logon:
-                    data_ultimo_logon = max(data_ultimo_logon, logon_timestamp)
-                else:
-                    data_ultimo_logon = logon_timestamp
-            except:
-                pass
-        
-        # Só inclui se teve logon a partir de abril/2024
-        if data_ultimo_logon and data_ultimo_logon >= data_corte:
-            login = entry.sAMAccountName.value if hasattr(entry, 'sAMAccountName') and entry.sAMAccountName.value else 'N/A'
-            nome = entry.displayName.value if hasattr(entry, 'displayName') and entry.displayName.value else login
-            cargo = entry.title.value if hasattr(entry, 'title') and entry.title.value else 'Não informado'
-            email = entry.mail.value if hasattr(entry, 'mail') and entry.mail.value else 'N/A'
-            
-            # Data de criação
-            data_criacao = 'N/A'
-            if hasattr(entry, 'whenCreated') and entry.whenCreated.value:
-                try:
-                    created_dt = entry.whenCreated.value.replace(tzinfo=None)
-                    data_criacao = created_dt.strftime('%d/%m/%Y')
-                except:
-                    data_criacao = 'Erro ao converter'
-            
-            usuarios_processados.append({
-                'Login': login,
-                'Nome': nome,
-                'E-mail': email,
-                'Cargo': cargo,
-                'Status': 'Inativo',
-                'Data de Criação': data_criacao,
-                'Último Logon': data_ultimo_logon.strftime('%d/%m/%Y')
-            })
-    
-    # Ordena por nome
-    usuarios_processados.sort(key=lambda x: x['Nome'] or 'ZZZ')
-    
     # Gera a planilha
-    nome_arquivo = f"Contas_Desabilitadas_Desde_Abril_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    colunas = ['Login', 'Nome', 'E-mail', 'Cargo', 'Status', 'Data de Criação', 'Último Logon']
-    gerar_planilha(usuarios_processados, nome_arquivo, "CONTAS DESABILITADAS A PARTIR DE 01/04/2024", colunas)
+    nome_arquivo = f"{especificacao['arquivo']}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    if versao:
+        os.makedirs(PASTA_RELATORIOS, exist_ok=True)
+        nome_arquivo = os.path.join(PASTA_RELATORIOS, nome_arquivo)
+    gerar_planilha(usuarios_processados, nome_arquivo, especificacao['titulo'], especificacao['colunas'])
+    if versao and os.path.exists(nome_arquivo):
+        registrar_cache_relatorio(chave, nome_arquivo, versao)
+    return usuarios_processados
+
+COLUNAS_PADRAO = ['Login', 'Nome', 'E-mail', 'Cargo', 'Status', 'Data de Criação', 'Último Logon']
+
+RELATORIOS = {
+    'contas_ativas': {
+        'titulo': 'CONTAS ATIVAS',
+        'arquivo': 'Contas_Ativas',
+        'colunas': COLUNAS_PADRAO,
+        'fixos': {'Status': 'Ativo'},
+        'incluir': P_ATIVA,
+        'ordenar': 'Nome',
+        'vazio': 'Nenhuma conta ativa encontrada.',
+    },
+    # Sem data de desativação no AD, considera desabilitadas as contas com logon a partir de abril/2024
+    'desabilitadas_desde_abril': {
+        'titulo': 'CONTAS DESABILITADAS A PARTIR DE 01/04/2024',
+        'arquivo': 'Contas_Desabilitadas_Desde_Abril',
+        'colunas': COLUNAS_PADRAO,
+        'fixos': {'Status': 'Inativo'},
+        'formatadores': {'Último Logon': COLUNAS['Último Logon (consolidado)']},
+        'incluir': ('e', P_DESABILITADA, ('entre', 'ultimoLogon', datetime(2024, 4, 1), None)),
+        'ordenar': 'Nome',
+        'vazio': 'Nenhuma conta desabilitada encontrada.',
+    },
+    'criadas_em_2024': {
+        'titulo': 'CONTAS CRIADAS EM 2024',
+        'arquivo': 'Contas_Criadas_2024',
+        'colunas': COLUNAS_PADRAO,
+        'incluir': ('entre', 'whenCreated', datetime(2024, 1, 1), datetime(2025, 1, 1)),
+        'ordenar': 'Nome',
+        'vazio': 'Nenhum usuário encontrado.',
+    },
+    'desabilitadas_em_2024': {
+        'titulo': 'CONTAS DESABILITADAS EM 2024',
+        'arquivo': 'Contas_Desabilitadas_2024',
+        'colunas': COLUNAS_PADRAO,
+        'fixos': {'Status': 'Inativo'},
+        'formatadores': {'Último Logon': COLUNAS['Último Logon (consolidado)']},
+        'incluir': ('e', P_DESABILITADA, ('entre', 'ultimoLogon', datetime(2024, 1, 1), datetime(2025, 1, 1))),
+        'ordenar': 'Nome',
+        'vazio': 'Nenhuma conta desabilitada encontrada.',
+    },
+    'relacao_emails': {
+        'titulo': 'RELAÇÃO DE E-MAILS',
+        'arquivo': 'Relacao_Emails',
+        'colunas': ['Nome', 'E-mail', 'Cargo'],
+        'incluir': ('existe', 'mail'),
+        'ordenar': 'Nome',
+        'vazio': 'Nenhum usuário com e-mail encontrado.',
+    },
+}
+
+def gerar_contas_ativas(conexao):
+    """Gera relatório com todas as contas ativas"""
+    return gerar_relatorio(conexao, RELATORIOS['contas_ativas'])
+
+def gerar_contas_desabilitadas_desde_abril(conexao):
+    """Gera relatório com contas desabilitadas a partir de 01/04/2024"""
+    return gerar_relatorio(conexao, RELATORIOS['desabilitadas_desde_abril'])
 
 def gerar_contas_criadas_em_2024(conexao):
     """Gera relatório com contas criadas somente em 2024"""
-    if not OPENPYXL_DISPONIVEL:
-        print("❌ ERRO: Biblioteca openpyxl não está disponível.")
-        return
-    
-    base_dn = get_base_dn(conexao)
-    print("\n📊 GERANDO RELATÓRIO - CONTAS CRIADAS EM 2024")
-    
-    data_inicio_2024 = datetime(2024, 1, 1)
-    data_fim_2024 = datetime(2025, 1, 1)
-    
-    # Busca todos os usuários
-    filtro = '(&(objectClass=user)(!(sAMAccountName=*$)))'
-    atributos = ['sAMAccountName', 'displayName', 'title', 'mail', 'whenCreated', 'userAccountControl', 'lastLogon', 'lastLogonTimestamp']
-    
-    dados_usuarios = buscar_usuarios_com_paginacao(conexao, base_dn, filtro, atributos)
+    return gerar_relatorio(conexao, RELATORIOS['criadas_em_2024'])
+
+def gerar_contas_desabilitadas_em_2024(conexao):
+    """Gera relatório com contas desabilitadas somente em 2024"""
+    return gerar_relatorio(conexao, RELATORIOS['desabilitadas_em_2024'])
+
+def gerar_relacao_emails(conexao):
+    """Gera relatório com todos os e-mails: Nome, E-mail e Cargo"""
+    return gerar_relatorio(conexao, RELATORIOS['relacao_emails'])
+
+# ============================================================
+# INVENTÁRIO DE COMPUTADORES E CONTAS DE SERVIÇO
+# ============================================================
+
+# objectCategory é indexado no AD; gMSAs também têm objectClass=computer, mas outra categoria
+FILTRO_COMPUTADORES = '(objectCategory=computer)'
+# Contas gerenciadas (gMSA e sMSA) e contas de usuário com SPN (contas de serviço "clássicas")
+FILTRO_CONTAS_SERVICO = ('(|(objectCategory=msDS-GroupManagedServiceAccount)(objectCategory=msDS-ManagedServiceAccount)'
+                         '(&(objectCategory=person)(objectClass=user)(servicePrincipalName=*)))')
+DIAS_COMPUTADOR_INATIVO = 90
+
+UAC_DELEGACAO_IRRESTRITA = 0x80000  # TRUSTED_FOR_DELEGATION
+UAC_SENHA_NUNCA_EXPIRA = 0x10000    # DONT_EXPIRE_PASSWORD
+
+def _unidade_organizacional(dn):
+    """DN do contêiner de um objeto (tudo após o primeiro RDN)"""
+    return re.split(r'(?<!\\),', dn, maxsplit=1)[-1] if dn else 'N/A'
+
+def _tipo_conta_servico(classes):
+    classes = {classe.lower() for classe in classes or []}
+    if 'msds-groupmanagedserviceaccount' in classes:
+        return 'gMSA'
+    if 'msds-managedserviceaccount' in classes:
+        return 'sMSA'
+    return 'Usuário com SPN'
+
+COLUNAS.update({
+    'Computador': (['sAMAccountName'], lambda l: (l.get('sAMAccountName') or 'N/A').rstrip('$')),
+    'Nome DNS': (['dNSHostName'], lambda l: l.get('dNSHostName') or 'N/A'),
+    'Sistema Operacional': (['operatingSystem'], lambda l: l.get('operatingSystem') or 'Não informado'),
+    'Versão do SO': (['operatingSystemVersion'], lambda l: l.get('operatingSystemVersion') or 'N/A'),
+    'Último Logon (replicado)': (['lastLogonTimestamp'], lambda l: _formatar_data(l.get('lastLogonTimestamp'), 'Nunca')),
+    'Senha Definida em': (['pwdLastSet'], lambda l: _formatar_data(filetime_para_datetime(l.get('pwdLastSet')), 'Nunca')),
+    'Local (OU)': (['distinguishedName'], lambda l: _unidade_organizacional(l.get('distinguishedName'))),
+    'Tipo de Conta': (['objectClass'], lambda l: _tipo_conta_servico(l.get('objectClass'))),
+    'SPNs': (['servicePrincipalName'], lambda l: '; '.join(l.get('servicePrincipalName') or []) or 'Nenhum'),
+    'Senha Nunca Expira': (['userAccountControl'], lambda l: 'Sim' if (l.get('userAccountControl') or 0) & UAC_SENHA_NUNCA_EXPIRA else 'Não'),
+    'Delegação Irrestrita': (['userAccountControl'], lambda l: 'Sim' if (l.get('userAccountControl') or 0) & UAC_DELEGACAO_IRRESTRITA else 'Não'),
+})
+
+COLUNAS_COMPUTADORES = ['Computador', 'Nome DNS', 'Sistema Operacional', 'Versão do SO', 'Status',
+                        'Último Logon (replicado)', 'Senha Definida em', 'Data de Criação', 'Local (OU)']
+
+# Relatórios de objetos que não são usuários; ficam fora de RELATORIOS porque o espelho e o serviço só têm usuários
+RELATORIOS_OBJETOS = {
+    'computadores': {
+        'titulo': 'INVENTÁRIO DE COMPUTADORES',
+        'arquivo': 'Inventario_Computadores',
+        'filtro_base': FILTRO_COMPUTADORES,
+        'colunas': COLUNAS_COMPUTADORES,
+        'ordenar': 'Computador',
+        'objetos': 'computadores',
+        'vazio': 'Nenhum computador encontrado.',
+    },
+    'contas_servico': {
+        'titulo': 'CONTAS DE SERVIÇO (gMSA, sMSA E USUÁRIOS COM SPN)',
+        'arquivo': 'Contas_Servico',
+        'filtro_base': FILTRO_CONTAS_SERVICO,
+        'colunas': ['Login', 'Nome', 'Tipo de Conta', 'Status', 'SPNs', 'Senha Definida em', 'Senha Nunca Expira',
+                    'Delegação Irrestrita', 'Último Logon (replicado)', 'Data de Criação', 'Local (OU)'],
+        'ordenar': 'Login',
+        'objetos': 'contas de serviço',
+        'vazio': 'Nenhuma conta de serviço encontrada.',
+    },
+}
+
+def especificacao_computadores_inativos(dias=DIAS_COMPUTADOR_INATIVO):
+    """
+    Computadores habilitados sem logon há `dias` dias, com todo o critério avaliado no servidor.
+    Máquinas que nunca fizeram logon (sem lastLogonTimestamp) também contam, desde que criadas antes
+    do corte; por isso o corte vai no filtro base em vez de um predicado 'entre', que exige o atributo.
+    O corte é arredondado para o dia, mantendo a mesma chave no cache de relatórios ao longo do dia.
+    """
+    corte = datetime.combine(datetime.now().date() - timedelta(days=dias), datetime.min.time())
+    filtro = (f"(&{FILTRO_COMPUTADORES}(!(lastLogonTimestamp>={_valor_filtro_ldap('lastLogonTimestamp', corte)}))"
+              f"(!(whenCreated>={_valor_filtro_ldap('whenCreated', corte)})))")
+    return dict(RELATORIOS_OBJETOS['computadores'],
+                titulo=f'COMPUTADORES SEM LOGON HÁ {dias} DIAS',
+                arquivo='Computadores_Inativos',
+                filtro_base=filtro,
+                fixos={'Status': 'Ativo'},
+                incluir=P_ATIVA,
+                vazio='Nenhum computador inativo encontrado.')
+
+def gerar_inventario_computadores(conexao, dias=None):
+    """Inventário de computadores; com `dias`, só as máquinas habilitadas sem logon nesse período"""
+    if dias:
+        return gerar_relatorio(conexao, especificacao_computadores_inativos(dias))
+    return gerar_relatorio(conexao, RELATORIOS_OBJETOS['computadores'])
+
+def gerar_contas_servico(conexao):
+    """Gera relatório das contas de serviço: gMSA, sMSA e contas de usuário com SPN"""
+    return gerar_relatorio(conexao, RELATORIOS_OBJETOS['contas_servico'])
+
+# ============================================================
+# CACHE DE RELATÓRIOS (DEFINIÇÃO + VERSÃO DO DIRETÓRIO)
+# ============================================================
+
+PASTA_RELATORIOS = 'relatorios'
+ARQUIVO_CACHE_RELATORIOS = os.path.join(PASTA_RELATORIOS, 'cache.json')
+
+# Limites da pasta de relatórios em cache: tamanho total e idade máxima de cada arquivo
+CACHE_RELATORIOS = {
+    'tamanho_maximo': int(os.environ.get('AD_CACHE_MB', '200')) * 1024 * 1024,
+    'idade_maxima': timedelta(days=int(os.environ.get('AD_CACHE_DIAS', '7'))),
+}
+
+def _canonico(valor):
+    """Forma serializável e estável de uma especificação (funções entram pelo nome e pelo bytecode)"""
+    if isinstance(valor, datetime):
+        return valor.isoformat()
+    if callable(valor):
+        codigo = getattr(valor, '__code__', None)
+        resumo = hashlib.sha256(codigo.co_code + repr(codigo.co_consts).encode('utf-8')).hexdigest()[:16] if codigo else ''
+        return f"{getattr(valor, '__qualname__', repr(valor))}:{resumo}"
+    raise TypeError(f"Valor não serializável na especificação: {valor!r}")
+
+def chave_relatorio(conexao, base_dn, especificacao, filtro, atributos):
+    """Hash da definição do relatório e do que a busca realmente pede ao servidor"""
+    definicao = json.dumps({
+        'especificacao': especificacao,
+        'filtro': filtro,
+        'atributos': atributos,
+        'servidor': conexao.server.host,
+        'base': base_dn,
+    }, sort_keys=True, default=_canonico, ensure_ascii=False)
+    return hashlib.sha256(definicao.encode('utf-8')).hexdigest()
+
+def versao_diretorio(conexao):
+    """(DC, highestCommittedUSN) do DC atual; USNs só são comparáveis dentro do mesmo DC"""
+    try:
+        with _sem_formatacao(conexao):
+            conexao.search('', '(objectClass=*)', BASE, attributes=['highestCommittedUSN', 'dsServiceName'])
+        raiz = conexao.response[0]['raw_attributes'] if conexao.response else {}
+        return raiz['dsServiceName'][0].decode('utf-8'), int(raiz['highestCommittedUSN'][0])
+    except (LDAPException, KeyError, IndexError, ValueError):
+        return None
+
+def _usuarios_alterados_desde(conexao, base_dn, filtro_base, usn):
+    """Há algum usuário criado, alterado ou excluído depois do USN? Uma busca limitada a uma resposta"""
+    try:
+        conexao.search(base_dn, f"(&{filtro_base}(uSNChanged>={usn + 1}))", SUBTREE, attributes=['1.1'],
+                       size_limit=1, controls=[(OID_MOSTRAR_EXCLUIDOS, False, None)])
+    except LDAPException:
+        return True
+    return any(resposta.get('type') == 'searchResEntry' for resposta in conexao.response or [])
+
+def _ler_cache_relatorios():
+    if not os.path.exists(ARQUIVO_CACHE_RELATORIOS):
+        return {}
+    try:
+        with open(ARQUIVO_CACHE_RELATORIOS, encoding='utf-8') as arquivo:
+            return json.load(arquivo)
+    except (OSError, ValueError):
+        return {}
+
+def _gravar_cache_relatorios(cache):
+    os.makedirs(PASTA_RELATORIOS, exist_ok=True)
+    temporario = ARQUIVO_CACHE_RELATORIOS + '.tmp'
+    with open(temporario, 'w', encoding='utf-8') as arquivo:
+        json.dump(cache, arquivo, indent=1)
+    os.replace(temporario, ARQUIVO_CACHE_RELATORIOS)
+
+def _remover_arquivo_cache(entrada):
+    try:
+        os.remove(entrada['arquivo'])
+    except OSError:
+        pass
+
+def consultar_cache_relatorio(conexao, base_dn, chave, filtro_base):
+    """Arquivo já gerado para a mesma definição, se nenhum usuário mudou no AD desde então"""
+    cache = _ler_cache_relatorios()
+    entrada = cache.get(chave)
+    if not entrada or not os.path.exists(entrada['arquivo']):
+        return None
+    versao = versao_diretorio(conexao)
+    if versao is None or versao[0] != entrada['dc'] or _usuarios_alterados_desde(conexao, base_dn, filtro_base, entrada['usn']):
+        return None
+    entrada['acessado_em'] = datetime.now().isoformat()
+    _gravar_cache_relatorios(cache)
+    return entrada['arquivo']
+
+def registrar_cache_relatorio(chave, arquivo, versao):
+    """Guarda o arquivo gerado na versão do diretório lida antes da busca e aplica a política de descarte"""
+    cache = _ler_cache_relatorios()
+    anterior = cache.pop(chave, None)
+    if anterior and anterior['arquivo'] != arquivo:
+        _remover_arquivo_cache(anterior)
+    agora = datetime.now().isoformat()
+    cache[chave] = {'arquivo': arquivo, 'dc': versao[0], 'usn': versao[1], 'gerado_em': agora, 'acessado_em': agora,
+                    'tamanho': os.path.getsize(arquivo)}
+    descartar_cache_relatorios(cache, manter=chave)
+    _gravar_cache_relatorios(cache)
+
+def descartar_cache_relatorios(cache, manter=None):
+    """Remove os arquivos mais antigos que a idade máxima e, acima do tamanho máximo, os menos acessados (exceto `manter`)"""
+    limite_idade = (datetime.now() - CACHE_RELATORIOS['idade_maxima']).isoformat()
+    for chave, entrada in list(cache.items()):
+        if entrada['gerado_em'] < limite_idade or not os.path.exists(entrada['arquivo']):
+            _remover_arquivo_cache(cache.pop(chave))
     
-    if not dados_usuarios:
-        print("❌ Nenhum usuário encontrado.")
-        return
+    total = sum(entrada['tamanho'] for entrada in cache.values())
+    for chave, entrada in sorted(cache.items(), key=lambda item: item[1]['acessado_em']):
+        if total <= CACHE_RELATORIOS['tamanho_maximo']:
+            break
+        if chave == manter:
+            continue
+        total -= entrada['tamanho']
+        _remover_arquivo_cache(cache.pop(chave))
+
+# ============================================================
+# BUSCA PAGINADA ADAPTATIVA COM CHECKPOINT
+# ============================================================
+
+# O AD limita cada página ao MaxPageSize (1000 por padrão); o tamanho varia dentro desses limites
+PAGINACAO = {
+    'tamanho_inicial': 1000,
+    'tamanho_minimo': 50,
+    'tamanho_maximo': 1000,
+    'tempo_alvo': 3.0,                 # segundos desejados por página
+    'bytes_alvo': 8 * 1024 * 1024,     # volume bruto desejado por página
+    'tentativas': 5,                   # tentativas por página, com espera de 1s, 2s, 4s...
+    'espera_inicial': 1.0,
+    'janelas_usn': 8,                  # faixas de uSNCreated (pontos de reinício da busca)
+    'checkpoint': os.environ.get('AD_CHECKPOINT', '') == '1',  # opcional: --checkpoint
+    'validade_checkpoint': 12 * 3600,  # checkpoints mais antigos são descartados
+}
+PASTA_CHECKPOINTS = 'checkpoints'
+OID_PAGINACAO = '1.2.840.113556.1.4.319'
+# timeLimitExceeded, adminLimitExceeded, busy e unavailable: vale tentar de novo
+RESULTADOS_TRANSITORIOS = {3, 11, 51, 52}
+
+def _extrair_cookie(conexao):
+    """Obtém o cookie do controle de paginação (1.2.840.113556.1.4.319) da última busca"""
+    controle = (conexao.result or {}).get('controls', {}).get(OID_PAGINACAO)
+    if not controle:
+        return None
+    return controle['value'].get('cookie') or None
+
+def _respostas_pagina(conexao):
+    """Entradas da última busca como respostas brutas compactas (dn + raw_attributes)"""
+    return [
+        {'dn': resposta['dn'], 'raw_attributes': resposta['raw_attributes']}
+        for resposta in conexao.response
+        if resposta.get('type') == 'searchResEntry'
+    ]
+
+@contextlib.contextmanager
+def _sem_formatacao(conexao):
+    """
+    Busca sem a formatação de atributos do ldap3: com check_names desligado a resposta traz
+    apenas os bytes em raw_attributes (e cópias em texto), sem consultar o esquema atributo
+    por atributo. Os relatórios decodificam os bytes com a tabela de compilar_decodificador.
+    """
+    anterior = conexao.check_names
+    conexao.check_names = False
+    try:
+        yield conexao
+    finally:
+        conexao.check_names = anterior
+
+def _ajustar_tamanho_pagina(tamanho, segundos, volume):
+    """Aproxima a próxima página do tempo e do volume alvo, no máximo dobrando ou reduzindo à metade"""
+    fator = min(PAGINACAO['tempo_alvo'] / max(segundos, 0.001), PAGINACAO['bytes_alvo'] / max(volume, 1))
+    fator = min(max(fator, 0.5), 2.0)
+    return int(min(max(tamanho * fator, PAGINACAO['tamanho_minimo']), PAGINACAO['tamanho_maximo']))
+
+def _caminho_checkpoint(conexao, base_dn, filtro, atributos):
+    chave = json.dumps([conexao.server.host, base_dn, filtro, sorted(atributos)])
+    return os.path.join(PASTA_CHECKPOINTS, f"busca_{hashlib.sha1(chave.encode('utf-8')).hexdigest()[:16]}.jsonl")
+
+def _janelas_usn(conexao):
+    """
+    Divide a busca em faixas de uSNCreated que, juntas, cobrem todos os inteiros:
+    [0, b1), [b1, b2), ..., [bn, ∞), com bn = highestCommittedUSN do DC. Cada faixa é
+    um ponto de reinício: uma falha ou retomada repete só a faixa em andamento.
+    Retorna (DC, faixas), ou (None, [None]) se o servidor não informa o USN.
+    """
+    versao = versao_diretorio(conexao)
+    if versao is None:
+        return None, [None]
+    dc, usn = versao
+    limites = sorted({usn * parte // PAGINACAO['janelas_usn'] for parte in range(1, PAGINACAO['janelas_usn'] + 1)} - {0})
+    return dc, [list(janela) for janela in zip([0] + limites, limites + [None])]
+
+def _filtro_janela(filtro, janela):
+    if janela is None:
+        return filtro
+    inicio, fim = janela
+    limite = f"(uSNCreated<={fim - 1})" if fim is not None else ''
+    return f"(&{filtro}(uSNCreated>={inicio}){limite})"
+
+def _gravar_linha_checkpoint(arquivo, registro):
+    """Acrescenta uma linha ao checkpoint e força a gravação em disco antes de continuar"""
+    arquivo.write(json.dumps(registro) + '\n')
+    arquivo.flush()
+    os.fsync(arquivo.fileno())
+
+def _entradas_checkpoint(respostas):
+    return [
+        {'dn': resposta['dn'], 'raw': {atributo: [base64.b64encode(valor).decode('ascii') for valor in valores or ()]
+                                       for atributo, valores in resposta['raw_attributes'].items()}}
+        for resposta in respostas
+    ]
+
+def _ler_checkpoint(caminho):
+    """
+    Estado de uma busca interrompida: {'dc', 'janelas', 'concluidas', 'respostas', 'paginas'},
+    ou None. Respostas de uma faixa não concluída também valem: a faixa é repetida sem duplicá-las.
+    """
+    if not os.path.exists(caminho):
+        return None
+    if time.time() - os.path.getmtime(caminho) > PAGINACAO['validade_checkpoint']:
+        print("   ⚠ Checkpoint expirado descartado")
+        os.remove(caminho)
+        return None
     
-    # Processa os dados e aplica filtro de data de criação
-    usuarios_processados = []
-    for entry in dados_usuarios:
-        # Verifica data de criação
-        created_dt = None
-        if hasattr(entry, 'whenCreated') and entry.whenCreated.value:
+    estado = None
+    with open(caminho, encoding='utf-8') as arquivo:
+        for linha in arquivo:
             try:
-                created_dt = entry.whenCreated.value.replace(tzinfo=None)
-            except:
+                registro = json.loads(linha)
+            except json.JSONDecodeError:
+                # Linha truncada pela interrupção: a página é buscada de novo com a faixa
                 continue
-        
-        # Só inclui se foi criado em 2024
-        if created_dt and data_inicio_2024 <= created_dt < data_fim_2024:
-            login = entry.sAMAccountName.value if hasattr(entry, 'sAMAccountName') and entry.sAMAccountName.value else 'N/A'
-            nome = entry.displayName.value if hasattr(entry, 'displayName') and entry.displayName.value else login
-            cargo = entry.title.value if hasattr(entry, 'title') and entry.title.value else 'Não informado'
-            email = entry.mail.value if hasattr(entry, 'mail') and entry.mail.value else 'N/A'
-            
-            # Status da conta
-            user_account_control = int(entry.userAccountControl.value) if hasattr(entry, 'userAccountControl') and entry.userAccountControl.value else 0
-            is_disabled = bool(user_account_control & 0x0002)
-            status = 'Inativo' if is_disabled else 'Ativo'
-            
-            # Data de último logon
-            data_ultimo_logon = 'Nunca'
-            if hasattr(entry, 'lastLogon') and entry.lastLogon.value:
-                try:
-                    logon_dt = entry.lastLogon.value.replace(tzinfo=None)
-                    data_ultimo_logon = logon_dt.strftime('%d/%m/%Y')
-                except:
-                    pass
-            
-            usuarios_processados.append({
-                'Login': login,
-                'Nome': nome,
-                'E-mail': email,
-                'Cargo': cargo,
-                'Status': status,
-                'Data de Criação': created_dt.strftime('%d/%m/%Y'),
-                'Último Logon': data_ultimo_logon
-            })
+            if 'janelas' in registro:
+                estado = {'dc': registro['dc'], 'janelas': registro['janelas'], 'concluidas': set(), 'respostas': [], 'paginas': 0}
+            elif estado is None:
+                continue
+            elif registro.get('concluida'):
+                estado['concluidas'].add(registro['janela'])
+            else:
+                estado['respostas'].extend(
+                    {'dn': entrada['dn'], 'raw_attributes': {atributo: [base64.b64decode(valor) for valor in valores]
+                                                             for atributo, valores in entrada['raw'].items()}}
+                    for entrada in registro['entradas']
+                )
+                estado['paginas'] += 1
+    return estado
+
+def _abrir_checkpoint(caminho, novo):
+    if not PAGINACAO['checkpoint']:
+        return open(os.devnull, 'w', encoding='utf-8')
+    os.makedirs(PASTA_CHECKPOINTS, exist_ok=True)
+    arquivo = open(caminho, 'w' if novo else 'a+', encoding='utf-8')
+    # Garante que uma linha truncada não se junte à próxima página gravada
+    if arquivo.tell() > 0:
+        arquivo.seek(arquivo.tell() - 1)
+        if arquivo.read(1) != '\n':
+            arquivo.write('\n')
+    return arquivo
+
+def _reconectar(conexao_atual, conexao_original):
+    """Descarta a conexão com falha e abre outra com as mesmas credenciais"""
+    if conexao_atual is not conexao_original:
+        try:
+            conexao_atual.unbind()
+        except LDAPException:
+            pass
+    return _clonar_conexao(conexao_original)
+
+def _relatar_busca_incompleta(total, paginas, tentativas, erro, caminho):
+    print("\n⚠ RESULTADO INCOMPLETO")
+    print(f"   Usuários recebidos: {total} em {paginas} páginas")
+    print(f"   Falha na página {paginas + 1} após {tentativas} tentativas: {erro}")
+    if PAGINACAO['checkpoint']:
+        print(f"   Checkpoint mantido em {caminho}; execute novamente para retomar a busca")
+
+def iterar_paginas_usuarios(conexao, base_dn, filtro, atributos):
+    """
+    Busca paginada robusta: gera as páginas de respostas brutas (dn + raw_attributes) à medida que chegam.
+
+    A busca é dividida em faixas de uSNCreated (veja _janelas_usn), e o tamanho da página
+    acompanha a latência e o volume observados. O cookie de paginação só vale na conexão que
+    o emitiu, por isso uma página com falha é repetida com espera crescente em uma conexão
+    nova a partir do início da faixa, ignorando os DNs já recebidos; a cada falha perde-se
+    no máximo uma faixa. Se não for possível concluir, o resultado parcial é relatado e uma
+    exceção é lançada.
+
+    Com o checkpoint ativado (--checkpoint ou AD_CHECKPOINT=1), as páginas e as faixas
+    concluídas são gravadas sem criptografia em checkpoints/ (com fsync por página); a
+    execução seguinte entrega as páginas salvas e busca só as faixas pendentes no mesmo DC.
+    O arquivo é removido quando a busca termina.
+    """
+    caminho = _caminho_checkpoint(conexao, base_dn, filtro, atributos)
+    dc, janelas = _janelas_usn(conexao)
+    vistos, concluidas, pagina = set(), set(), 0
+    retomada = _ler_checkpoint(caminho) if PAGINACAO['checkpoint'] else None
+    if retomada and retomada['dc'] != dc:
+        # USNs de DCs diferentes não são comparáveis: as faixas salvas não valem mais
+        print("   ⚠ Checkpoint de outro controlador de domínio descartado")
+        retomada = None
+    if retomada:
+        janelas, concluidas, pagina = retomada['janelas'], retomada['concluidas'], retomada['paginas']
+        respostas = retomada.pop('respostas')
+        print(f"   ♻ Retomando busca interrompida: {len(respostas)} usuários recebidos, "
+              f"{len(concluidas)} de {len(janelas)} faixas concluídas")
+        vistos.update(resposta['dn'] for resposta in respostas)
+        for inicio in range(0, len(respostas), PAGINACAO['tamanho_maximo']):
+            yield respostas[inicio:inicio + PAGINACAO['tamanho_maximo']]
+        del respostas
     
-    # Ordena por nome
-    usuarios_processados.sort(key=lambda x: x['Nome'] or 'ZZZ')
+    tamanho = PAGINACAO['tamanho_inicial']
+    conexao_busca = conexao
     
-    # Gera a planilha
-    nome_arquivo = f"Contas_Criadas_2024_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    colunas = ['Login', 'Nome', 'E-mail', 'Cargo', 'Status', 'Data de Criação', 'Último Logon']
-    gerar_planilha(usuarios_processados, nome_arquivo, "CONTAS CRIADAS EM 2024", colunas)
+    try:
+        with _abrir_checkpoint(caminho, novo=not retomada) as checkpoint:
+            if PAGINACAO['checkpoint'] and not retomada:
+                _gravar_linha_checkpoint(checkpoint, {'dc': dc, 'janelas': janelas})
+            
+            for indice, janela in enumerate(janelas):
+                if indice in concluidas:
+                    continue
+                filtro_janela = _filtro_janela(filtro, janela)
+                cookie = None
+                while True:
+                    print(f"   Buscando página {pagina + 1} ({tamanho} por página)...")
+                    
+                    erro = None
+                    tentativa = 0
+                    while tentativa < PAGINACAO['tentativas']:
+                        tentativa += 1
+                        if erro:
+                            espera = PAGINACAO['espera_inicial'] * 2 ** (tentativa - 2)
+                            tamanho = max(PAGINACAO['tamanho_minimo'], tamanho // 2)
+                            print(f"   ⚠ Página {pagina + 1} falhou ({erro}); tentativa {tentativa}/{PAGINACAO['tentativas']} em {espera:.0f}s com {tamanho} por página")
+                            time.sleep(espera)
+                            try:
+                                conexao_busca = _reconectar(conexao_busca, conexao)
+                            except LDAPException as e:
+                                erro = f"falha ao reconectar: {e}"
+                                continue
+                            if cookie is not None:
+                                # Conexão nova: a faixa recomeça e os usuários já recebidos são ignorados
+                                print(f"   ↺ Recomeçando a faixa {indice + 1}/{len(janelas)} sem repetir os {len(vistos)} usuários já recebidos")
+                                cookie = None
+                        
+                        inicio = time.monotonic()
+                        try:
+                            with _sem_formatacao(conexao_busca):
+                                conexao_busca.search(
+                                    base_dn,
+                                    filtro_janela,
+                                    attributes=atributos,
+                                    paged_size=tamanho,
+                                    paged_cookie=cookie,
+                                    search_scope=SUBTREE,
+                                    time_limit=0,
+                                    size_limit=0
+                                )
+                        except LDAPException as e:
+                            erro = str(e)
+                            continue
+                        
+                        codigo = conexao_busca.result['result']
+                        if codigo == 0:
+                            erro = None
+                            break
+                        erro = f"{conexao_busca.result['description']} ({codigo}) {conexao_busca.result['message']}".strip()
+                        # Um cookie recusado (estado de paginação expirado no DC) também recomeça a faixa
+                        if codigo in RESULTADOS_TRANSITORIOS or cookie is not None:
+                            continue
+                        break
+                    
+                    if erro:
+                        _relatar_busca_incompleta(len(vistos), pagina, tentativa, erro, caminho)
+                        raise Exception(f"Busca incompleta: {len(vistos)} usuários recebidos antes da falha ({erro})")
+                    
+                    segundos = time.monotonic() - inicio
+                    pagina += 1
+                    respostas = _respostas_pagina(conexao_busca)
+                    volume = sum(len(valor) for resposta in respostas for valores in resposta['raw_attributes'].values() for valor in valores or ())
+                    cookie = _extrair_cookie(conexao_busca)
+                    respostas = [resposta for resposta in respostas if resposta['dn'] not in vistos]
+                    
+                    # Páginas vazias com cookie são normais em filtros seletivos: a busca continua
+                    vistos.update(resposta['dn'] for resposta in respostas)
+                    if PAGINACAO['checkpoint']:
+                        _gravar_linha_checkpoint(checkpoint, {'janela': indice, 'entradas': _entradas_checkpoint(respostas)})
+                    print(f"   ✓ Página {pagina}: {len(respostas)} usuários em {segundos:.1f}s | Total: {len(vistos)}")
+                    yield respostas
+                    
+                    if not cookie:
+                        break
+                    tamanho = _ajustar_tamanho_pagina(tamanho, segundos, volume)
+                
+                if PAGINACAO['checkpoint']:
+                    _gravar_linha_checkpoint(checkpoint, {'janela': indice, 'concluida': True})
+            print(f"   Busca concluída após {pagina} páginas")
+    finally:
+        if conexao_busca is not conexao:
+            conexao_busca.unbind()
+    
+    # Busca concluída: o checkpoint (com atributos dos usuários) não é mantido em disco
+    if os.path.exists(caminho):
+        os.remove(caminho)
 
-def gerar_contas_desabilitadas_em_2024(conexao):
-    """Gera relatório com contas desabilitadas somente em 2024"""
-    if not OPENPYXL_DISPONIVEL:
-        print("❌ ERRO: Biblioteca openpyxl não está disponível.")
+def paginas_usuarios(conexao, base_dn, filtro, atributos):
+    """Páginas de respostas brutas pelo caminho configurado (sequencial com checkpoint, concorrente ou floresta)"""
+    if MODO_FLORESTA or CONCORRENCIA_BUSCA > 1:
+        todas_entradas = buscar_usuarios_com_paginacao(conexao, base_dn, filtro, atributos)
+        for inicio in range(0, len(todas_entradas), PAGINACAO['tamanho_maximo']):
+            yield todas_entradas[inicio:inicio + PAGINACAO['tamanho_maximo']]
         return
     
-    base_dn = get_base_dn(conexao)
-    print("\n📊 GERANDO RELATÓRIO - CONTAS DESABILITADAS EM 2024")
+    print("🔍 Buscando usuários no Active Directory...")
+    yield from iterar_paginas_usuarios(conexao, base_dn, filtro, atributos)
+
+def buscar_usuarios_com_paginacao(conexao, base_dn, filtro, atributos):
+    """Retorna as respostas brutas (dn + raw_attributes) de todos os usuários do filtro"""
+    if MODO_FLORESTA:
+        return buscar_usuarios_floresta(conexao, filtro, atributos)
+    if CONCORRENCIA_BUSCA > 1:
+        return buscar_usuarios_concorrente(conexao, base_dn, filtro, atributos, max_concorrencia=CONCORRENCIA_BUSCA)
+    
+    todas_entradas = [resposta for pagina in paginas_usuarios(conexao, base_dn, filtro, atributos) for resposta in pagina]
+    print(f"✅ Total de usuários encontrados: {len(todas_entradas)}")
+    return todas_entradas
+
+# ============================================================
+# MODO FLORESTA (CATÁLOGO GLOBAL)
+# ============================================================
+
+# Ativado por --floresta ou AD_FLORESTA=1: as buscas de usuários cobrem todos os domínios da floresta
+MODO_FLORESTA = os.environ.get('AD_FLORESTA', '') == '1'
+PORTA_CATALOGO_GLOBAL = 3268
+PORTA_CATALOGO_GLOBAL_SSL = 3269
+# Base vazia no catálogo global = todas as partições de domínio da floresta
+BASE_CATALOGO_GLOBAL = ''
+FILTRO_DOMINIOS = '(&(objectClass=crossRef)(systemFlags:1.2.840.113556.1.4.803:=2))'
+FILTRO_ATRIBUTOS_PAS = '(&(objectClass=attributeSchema)(isMemberOfPartialAttributeSet=TRUE))'
+
+_floresta = {}
+
+def atributos_catalogo_global(conexao):
+    """Atributos (em minúsculas) do conjunto parcial replicado no catálogo global, lidos do esquema"""
+    if 'pas' not in _floresta:
+        esquema = conexao.server.info.other['schemaNamingContext'][0]
+        respostas = conexao.extend.standard.paged_search(esquema, FILTRO_ATRIBUTOS_PAS, search_scope=LEVEL,
+                                                         attributes=['lDAPDisplayName'], paged_size=1000, generator=True)
+        _floresta['pas'] = {
+            resposta['raw_attributes']['lDAPDisplayName'][0].decode('utf-8').lower()
+            for resposta in respostas if resposta.get('type') == 'searchResEntry'
+        }
+    return _floresta['pas']
+
+def dominios_floresta(conexao):
+    """(DN, nome DNS) de cada domínio da floresta, a partir das crossRef da partição de configuração"""
+    if 'dominios' not in _floresta:
+        configuracao = conexao.server.info.other['configurationNamingContext'][0]
+        conexao.search(f'CN=Partitions,{configuracao}', FILTRO_DOMINIOS, search_scope=LEVEL, attributes=['nCName', 'dnsRoot'])
+        _floresta['dominios'] = [
+            (resposta['raw_attributes']['nCName'][0].decode('utf-8'), resposta['raw_attributes']['dnsRoot'][0].decode('utf-8'))
+            for resposta in conexao.response if resposta.get('type') == 'searchResEntry'
+        ]
+    return _floresta['dominios']
+
+def _atributos_filtro(filtro):
+    """Nomes dos atributos usados em um filtro LDAP"""
+    return set(re.findall(r'\(([A-Za-z][\w-]*)(?::[^=()]*)?[~<>]?=', filtro))
+
+def _conectar_servidor(conexao, host, porta, use_ssl):
+    """Nova conexão com outro servidor (catálogo global ou DC de outro domínio) usando as mesmas credenciais"""
+    servidor = Server(host, port=porta, use_ssl=use_ssl, tls=conexao.server.tls, get_info=NONE)
+    return Connection(
+        servidor,
+        user=conexao.user,
+        password=conexao.password,
+        authentication=conexao.authentication,
+        auto_bind=True,
+        receive_timeout=TEMPO_LIMITE_RECEBIMENTO
+    )
+
+def _buscar_dominios(conexao, filtro, atributos):
+    """Busca o filtro em todos os domínios em paralelo, cada um no seu próprio DC; lança exceção se algum falhar"""
+    dominios = dominios_floresta(conexao)
     
-    data_inicio_2024 = datetime(2024, 1, 1)
-    data_fim_2024 = datetime(2025, 1, 1)
+    def _buscar(dominio):
+        base, host = dominio
+        conexao_dominio = _conectar_servidor(conexao, host, conexao.server.port, conexao.server.ssl)
+        try:
+            return [resposta for pagina in iterar_paginas_usuarios(conexao_dominio, base, filtro, atributos) for resposta in pagina]
+        finally:
+            conexao_dominio.unbind()
     
-    # Busca todos os usuários desabilitados
-    filtro = '(&(objectClass=user)(!(sAMAccountName=*$))(userAccountControl:1.2.840.113556.1.4.803:=2))'
-    atributos = ['sAMAccountName', 'displayName', 'title', 'mail', 'whenCreated', 'lastLogon', 'lastLogonTimestamp']
+    respostas, falhas = [], []
+    with ThreadPoolExecutor(max_workers=min(8, len(dominios)) or 1) as executor:
+        futuros = {executor.submit(_buscar, dominio): dominio for dominio in dominios}
+        for futuro, (base, host) in futuros.items():
+            try:
+                parcial = futuro.result()
+                print(f"   ✓ Domínio {host}: {len(parcial)} usuários")
+                respostas.extend(parcial)
+            except Exception as e:
+                falhas.append(f"{host}: {e}")
     
-    dados_usuarios = buscar_usuarios_com_paginacao(conexao, base_dn, filtro, atributos)
+    if falhas:
+        print("\n⚠ RESULTADO INCOMPLETO - domínios sem resposta:")
+        for falha in falhas:
+            print(f"   {falha}")
+        raise Exception(f"Busca na floresta incompleta: {len(falhas)} de {len(dominios)} domínios falharam")
+    return respostas
+
+def buscar_usuarios_floresta(conexao, filtro, atributos):
+    """
+    Busca os usuários de toda a floresta, com o mesmo retorno de buscar_usuarios_com_paginacao.
+
+    Os atributos do conjunto parcial (PAS) vêm de uma única busca paginada no catálogo
+    global (3268, ou 3269 com SSL). Só os atributos fora do PAS (lastLogon, por exemplo)
+    são buscados domínio a domínio, em paralelo, e anexados pelo objectGUID. Se o próprio
+    filtro depender de atributos fora do PAS, todos os domínios são consultados diretamente.
+    """
+    pas = atributos_catalogo_global(conexao)
+    fora_pas = [atributo for atributo in atributos if atributo.lower() not in pas]
+    filtro_fora_pas = sorted(atributo for atributo in _atributos_filtro(filtro) if atributo.lower() not in pas)
     
-    if not dados_usuarios:
-        print("❌ Nenhuma conta desabilitada encontrada.")
-        return
+    if filtro_fora_pas:
+        print(f"🌲 Filtro usa atributos fora do catálogo global ({', '.join(filtro_fora_pas)}): consultando cada domínio")
+        return _buscar_dominios(conexao, filtro, atributos)
     
-    # Processa os dados e aplica filtro (desabilitados que tiveram atividade em 2024)
-    usuarios_processados = []
-    for entry in dados_usuarios:
-        # Verifica se teve atividade em 2024
-        data_ultimo_logon = None
-        
-        if hasattr(entry, 'lastLogon') and entry.lastLogon.value:
-            try:
-                data_ultimo_logon = entry.lastLogon.value.replace(tzinfo=None)
-            except:
-                pass
-        
-        if hasattr(entry, 'lastLogonTimestamp') and entry.lastLogonTimestamp.value:
-            try:
-                logon_timestamp = entry.lastLogonTimestamp.value.replace(tzinfo=None)
-                if data_ultimo_logon:
-                    data_ultimo_logon = max(data_ultimo_logon, logon_timestamp)
-                else:
-                    data_ultimo_logon = logon_timestamp
-            except:
-                pass
-        
-        # Só inclui se teve logon em 2024
-        if data_ultimo_logon and data_inicio_2024 <= data_ultimo_logon < data_fim_2024:
-            login = entry.sAMAccountName.value if hasattr(entry, 'sAMAccountName') and entry.sAMAccountName.value else 'N/A'
-            nome = entry.displayName.value if hasattr(entry, 'displayName') and entry.displayName.value else login
-            cargo = entry.title.value if hasattr(entry, 'title') and entry.title.value else 'Não informado'
-            email = entry.mail.value if hasattr(entry, 'mail') and entry.mail.value else 'N/A'
-            
-            # Data de criação
-            data_criacao = 'N/A'
-            if hasattr(entry, 'whenCreated') and entry.whenCreated.value:
-                try:
-                    created_dt = entry.whenCreated.value.replace(tzinfo=None)
-                    data_criacao = created_dt.strftime('%d/%m/%Y')
-                except:
-                    data_criacao = 'Erro ao converter'
-            
-            usuarios_processados.append({
-                'Login': login,
-                'Nome': nome,
-                'E-mail': email,
-                'Cargo': cargo,
-                'Status': 'Inativo',
-                'Data de Criação': data_criacao,
-                'Último Logon': data_ultimo_logon.strftime('%d/%m/%Y')
-            })
+    porta = PORTA_CATALOGO_GLOBAL_SSL if conexao.server.ssl else PORTA_CATALOGO_GLOBAL
+    print(f"🌲 Buscando usuários da floresta no catálogo global ({conexao.server.host}:{porta})...")
+    atributos_gc = list(dict.fromkeys([atributo for atributo in atributos if atributo.lower() in pas] + ['objectGUID']))
+    catalogo = _conectar_servidor(conexao, conexao.server.host, porta, conexao.server.ssl)
+    try:
+        respostas = [resposta for pagina in iterar_paginas_usuarios(catalogo, BASE_CATALOGO_GLOBAL, filtro, atributos_gc)
+                     for resposta in pagina]
+    finally:
+        catalogo.unbind()
     
-    # Ordena por nome
-    usuarios_processados.sort(key=lambda x: x['Nome'] or 'ZZZ')
+    if fora_pas:
+        print(f"🌲 Complementando por domínio os atributos fora do catálogo global: {', '.join(fora_pas)}")
+        complementos = {}
+        for resposta in _buscar_dominios(conexao, filtro, list(dict.fromkeys(['objectGUID'] + fora_pas))):
+            guid = resposta['raw_attributes'].get('objectGUID')
+            if guid:
+                complementos[bytes(guid[0])] = resposta['raw_attributes']
+        for resposta in respostas:
+            guid = resposta['raw_attributes'].get('objectGUID')
+            complemento = complementos.get(bytes(guid[0])) if guid else None
+            if complemento:
+                for atributo in fora_pas:
+                    if complemento.get(atributo):
+                        resposta['raw_attributes'][atributo] = complemento[atributo]
     
-    # Gera a planilha
-    nome_arquivo = f"Contas_Desabilitadas_2024_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    colunas = ['Login', 'Nome', 'E-mail', 'Cargo', 'Status', 'Data de Criação', 'Último Logon']
-    gerar_planilha(usuarios_processados, nome_arquivo, "CONTAS DESABILITADAS EM 2024", colunas)
+    print(f"✅ Total de usuários na floresta: {len(respostas)}")
+    return respostas
 
-def gerar_relacao_emails(conexao):
-    """Gera relatório com todos os e-mails: Nome, E-mail e Cargo"""
-    if not OPENPYXL_DISPONIVEL:
-        print("❌ ERRO: Biblioteca openpyxl não está disponível.")
-        return
+# ============================================================
+# BUSCA CONCORRENTE (asyncio) PARTICIONADA POR OU
+# ============================================================
+
+def _clonar_conexao(conexao):
+    """Abre uma nova conexão com o mesmo servidor e as mesmas credenciais da conexão informada"""
+    return Connection(
+        conexao.server,
+        user=conexao.user,
+        password=conexao.password,
+        authentication=conexao.authentication,
+        client_strategy=conexao.strategy_type,
+        auto_bind=True,
+        receive_timeout=TEMPO_LIMITE_RECEBIMENTO
+    )
+
+def descobrir_particoes(conexao, base_dn):
+    """
+    Divide o domínio em partições de busca: cada objeto um nível abaixo do
+    base_dn, de qualquer classe (OUs, contêineres, lostAndFound, classes
+    personalizadas e os próprios usuários na raiz), vira uma subárvore.
+    Juntas, cobrem exatamente a busca SUBTREE a partir do base_dn.
+    """
+    conexao.search(base_dn, '(objectClass=*)', search_scope=LEVEL, attributes=['objectClass'])
+    return [(entry.entry_dn, SUBTREE) for entry in conexao.entries]
+
+def _buscar_particao(pool, loop, fila, vagas, cancelado, base, escopo, filtro, atributos, tamanho_pagina):
+    """
+    Executa a busca paginada de uma partição em uma thread do executor.
+    Cada página ocupa uma vaga antes de ser entregue à fila assíncrona; sem
+    vagas livres a thread espera o consumidor (backpressure).
+    """
+    conexao = pool.get()
+    try:
+        cookie = None
+        total = 0
+        while True:
+            with _sem_formatacao(conexao):
+                conexao.search(
+                    base,
+                    filtro,
+                    attributes=atributos,
+                    paged_size=tamanho_pagina,
+                    paged_cookie=cookie,
+                    search_scope=escopo,
+                    time_limit=0,
+                    size_limit=0
+                )
+            pagina = _respostas_pagina(conexao)
+            cookie = _extrair_cookie(conexao)
+            if pagina:
+                while not vagas.acquire(timeout=0.1):
+                    if cancelado.is_set():
+                        return total
+                total += len(pagina)
+                loop.call_soon_threadsafe(fila.put_nowait, pagina)
+            if not cookie or cancelado.is_set():
+                return total
+    finally:
+        pool.put(conexao)
+
+async def buscar_usuarios_async(conexao, base_dn, filtro, atributos, max_concorrencia=8, tamanho_pagina=1000, limite_fila=16):
+    """
+    Gerador assíncrono que busca as partições do domínio em paralelo e
+    intercala os resultados em um único fluxo de entradas.
+
+    O tempo total tende ao da partição mais lenta, e não à soma das idas e
+    voltas de todas as páginas. No máximo `limite_fila` páginas ficam em
+    memória aguardando o consumidor.
+    """
+    loop = asyncio.get_running_loop()
+    particoes = descobrir_particoes(conexao, base_dn)
+    print(f"🔍 Buscando usuários em {len(particoes)} partições ({max_concorrencia} em paralelo)...")
     
-    base_dn = get_base_dn(conexao)
-    print("\n📊 GERANDO RELATÓRIO - RELAÇÃO DE E-MAILS")
+    # Pool de conexões: cada thread usa uma conexão própria, reaproveitada entre partições
+    pool = queue.Queue()
+    for _ in range(min(max_concorrencia, len(particoes))):
+        pool.put(_clonar_conexao(conexao))
     
-    # Busca todos os usuários que têm e-mail
-    filtro = '(&(objectClass=user)(!(sAMAccountName=*$))(mail=*))'
-    atributos = ['sAMAccountName', 'displayName', 'title', 'mail']
+    # Páginas usam vagas limitadas; os avisos de fim/erro nunca bloqueiam
+    fila = asyncio.Queue()
+    vagas = threading.Semaphore(limite_fila)
+    cancelado = threading.Event()
+    fim = object()
     
-    dados_usuarios = buscar_usuarios_com_paginacao(conexao, base_dn, filtro, atributos)
+    async def _executar(executor, base, escopo):
+        try:
+            total = await loop.run_in_executor(
+                executor, _buscar_particao, pool, loop, fila, vagas, cancelado, base, escopo, filtro, atributos, tamanho_pagina
+            )
+            print(f"   ✓ Partição {base}: {total} usuários")
+        except Exception as e:
+            fila.put_nowait(e)
+        finally:
+            fila.put_nowait(fim)
     
-    if not dados_usuarios:
-        print("❌ Nenhum usuário com e-mail encontrado.")
-        return
+    executor = ThreadPoolExecutor(max_workers=max_concorrencia)
+    tarefas = [asyncio.ensure_future(_executar(executor, base, escopo)) for base, escopo in particoes]
+    try:
+        pendentes = len(tarefas)
+        while pendentes:
+            item = await fila.get()
+            if item is fim:
+                pendentes -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                vagas.release()
+                for entry in item:
+                    yield entry
+    finally:
+        # Consumidor encerrado antes do fim: as tarefas são canceladas e as threads
+        # param após a página em andamento, sem bloquear o loop de eventos
+        cancelado.set()
+        for tarefa in tarefas:
+            tarefa.cancel()
+        await asyncio.gather(*tarefas, return_exceptions=True)
+        await loop.run_in_executor(None, executor.shutdown)
+        while not pool.empty():
+            pool.get_nowait().unbind()
+
+def buscar_usuarios_concorrente(conexao, base_dn, filtro, atributos, max_concorrencia=8, tamanho_pagina=1000):
+    """Versão síncrona da busca concorrente, com o mesmo retorno de buscar_usuarios_com_paginacao"""
+    async def _coletar():
+        return [entry async for entry in buscar_usuarios_async(conexao, base_dn, filtro, atributos, max_concorrencia, tamanho_pagina)]
     
-    # Processa os dados
-    usuarios_processados = []
-    for entry in dados_usuarios:
-        nome = entry.displayName.value if hasattr(entry, 'displayName') and entry.displayName.value else 'N/A'
-        cargo = entry.title.value if hasattr(entry, 'title') and entry.title.value else 'Não informado'
-        email = entry.mail.value if hasattr(entry, 'mail') and entry.mail.value else 'N/A'
-        
-        if email != 'N/A':  # Só inclui se tem e-mail válido
-            usuarios_processados.append({
-                'Nome': nome,
-                'E-mail': email,
-                'Cargo': cargo
-            })
+    todas_entradas = asyncio.run(_coletar())
+    print(f"✅ Total de usuários encontrados: {len(todas_entradas)}")
+    return todas_entradas
+
+# ============================================================
+# DECODIFICAÇÃO PARALELA (PIPELINE BUSCA -> PROCESSOS)
+# ============================================================
+
+# Processos decodificadores; 1 decodifica na própria thread da busca
+PROCESSOS_DECODIFICACAO = int(os.environ.get('AD_PROCESSOS', '0')) or (os.cpu_count() or 1)
+
+def _decodificar_pagina_colunas(pagina, atributos):
+    """Decodifica uma página de respostas brutas em colunas tipadas (executada nos processos do pool)"""
+    colunas = {atributo: [] for atributo in atributos}
+    destinos = [(atributo, decodificar, colunas[atributo].append)
+                for atributo, decodificar in compilar_decodificador(tuple(atributos))]
+    for resposta in pagina:
+        brutos = resposta['raw_attributes']
+        for atributo, decodificar, anexar in destinos:
+            valores = brutos.get(atributo)
+            if valores:
+                try:
+                    anexar(decodificar(valores))
+                except (ValueError, TypeError):
+                    anexar(None)
+            else:
+                anexar(None)
+    return len(pagina), colunas
+
+def buscar_tabela_usuarios(conexao, base_dn, filtro, atributos, processos=None):
+    """
+    Busca os usuários e monta a tabela por colunas, decodificando as páginas em paralelo.
+
+    Cada página recebida é enviada a um pool de processos enquanto a próxima é buscada,
+    de modo que rede e CPU trabalham ao mesmo tempo. As páginas voltam como colunas
+    tipadas e são anexadas na ordem da busca. O pool só é criado a partir da segunda
+    página, para que buscas pequenas não paguem o custo de iniciar processos.
+    """
+    processos = processos or PROCESSOS_DECODIFICACAO
+    tabela = {'n': 0, 'colunas': {atributo: [] for atributo in atributos}}
+    pendentes = collections.deque()
+    executor = None
     
-    # Ordena por nome
-    usuarios_processados.sort(key=lambda x: x['Nome'] or 'ZZZ')
+    def _anexar(resultado):
+        quantidade, colunas = resultado
+        tabela['n'] += quantidade
+        for atributo, valores in colunas.items():
+            tabela['colunas'][atributo].extend(valores)
     
-    # Gera a planilha
-    nome_arquivo = f"Relacao_Emails_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    colunas = ['Nome', 'E-mail', 'Cargo']
-    gerar_planilha(usuarios_processados, nome_arquivo, "RELAÇÃO DE E-MAILS", colunas)
+    try:
+        for pagina in paginas_usuarios(conexao, base_dn, filtro, atributos):
+            if executor is None and processos > 1 and tabela['n']:
+                try:
+                    executor = ProcessPoolExecutor(max_workers=processos)
+                    print(f"   ⚙ Decodificando em {processos} processos")
+                except (OSError, NotImplementedError) as e:
+                    print(f"⚠ Decodificação paralela indisponível ({e}); seguindo em um único processo")
+                    processos = 1
+            
+            if executor is None:
+                _anexar(_decodificar_pagina_colunas(pagina, atributos))
+                continue
+            
+            pendentes.append(executor.submit(_decodificar_pagina_colunas, pagina, atributos))
+            # No máximo duas páginas por processo aguardando: limita a memória em buscas enormes
+            while len(pendentes) > 2 * processos or (pendentes and pendentes[0].done()):
+                _anexar(pendentes.popleft().result())
+        
+        while pendentes:
+            _anexar(pendentes.popleft().result())
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+    
+    print(f"✅ Total de usuários encontrados: {tabela['n']}")
+    return tabela
 
-def buscar_usuarios_com_paginacao(conexao, base_dn, filtro, atributos):
-    """Função auxiliar para buscar usuários com paginação"""
-    print("🔍 Buscando usuários no Active Directory...")
+def medir_decodificacao(conexao, paginas=5, tamanho_pagina=1000, repeticoes=3):
+    """
+    Compara, nas mesmas páginas de usuários, o caminho anterior (o ldap3 formata os atributos,
+    monta as Entry e os valores são lidos com entry.X.value) com o caminho rápido
+    (raw_attributes sem formatação + tabela de decodificadores pré-compilada).
+    Os tempos incluem a rede; cada caminho é medido `repeticoes` vezes e vale o melhor.
+    """
+    base_dn = get_base_dn(conexao)
+    atributos = ATRIBUTOS_SNAPSHOT
     
-    todas_entradas = []
-    cookie = None
-    pagina = 0
+    def _caminho_entry():
+        total, cookie = 0, None
+        for _ in range(paginas):
+            conexao.search(base_dn, FILTRO_USUARIOS, attributes=atributos, paged_size=tamanho_pagina, paged_cookie=cookie)
+            for entry in conexao.entries:
+                {atributo: entry[atributo].value if atributo in entry else None for atributo in atributos}
+                total += 1
+            cookie = _extrair_cookie(conexao)
+            if not cookie:
+                break
+        return total
     
-    while True:
-        pagina += 1
-        print(f"   Buscando página {pagina}...")
-        
-        # Busca com paginação
-        conexao.search(
-            base_dn,
-            filtro,
-            attributes=atributos,
-            paged_size=1000,
-            paged_cookie=cookie,
-            search_scope='SUBTREE',
-            time_limit=0,
-            size_limit=0
-        )
-        
-        if not conexao.entries:
-            print(f"   Nenhum resultado na página {pagina}")
-            break
-        
-        # Adiciona os resultados à lista
-        todas_entradas.extend(list(conexao.entries))
-        print(f"   ✓ Página {pagina}: {len(conexao.entries)} usuários | Total: {len(todas_entradas)}")
-        
-        # Verifica se há mais páginas
-        try:
-            controls = conexao.result.get('controls', {})
-            if isinstance(controls, dict):
-                paged_control = controls.get('1.2.840.113556.1.4.319', {})
-                if isinstance(paged_control, dict):
-                    cookie = paged_control.get('value', {}).get('cookie')
-                else:
-                    cookie = None
-            else:
-                cookie = None
-        except:
-            cookie = None
-            
-        if not cookie:
-            print(f"   Busca concluída após {pagina} páginas")
-            break
+    def _caminho_rapido():
+        total, cookie = 0, None
+        for _ in range(paginas):
+            with _sem_formatacao(conexao):
+                conexao.search(base_dn, FILTRO_USUARIOS, attributes=atributos, paged_size=tamanho_pagina, paged_cookie=cookie)
+            total += _decodificar_pagina_colunas(_respostas_pagina(conexao), atributos)[0]
+            cookie = _extrair_cookie(conexao)
+            if not cookie:
+                break
+        return total
     
-    print(f"✅ Total de usuários encontrados: {len(todas_entradas)}")
-    return todas_entradas
+    print(f"\n⏱ MEDINDO DECODIFICAÇÃO ({paginas} páginas de até {tamanho_pagina} usuários, {len(atributos)} atributos)")
+    melhores = {}
+    for _ in range(repeticoes):
+        for nome, caminho in (('Entry (ldap3)', _caminho_entry), ('Bruto pré-compilado', _caminho_rapido)):
+            inicio = time.perf_counter()
+            total = caminho()
+            decorrido = time.perf_counter() - inicio
+            if nome not in melhores or decorrido < melhores[nome][1]:
+                melhores[nome] = (total, decorrido)
+    
+    for nome, (total, decorrido) in melhores.items():
+        print(f"   {nome:<22} {total} usuários em {decorrido:.3f}s ({decorrido / max(total, 1) * 1e6:.1f} µs/usuário)")
+    antigo, novo = melhores['Entry (ldap3)'][1], melhores['Bruto pré-compilado'][1]
+    print(f"✓ Caminho rápido {antigo / max(novo, 1e-9):.1f}x mais rápido")
+    return melhores
 
-def gerar_planilha(dados, nome_arquivo, titulo, colunas):
-    """Função auxiliar para gerar planilhas Excel"""
+def gerar_planilha(dados, nome_arquivo, titulo, colunas, informacoes=None):
+    """Função auxiliar para gerar planilhas Excel; `informacoes` são linhas extras do cabeçalho"""
     print(f"📝 Criando planilha: {nome_arquivo}")
     
     try:
@@ -574,6 +1643,8 @@ def gerar_planilha(dados, nome_arquivo, titulo, colunas):
         ws['A1'].font = Font(bold=True, size=14)
         ws['A2'] = f'Gerado em: {datetime.now().strftime("%d/%m/%Y às %H:%M:%S")}'
         ws['A3'] = f'Total de registros: {len(dados)}'
+        for informacao in informacoes or []:
+            ws.append([informacao])
         
         # Linha vazia
         ws.append([''])
@@ -605,537 +1676,2307 @@ def gerar_planilha(dados, nome_arquivo, titulo, colunas):
         
         print(f"✅ Relatório gerado com sucesso!")
         print(f"   📄 Arquivo: {nome_arquivo}")
-        print(f"   📊 Total de registros: {len(dados)}")
+        print(f"   📊 Total de registros: {len(dados)}")
+        
+        # Abre o arquivo automaticamente
+        os.startfile(nome_arquivo)
+        print("✓ Arquivo aberto")
+        
+    except Exception as e:
+        print(f"❌ Erro ao criar planilha: {e}")
+
+# ============================================================
+# TABELA DE USUÁRIOS E MOTOR DE REGRAS
+# ============================================================
+
+# Converte um bytearray de 0/1 (um byte por linha) nos dígitos de um número binário
+_DIGITOS_BINARIOS = bytes.maketrans(b'\x00\x01', b'01')
+
+def montar_tabela_usuarios(linhas, atributos):
+    """Transpõe as linhas tipadas em uma tabela por colunas (atributo -> lista de valores)"""
+    return {
+        'n': len(linhas),
+        'colunas': {atributo: [linha.get(atributo) for linha in linhas] for atributo in atributos},
+    }
+
+def coluna_tabela(tabela, campo):
+    """Obtém a coluna de um atributo ou campo derivado; derivados são calculados uma única vez"""
+    colunas = tabela['colunas']
+    if campo not in colunas and campo in CAMPOS_DERIVADOS:
+        origens, calcular = CAMPOS_DERIVADOS[campo]
+        valores = zip(*(colunas[origem] for origem in origens))
+        colunas[campo] = [calcular(dict(zip(origens, linha))) for linha in valores]
+    return colunas[campo]
+
+def linha_tabela(tabela, indice):
+    """Reconstrói a linha tipada de um índice da tabela"""
+    return {atributo: valores[indice] for atributo, valores in tabela['colunas'].items() if atributo not in CAMPOS_DERIVADOS}
+
+def _teste_folha(folha):
+    """Função de um valor da coluna para uma condição simples (flag, existe, entre)"""
+    operador = folha[0]
+    if operador == 'flag':
+        bits = folha[2]
+        return lambda valor: ((valor or 0) & bits) == bits
+    if operador == 'existe':
+        return lambda valor: valor is not None and valor != ''
+    if operador == 'entre':
+        inicio, fim = folha[2], folha[3]
+        return lambda valor: valor is not None and (inicio is None or valor >= inicio) and (fim is None or valor < fim)
+    raise ValueError(f"Operador de predicado desconhecido: {operador}")
+
+def _mascara_coluna(coluna, teste):
+    """Avalia o teste sobre a coluna inteira e devolve a máscara de bits (bit i = linha i)"""
+    if not coluna:
+        return 0
+    marcados = bytearray(map(teste, coluna))
+    return int(marcados[::-1].translate(_DIGITOS_BINARIOS), 2)
+
+def compilar_regras(conjuntos):
+    """
+    Compila conjuntos nomeados de predicados em operações sobre máscaras de bits.
+
+    As condições simples são deduplicadas entre todos os conjuntos: cada uma
+    vira uma única passada sobre a sua coluna, e 'e'/'ou'/'nao' são resolvidos
+    com operações bit a bit sobre as máscaras inteiras. Avaliar vários
+    conjuntos custa o mesmo que avaliar as condições distintas uma vez.
+    """
+    folhas = {}
+    
+    def _compilar(predicado):
+        operador = predicado[0]
+        if operador in ('e', 'ou'):
+            partes = [_compilar(sub) for sub in predicado[1:]]
+            if operador == 'e':
+                def _e(mascaras, todos):
+                    resultado = todos
+                    for parte in partes:
+                        resultado &= parte(mascaras, todos)
+                    return resultado
+                return _e
+            def _ou(mascaras, todos):
+                resultado = 0
+                for parte in partes:
+                    resultado |= parte(mascaras, todos)
+                return resultado
+            return _ou
+        if operador == 'nao':
+            parte = _compilar(predicado[1])
+            return lambda mascaras, todos: todos ^ parte(mascaras, todos)
+        indice = folhas.setdefault(predicado, len(folhas))
+        return lambda mascaras, todos: mascaras[indice]
+    
+    return {
+        'conjuntos': {nome: _compilar(predicado) for nome, predicado in conjuntos.items()},
+        'folhas': [(folha[1], _teste_folha(folha)) for folha in folhas],
+    }
+
+def avaliar_regras(regras, tabela):
+    """Avalia regras compiladas sobre a tabela e devolve nome -> máscara de bits"""
+    mascaras = [_mascara_coluna(coluna_tabela(tabela, campo), teste) for campo, teste in regras['folhas']]
+    todos = (1 << tabela['n']) - 1
+    return {nome: avaliar(mascaras, todos) for nome, avaliar in regras['conjuntos'].items()}
+
+def contar_mascara(mascara):
+    return bin(mascara).count('1')
+
+def indices_mascara(mascara):
+    """Índices das linhas marcadas na máscara, em ordem crescente"""
+    digitos = bin(mascara)[:1:-1]
+    return [indice for indice, digito in enumerate(digitos) if digito == '1']
+
+def marcadores_mascara(mascara, n):
+    """Máscara como bytes indexáveis por linha (b'1' = marcada), para filtrar uma permutação em uma passada"""
+    return bin(mascara)[:1:-1].encode('ascii').ljust(n, b'0')
+
+def indice_ordenacao(tabela, coluna='Nome'):
+    """
+    Permutação das linhas da tabela pela chave de colação de uma coluna de relatório.
+
+    A chave de cada linha é calculada uma única vez a partir das colunas da tabela e
+    a permutação fica guardada nela: relatórios, abas, a base SQL e o organograma sobre a
+    mesma tabela reaproveitam a ordem, filtrando a permutação por máscara ou fatiando-a,
+    em vez de ordenar de novo. Tabelas novas (outra busca, espelho alterado) começam sem índice.
+    """
+    ordens = tabela.setdefault('ordens', {})
+    if coluna not in ordens:
+        campos, formatar = COLUNAS[coluna]
+        valores = zip(*(coluna_tabela(tabela, campo) for campo in campos))
+        chaves = [chave_colacao(formatar(dict(zip(campos, linha)))) for linha in valores]
+        ordens[coluna] = array.array('l', sorted(range(tabela['n']), key=chaves.__getitem__))
+    return ordens[coluna]
+
+def iterar_linhas_tabela(especificacao, tabela, mascara=None):
+    """
+    Linhas formatadas do relatório para as linhas da tabela marcadas na máscara (todas, se None).
+    Ordenando por uma coluna padrão, a ordem vem do índice da tabela; formatadores próprios
+    da especificação para a coluna de ordenação caem na ordenação do fluxo.
+    """
+    ordenar = especificacao.get('ordenar')
+    colunas = _colunas_especificacao(especificacao)
+    if not ordenar or colunas[ordenar] is not COLUNAS.get(ordenar):
+        indices = range(tabela['n']) if mascara is None else indices_mascara(mascara)
+        linhas = (linha_tabela(tabela, indice) for indice in indices)
+        return iterar_linhas_relatorio(dict(especificacao, incluir=None), linhas)
+    
+    ordem = indice_ordenacao(tabela, ordenar)
+    if mascara is not None:
+        marcados = marcadores_mascara(mascara, tabela['n'])
+        ordem = (indice for indice in ordem if marcados[indice] == 49)  # b'1'
+    return ({titulo: formatar(linha) for titulo, (_, formatar) in colunas.items()}
+            for linha in (linha_tabela(tabela, indice) for indice in ordem))
+
+# Critérios da auditoria 2024, um conjunto nomeado por regra
+JANELA_AUDITORIA = (datetime(2024, 1, 1), datetime(2025, 1, 1))
+P_CRIADA_NA_JANELA = ('entre', 'whenCreated') + JANELA_AUDITORIA
+P_LOGON_NA_JANELA = ('entre', 'ultimoLogon') + JANELA_AUDITORIA
+P_ATIVIDADE_APOS_JANELA = ('ou',
+    ('entre', 'whenCreated', JANELA_AUDITORIA[1], None),
+    ('entre', 'ultimoLogon', JANELA_AUDITORIA[1], None),
+)
+
+REGRAS_AUDITORIA_2024 = {
+    # REGRA 1: todas as contas atualmente ativas
+    'ativas': P_ATIVA,
+    # REGRA 2: inativas criadas ou com último logon dentro da janela
+    'inativas_criadas_2024': ('e', P_DESABILITADA, P_CRIADA_NA_JANELA),
+    'inativas_logon_2024': ('e', P_DESABILITADA, P_LOGON_NA_JANELA),
+    # EXCLUSÃO: inativas criadas ou com logon em 2025 ou depois
+    'inativas_atividade_2025': ('e', P_DESABILITADA, P_ATIVIDADE_APOS_JANELA),
+    'auditoria': ('ou',
+        P_ATIVA,
+        ('e', P_DESABILITADA, ('ou', P_CRIADA_NA_JANELA, P_LOGON_NA_JANELA), ('nao', P_ATIVIDADE_APOS_JANELA)),
+    ),
+}
+
+_REGRAS_AUDITORIA_2024_COMPILADAS = compilar_regras(REGRAS_AUDITORIA_2024)
+
+def _expiracao_auditoria_2024(linha):
+    """Na auditoria, contas com logon em 2024 exibem a data do último logon no lugar da expiração"""
+    ultimo_logon = valor_campo(linha, 'ultimoLogon')
+    if ultimo_logon and JANELA_AUDITORIA[0] <= ultimo_logon <= JANELA_AUDITORIA[1]:
+        return ultimo_logon.strftime('%d/%m/%Y')
+    return _formatar_data(linha.get('accountExpires'), 'Nunca expira')
+
+RELATORIOS['auditoria_2024'] = {
+    'titulo': 'AUDITORIA 2024 - ACTIVE DIRECTORY',
+    'arquivo': 'Auditoria_2024',
+    'colunas': ['Login', 'Nome', 'E-mail', 'Cargo', 'Status', 'Data de Criação', 'Data de Expiração'],
+    'formatadores': {
+        'Data de Expiração': (['lastLogon', 'lastLogonTimestamp', 'accountExpires'], _expiracao_auditoria_2024),
+    },
+    'incluir': REGRAS_AUDITORIA_2024['auditoria'],
+    'ordenar': 'Nome',
+    'vazio': 'Nenhum usuário atende aos critérios de auditoria 2024.',
+}
+
+def gerar_auditoria_2024(conexao):
+    """Gera relatório de auditoria 2024 com critérios específicos"""
+    if not OPENPYXL_DISPONIVEL:
+        print("❌ ERRO: Biblioteca openpyxl não está disponível.")
+        print("Para usar esta função, instale com: pip install openpyxl")
+        return
+    
+    print("\n📊 GERANDO AUDITORIA 2024")
+    print("\n📋 Critérios aplicados:")
+    print("   • Todas as contas ATIVAS são incluídas")
+    print("   • Contas INATIVAS são incluídas SE:")
+    print("     - Data de criação >= 01/01/2024 OU")
+    print("     - Último logon >= 01/01/2024 e < 01/01/2025")
+    print("   • EXCLUSÃO: contas inativas criadas ou com logon em 2025 ou depois")
+    
+    especificacao = RELATORIOS['auditoria_2024']
+    base_dn = get_base_dn(conexao)
+    atributos = atributos_relatorio(especificacao)
+    
+    try:
+        # Busca TODOS os usuários: os totais de processados/excluídos entram no relatório
+        tabela = buscar_tabela_usuarios(conexao, base_dn, FILTRO_USUARIOS, atributos)
+    except Exception as e:
+        print(f"❌ Erro ao buscar usuários: {e}")
+        print("Verifique se você tem permissões para listar usuários no AD.")
+        return
+    
+    if not tabela['n']:
+        print("❌ Nenhum usuário encontrado.")
+        return
+    
+    print("🔄 Aplicando critérios de auditoria 2024...")
+    mascaras = avaliar_regras(_REGRAS_AUDITORIA_2024_COMPILADAS, tabela)
+    
+    usuarios_processados = tabela['n']
+    usuarios_incluidos = contar_mascara(mascaras['auditoria'])
+    ativos = contar_mascara(mascaras['ativas'])
+    inativos = usuarios_incluidos - ativos
+    print(f"✓ Processados: {usuarios_processados} usuários")
+    print(f"✓ Incluídos na auditoria: {usuarios_incluidos} usuários")
+    print(f"   • Inativas criadas em 2024: {contar_mascara(mascaras['inativas_criadas_2024'])}")
+    print(f"   • Inativas com logon em 2024: {contar_mascara(mascaras['inativas_logon_2024'])}")
+    print(f"   • Inativas com atividade em 2025 (excluídas): {contar_mascara(mascaras['inativas_atividade_2025'])}")
+    
+    if not usuarios_incluidos:
+        print(f"❌ {especificacao['vazio']}")
+        return
+    
+    dados_usuarios = list(iterar_linhas_tabela(especificacao, tabela, mascaras['auditoria']))
+    
+    nome_arquivo = f"{especificacao['arquivo']}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    informacoes = [
+        'Critérios: Contas ativas + inativas com criação/logon em 2024',
+        f'Usuários ativos: {ativos} | Usuários inativos: {inativos}',
+        f'Total de usuários processados: {usuarios_processados}',
+        f'Usuários excluídos da auditoria: {usuarios_processados - usuarios_incluidos}',
+    ]
+    gerar_planilha(dados_usuarios, nome_arquivo, especificacao['titulo'], especificacao['colunas'], informacoes)
+    
+    print(f"   ✅ Usuários ativos: {ativos}")
+    print(f"   ❌ Usuários inativos: {inativos}")
+    return dados_usuarios
+
+# ============================================================
+# SNAPSHOTS DO DIRETÓRIO E RELATÓRIO DE MUDANÇAS
+# ============================================================
+
+PASTA_SNAPSHOTS = 'snapshots'
+
+# Atributos gravados em cada snapshot (objectGUID é a chave, estável mesmo após renomear ou mover)
+ATRIBUTOS_SNAPSHOT = ['objectGUID', 'sAMAccountName', 'displayName', 'title', 'mail', 'userAccountControl',
+                      'whenCreated', 'lastLogon', 'lastLogonTimestamp', 'accountExpires']
+
+# Atributos comparados entre snapshots e o nome exibido no relatório de mudanças
+ATRIBUTOS_COMPARADOS = {
+    'sAMAccountName': 'Login',
+    'displayName': 'Nome',
+    'title': 'Cargo',
+    'mail': 'E-mail',
+    'accountExpires': 'Data de Expiração',
+}
+
+def _serializar_valor(valor):
+    return valor.isoformat() if isinstance(valor, datetime) else valor
+
+def _desserializar_linha(linha):
+    for atributo, valor in linha.items():
+        if valor is not None and TIPOS_ATRIBUTOS.get(atributo) in ('filetime', 'data_generalizada'):
+            linha[atributo] = datetime.fromisoformat(valor)
+    return linha
+
+def salvar_snapshot(linhas, caminho, atributos=ATRIBUTOS_SNAPSHOT):
+    """Grava as linhas tipadas em um snapshot JSON Lines compactado; a primeira linha é o cabeçalho"""
+    total = 0
+    with gzip.open(caminho, 'wt', encoding='utf-8') as arquivo:
+        cabecalho = {'snapshot': 1, 'gerado_em': datetime.now().isoformat(), 'atributos': atributos}
+        arquivo.write(json.dumps(cabecalho) + '\n')
+        for linha in linhas:
+            arquivo.write(json.dumps({a: _serializar_valor(linha.get(a)) for a in atributos}, ensure_ascii=False) + '\n')
+            total += 1
+    return total
+
+def ler_snapshot(caminho):
+    """Lê um snapshot linha a linha (gerador), sem carregar o arquivo inteiro"""
+    with gzip.open(caminho, 'rt', encoding='utf-8') as arquivo:
+        next(arquivo)  # cabeçalho
+        for texto in arquivo:
+            yield _desserializar_linha(json.loads(texto))
+
+def listar_snapshots():
+    """Snapshots salvos, do mais antigo para o mais recente"""
+    if not os.path.isdir(PASTA_SNAPSHOTS):
+        return []
+    nomes = sorted(nome for nome in os.listdir(PASTA_SNAPSHOTS) if nome.endswith('.jsonl.gz'))
+    return [os.path.join(PASTA_SNAPSHOTS, nome) for nome in nomes]
+
+def capturar_snapshot(conexao):
+    """Busca todos os usuários e grava um novo snapshot na pasta de snapshots"""
+    base_dn = get_base_dn(conexao)
+    print("\n📸 CAPTURANDO SNAPSHOT DO DIRETÓRIO")
+    
+    dados_usuarios = buscar_usuarios_com_paginacao(conexao, base_dn, FILTRO_USUARIOS, ATRIBUTOS_SNAPSHOT)
+    if not dados_usuarios:
+        print("❌ Nenhum usuário encontrado.")
+        return None
+    
+    os.makedirs(PASTA_SNAPSHOTS, exist_ok=True)
+    caminho = os.path.join(PASTA_SNAPSHOTS, f"Snapshot_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl.gz")
+    linhas = [decodificar_resposta(resposta, ATRIBUTOS_SNAPSHOT) for resposta in dados_usuarios]
+    total = salvar_snapshot(linhas, caminho)
+    print(f"✅ Snapshot salvo: {caminho} ({total} usuários)")
+    
+    # O histórico começa pelos snapshots que já existiam, em ordem
+    if not _ler_indice_historico()['execucoes']:
+        importar_snapshots_no_historico(listar_snapshots()[:-1])
+    execucao = registrar_no_historico(linhas)
+    print(f"✅ Histórico atualizado: {execucao['alteracoes']} valores alterados desde a execução anterior")
+    return caminho
+
+def _assinatura_linha(linha):
+    """Resumo dos atributos comparados: linhas com a mesma assinatura não mudaram"""
+    return hash(tuple(linha.get(a) for a in ATRIBUTOS_COMPARADOS) + (bool((linha.get('userAccountControl') or 0) & 0x0002),))
+
+def _formatar_valor_mudanca(atributo, valor):
+    if atributo == 'accountExpires':
+        return _formatar_data(valor, 'Nunca expira')
+    return valor if valor not in (None, '') else 'N/A'
+
+def comparar_snapshots(linhas_anteriores, linhas_atuais):
+    """
+    Compara dois snapshots pelo objectGUID e gera as mudanças encontradas.
+
+    O snapshot anterior é indexado em um dicionário (guid -> linha) e o atual
+    é percorrido em fluxo, uma única vez: cada linha custa uma consulta ao
+    índice e, quando a assinatura difere, a comparação dos atributos. O que
+    sobra no índice ao final são as contas removidas.
+    """
+    indice = {}
+    for linha in linhas_anteriores:
+        indice[linha['objectGUID']] = (_assinatura_linha(linha), linha)
+    
+    for atual in linhas_atuais:
+        encontrado = indice.pop(atual['objectGUID'], None)
+        if encontrado is None:
+            yield {'Tipo': 'Nova conta', 'linha': atual}
+            continue
+        assinatura, anterior = encontrado
+        if assinatura == _assinatura_linha(atual):
+            continue
+        
+        desabilitada_antes = bool((anterior.get('userAccountControl') or 0) & 0x0002)
+        desabilitada_agora = bool((atual.get('userAccountControl') or 0) & 0x0002)
+        if desabilitada_agora != desabilitada_antes:
+            yield {
+                'Tipo': 'Conta desabilitada' if desabilitada_agora else 'Conta reabilitada',
+                'linha': atual,
+                'Valor Anterior': 'Inativo' if desabilitada_antes else 'Ativo',
+                'Valor Atual': 'Inativo' if desabilitada_agora else 'Ativo',
+            }
+        for atributo, nome in ATRIBUTOS_COMPARADOS.items():
+            if anterior.get(atributo) != atual.get(atributo):
+                yield {
+                    'Tipo': f'Alteração de {nome}',
+                    'linha': atual,
+                    'Atributo': nome,
+                    'Valor Anterior': _formatar_valor_mudanca(atributo, anterior.get(atributo)),
+                    'Valor Atual': _formatar_valor_mudanca(atributo, atual.get(atributo)),
+                }
+    
+    for _, anterior in indice.values():
+        yield {'Tipo': 'Conta removida', 'linha': anterior}
+
+def gerar_relatorio_mudancas(caminho_anterior=None, caminho_atual=None):
+    """Gera o relatório de mudanças entre dois snapshots (por padrão, os dois mais recentes)"""
+    if not OPENPYXL_DISPONIVEL:
+        print("❌ ERRO: Biblioteca openpyxl não está disponível.")
+        return
+    
+    if caminho_anterior is None or caminho_atual is None:
+        snapshots = listar_snapshots()
+        if len(snapshots) < 2:
+            print("❌ São necessários pelo menos dois snapshots salvos para comparar.")
+            return
+        caminho_anterior, caminho_atual = snapshots[-2], snapshots[-1]
+    
+    print(f"\n📊 GERANDO RELATÓRIO DE MUDANÇAS")
+    print(f"   Anterior: {caminho_anterior}")
+    print(f"   Atual:    {caminho_atual}")
+    
+    mudancas = []
+    contagem = {}
+    for mudanca in comparar_snapshots(ler_snapshot(caminho_anterior), ler_snapshot(caminho_atual)):
+        linha = mudanca.pop('linha')
+        mudanca['Login'] = COLUNAS['Login'][1](linha)
+        mudanca['Nome'] = COLUNAS['Nome'][1](linha)
+        mudancas.append(mudanca)
+        contagem[mudanca['Tipo']] = contagem.get(mudanca['Tipo'], 0) + 1
+    
+    for tipo, quantidade in sorted(contagem.items()):
+        print(f"   • {tipo}: {quantidade}")
+    
+    if not mudancas:
+        print("✅ Nenhuma mudança entre os snapshots.")
+        return mudancas
+    
+    nome_arquivo = f"Mudancas_AD_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    colunas = ['Tipo', 'Login', 'Nome', 'Atributo', 'Valor Anterior', 'Valor Atual']
+    informacoes = [
+        f'Snapshot anterior: {os.path.basename(caminho_anterior)}',
+        f'Snapshot atual: {os.path.basename(caminho_atual)}',
+    ]
+    gerar_planilha(mudancas, nome_arquivo, "MUDANÇAS NO ACTIVE DIRECTORY", colunas, informacoes)
+    return mudancas
+
+# ============================================================
+# HISTÓRICO COMPACTO DE SNAPSHOTS (DELTAS POR COLUNA)
+# ============================================================
+
+PASTA_HISTORICO = 'historico'
+ARQUIVO_HISTORICO = os.path.join(PASTA_HISTORICO, 'historico.jsonl.gz')
+ARQUIVO_INDICE_HISTORICO = os.path.join(PASTA_HISTORICO, 'indice.json')
+
+# Atributos versionados; lastLogon fica de fora porque muda a cada logon e dominaria os deltas
+ATRIBUTOS_HISTORICO = ['sAMAccountName', 'displayName', 'title', 'mail', 'userAccountControl',
+                       'whenCreated', 'accountExpires']
+
+# A cada tantas execuções o estado completo é gravado, limitando o replay de qualquer consulta
+INTERVALO_COMPLETO = 30
+
+def _ler_indice_historico():
+    if not os.path.exists(ARQUIVO_INDICE_HISTORICO):
+        return {'execucoes': [], 'fim': 0, 'proximo_id': 0}
+    with open(ARQUIVO_INDICE_HISTORICO, encoding='utf-8') as arquivo:
+        return json.load(arquivo)
+
+def _gravar_indice_historico(indice):
+    temporario = ARQUIVO_INDICE_HISTORICO + '.tmp'
+    with open(temporario, 'w', encoding='utf-8') as arquivo:
+        json.dump(indice, arquivo)
+        arquivo.flush()
+        os.fsync(arquivo.fileno())
+    os.replace(temporario, ARQUIVO_INDICE_HISTORICO)
+
+def _iterar_execucoes(indice, ate=None, desde=None):
+    """
+    Registros das execuções até `ate` (índice da execução; None = última), inclusive,
+    a partir do último estado completo que antecede `desde` (padrão: `ate`): (posição, registro).
+    Cada execução é um membro gzip próprio; a leitura começa no deslocamento do completo.
+    """
+    execucoes = indice['execucoes']
+    if not execucoes:
+        return
+    ate = len(execucoes) - 1 if ate is None else ate
+    desde = ate if desde is None else desde
+    inicio = max(i for i in range(desde + 1) if execucoes[i]['completo'])
+    with open(ARQUIVO_HISTORICO, 'rb') as bruto:
+        bruto.seek(execucoes[inicio]['posicao'])
+        with gzip.GzipFile(fileobj=bruto, mode='rb') as arquivo:
+            for posicao, texto in zip(range(inicio, ate + 1), arquivo):
+                yield posicao, json.loads(texto)
+
+def _aplicar_execucao(estado, guids, registro):
+    """
+    Aplica uma execução ao estado (id -> linha serializada) e ao mapa id -> objectGUID.
+    Linhas alteradas são copiadas antes de mudar: referências antigas continuam válidas.
+    Devolve os ids afetados.
+    """
+    if registro['completo']:
+        estado.clear()
+    for id_, guid in registro['novos']:
+        guids[id_] = guid
+        estado[id_] = {}
+    for id_ in registro['removidos']:
+        estado.pop(id_, None)
+    alterados = set(id_ for id_, _ in registro['novos'])
+    for atributo, (ids, valores) in registro['colunas'].items():
+        for id_, valor in zip(ids, valores):
+            if id_ not in alterados:
+                estado[id_] = dict(estado[id_])
+                alterados.add(id_)
+            estado[id_][atributo] = valor
+    return alterados | set(registro['removidos'])
+
+def _estado_historico(indice, ate=None):
+    estado, guids = {}, {}
+    for _, registro in _iterar_execucoes(indice, ate):
+        _aplicar_execucao(estado, guids, registro)
+    return estado, guids
+
+def registrar_no_historico(linhas, data=None):
+    """
+    Acrescenta uma execução ao histórico com os deltas por coluna em relação à anterior.
+
+    Cada objectGUID recebe um id inteiro na primeira vez em que aparece; a
+    execução guarda, para cada atributo, só os pares (ids, valores) que
+    mudaram, mais os ids novos e removidos. O arquivo é uma sequência de
+    membros gzip (um por execução) e o índice guarda o deslocamento de cada
+    um, de modo que qualquer estado é reconstruído a partir do último estado
+    completo (gravado a cada INTERVALO_COMPLETO execuções).
+    """
+    os.makedirs(PASTA_HISTORICO, exist_ok=True)
+    indice = _ler_indice_historico()
+    anterior, guids = _estado_historico(indice)
+    id_por_guid = {guid: id_ for id_, guid in guids.items()}
+    proximo_id = indice['proximo_id']
+    completo = len(indice['execucoes']) % INTERVALO_COMPLETO == 0
+    
+    atual = {}
+    novos = []
+    for linha in linhas:
+        guid = linha['objectGUID']
+        id_ = id_por_guid.get(guid)
+        if id_ is None:
+            id_ = id_por_guid[guid] = proximo_id
+            proximo_id += 1
+        if completo or id_ not in anterior:
+            novos.append([id_, guid])
+        atual[id_] = {atributo: _serializar_valor(linha.get(atributo)) for atributo in ATRIBUTOS_HISTORICO}
+    
+    colunas = {atributo: ([], []) for atributo in ATRIBUTOS_HISTORICO}
+    for id_, linha in atual.items():
+        linha_anterior = {} if completo else anterior.get(id_, {})
+        for atributo, valor in linha.items():
+            if linha_anterior.get(atributo) != valor:
+                colunas[atributo][0].append(id_)
+                colunas[atributo][1].append(valor)
+    removidos = [] if completo else [id_ for id_ in anterior if id_ not in atual]
+    
+    registro = {
+        'data': (data or datetime.now()).isoformat(),
+        'completo': completo,
+        'novos': novos,
+        'removidos': removidos,
+        'colunas': {atributo: par for atributo, par in colunas.items() if par[0]},
+    }
+    
+    # Descarta o que tenha sobrado de uma gravação interrompida depois do último membro indexado
+    with open(ARQUIVO_HISTORICO, 'r+b' if os.path.exists(ARQUIVO_HISTORICO) else 'wb') as bruto:
+        bruto.truncate(indice['fim'])
+        bruto.seek(indice['fim'])
+        with gzip.GzipFile(fileobj=bruto, mode='wb') as arquivo:
+            arquivo.write((json.dumps(registro, ensure_ascii=False) + '\n').encode('utf-8'))
+        fim = bruto.tell()
+        bruto.flush()
+        os.fsync(bruto.fileno())
+    
+    alteracoes = sum(len(ids) for ids, _ in registro['colunas'].values())
+    indice['execucoes'].append({'data': registro['data'], 'posicao': indice['fim'], 'completo': completo,
+                                'total': len(atual), 'alteracoes': alteracoes})
+    indice['fim'] = fim
+    indice['proximo_id'] = proximo_id
+    _gravar_indice_historico(indice)
+    return indice['execucoes'][-1]
+
+def importar_snapshots_no_historico(caminhos):
+    """Registra snapshots já salvos (em ordem) no histórico, com a data de cada um"""
+    for caminho in caminhos:
+        with gzip.open(caminho, 'rt', encoding='utf-8') as arquivo:
+            cabecalho = json.loads(next(arquivo))
+        registrar_no_historico(ler_snapshot(caminho), datetime.fromisoformat(cabecalho['gerado_em']))
+        print(f"   ✓ Snapshot importado no histórico: {os.path.basename(caminho)}")
+
+def _execucao_em(indice, data):
+    """Índice da última execução registrada até a data (None se não houver)"""
+    datas = [execucao['data'] for execucao in indice['execucoes']]
+    posicao = bisect.bisect_right(datas, data.isoformat()) - 1
+    return posicao if posicao >= 0 else None
+
+def estado_em(data):
+    """Linhas tipadas (com objectGUID) do diretório como registrado na última execução até a data"""
+    indice = _ler_indice_historico()
+    posicao = _execucao_em(indice, data)
+    if posicao is None:
+        return []
+    estado, guids = _estado_historico(indice, posicao)
+    return [_desserializar_linha(dict(linha, objectGUID=guids[id_])) for id_, linha in estado.items()]
+
+def serie_historico(predicado, datas):
+    """
+    Quantas contas satisfaziam o predicado em cada data: [(data, quantidade ou None)].
+
+    O histórico é percorrido uma vez; a contagem é mantida de forma
+    incremental, reavaliando o predicado só nas contas alteradas em cada
+    execução (e em todas, nos estados completos).
+    """
+    indice = _ler_indice_historico()
+    alvos = {}
+    for data in datas:
+        posicao = _execucao_em(indice, data)
+        if posicao is not None:
+            alvos.setdefault(posicao, []).append(data)
+    resultado = {data: None for data in datas}
+    if not alvos:
+        return list(resultado.items())
+    
+    def _satisfaz(linha):
+        return linha is not None and avaliar_predicado(predicado, _desserializar_linha(dict(linha)))
+    
+    estado, guids = {}, {}
+    contagem = 0
+    ultima = max(alvos)
+    for posicao, registro in _iterar_execucoes(indice, ultima, desde=min(alvos)):
+        if registro['completo']:
+            _aplicar_execucao(estado, guids, registro)
+            contagem = sum(1 for linha in estado.values() if _satisfaz(linha))
+        else:
+            antes = {id_: estado.get(id_) for id_ in
+                     {id_ for id_, _ in registro['novos']} | set(registro['removidos'])
+                     | {id_ for ids, _ in registro['colunas'].values() for id_ in ids}}
+            _aplicar_execucao(estado, guids, registro)
+            for id_, linha in antes.items():
+                contagem += _satisfaz(estado.get(id_)) - _satisfaz(linha)
+        for data in alvos.get(posicao, ()):
+            resultado[data] = contagem
+    return list(resultado.items())
+
+def _descrever_mudanca(atributo, anterior, atual):
+    if atributo == 'userAccountControl':
+        desabilitada_antes = bool((anterior or 0) & 0x0002)
+        desabilitada_agora = bool((atual or 0) & 0x0002)
+        if desabilitada_antes != desabilitada_agora:
+            return 'Conta desabilitada' if desabilitada_agora else 'Conta reabilitada'
+    nome = ATRIBUTOS_COMPARADOS.get(atributo, atributo)
+    return f'Alteração de {nome}'
+
+def _formatar_valor_historico(atributo, valor):
+    if atributo == 'userAccountControl' and valor is not None:
+        return 'Inativo' if valor & 0x0002 else 'Ativo'
+    if atributo == 'whenCreated':
+        return _formatar_data(valor, 'N/A')
+    return _formatar_valor_mudanca(atributo, valor)
+
+def linha_do_tempo(login):
+    """
+    Eventos de uma conta (pelo login, mesmo que tenha sido renomeada) ao longo do histórico:
+    registro, desabilitação/reabilitação, mudanças de atributos e remoção, com o intervalo
+    entre a execução anterior e a que detectou cada mudança.
+    """
+    indice = _ler_indice_historico()
+    login = login.lower()
+    # Primeira passada: só a coluna de login, para achar as contas que já usaram esse login
+    alvos = set()
+    for _, registro in _iterar_execucoes(indice, desde=0):
+        ids, valores = registro['colunas'].get('sAMAccountName', ((), ()))
+        alvos.update(id_ for id_, valor in zip(ids, valores) if (valor or '').lower() == login)
+    if not alvos:
+        return []
+    
+    estado, guids = {}, {}
+    eventos = []
+    data_anterior = None
+    for _, registro in _iterar_execucoes(indice, desde=0):
+        anteriores = {id_: estado.get(id_) for id_ in alvos}
+        _aplicar_execucao(estado, guids, registro)
+        
+        data = datetime.fromisoformat(registro['data'])
+        for id_ in alvos:
+            antes, depois = anteriores.get(id_), estado.get(id_)
+            if antes is None and depois is None:
+                # Conta ainda não criada nesta execução (ou já removida)
+                continue
+            base = {'Data': data, 'Detectado Após': data_anterior, 'objectGUID': guids[id_]}
+            if antes is None and depois is not None:
+                eventos.append(dict(base, Evento='Conta registrada no histórico',
+                                    Valor=(depois.get('sAMAccountName') or 'N/A')))
+                antes = depois
+            if depois is None:
+                if antes is not None:
+                    eventos.append(dict(base, Evento='Conta removida', Valor=''))
+                continue
+            for atributo in ATRIBUTOS_HISTORICO:
+                if antes.get(atributo) != depois.get(atributo):
+                    valor_anterior = _desserializar_linha({atributo: antes.get(atributo)})[atributo]
+                    valor_atual = _desserializar_linha({atributo: depois.get(atributo)})[atributo]
+                    eventos.append(dict(base, Evento=_descrever_mudanca(atributo, valor_anterior, valor_atual),
+                                        Valor=f"{_formatar_valor_historico(atributo, valor_anterior)} -> "
+                                              f"{_formatar_valor_historico(atributo, valor_atual)}"))
+        data_anterior = data
+    return eventos
+
+def gerar_relatorio_historico():
+    """Série mensal de contas ativas no ano e, opcionalmente, a linha do tempo de um login"""
+    if not OPENPYXL_DISPONIVEL:
+        print("❌ ERRO: Biblioteca openpyxl não está disponível.")
+        return
+    
+    indice = _ler_indice_historico()
+    if not indice['execucoes']:
+        print("❌ Histórico vazio: salve um snapshot (opção 7) para começar a registrá-lo.")
+        return
+    print(f"\n🕓 HISTÓRICO DO DIRETÓRIO ({len(indice['execucoes'])} execuções, "
+          f"de {indice['execucoes'][0]['data'][:10]} a {indice['execucoes'][-1]['data'][:10]})")
+    
+    login = input("Login para a linha do tempo (Enter para a série mensal de contas ativas): ").strip()
+    if login:
+        eventos = linha_do_tempo(login)
+        if not eventos:
+            print(f"❌ Login '{login}' não encontrado no histórico.")
+            return
+        for evento in eventos:
+            evento['Data'] = evento['Data'].strftime('%d/%m/%Y %H:%M')
+            evento['Detectado Após'] = evento['Detectado Após'].strftime('%d/%m/%Y %H:%M') if evento['Detectado Após'] else 'N/A'
+            print(f"   • {evento['Data']}: {evento['Evento']} {evento['Valor']}")
+        nome_arquivo = f"Linha_do_Tempo_{login}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+        gerar_planilha(eventos, nome_arquivo, f"LINHA DO TEMPO - {login}",
+                       ['Data', 'Detectado Após', 'Evento', 'Valor', 'objectGUID'],
+                       ['Cada mudança ocorreu entre "Detectado Após" e "Data"'])
+        return eventos
+    
+    hoje = datetime.now()
+    datas = [datetime(hoje.year, mes, 1) for mes in range(1, hoje.month + 1)] + [hoje]
+    serie = serie_historico(P_ATIVA, datas)
+    dados = []
+    for data, quantidade in serie:
+        rotulo = 'Hoje' if data is hoje else data.strftime('%d/%m/%Y')
+        dados.append({'Data': rotulo, 'Contas Ativas': quantidade if quantidade is not None else 'Sem registro'})
+        print(f"   • {rotulo}: {dados[-1]['Contas Ativas']}")
+    nome_arquivo = f"Serie_Contas_Ativas_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    gerar_planilha(dados, nome_arquivo, f"CONTAS ATIVAS NO INÍCIO DE CADA MÊS - {hoje.year}", ['Data', 'Contas Ativas'],
+                   ['Estado da última execução registrada até cada data'])
+    return dados
+
+# ============================================================
+# PACOTE CONSOLIDADO DE AUDITORIA (UMA BUSCA, UMA PLANILHA)
+# ============================================================
+
+# Relatórios incluídos no pacote, na ordem das abas
+RELATORIOS_PACOTE = ['contas_ativas', 'desabilitadas_desde_abril', 'criadas_em_2024',
+                     'desabilitadas_em_2024', 'relacao_emails', 'auditoria_2024']
+
+def _nome_aba(titulo):
+    """Nome de aba válido no Excel: sem caracteres proibidos e com no máximo 31 caracteres"""
+    for caractere in '[]:*?/\\':
+        titulo = titulo.replace(caractere, '-')
+    return titulo.replace(' ', '_')[:31]
+
+def _escrever_aba(wb, titulo, colunas, dados, informacoes=None, total=None):
+    """
+    Escreve uma aba em uma planilha write_only, no mesmo layout de gerar_planilha.
+    `dados` pode ser um gerador; nesse caso `total` informa a contagem do cabeçalho.
+    """
+    ws = wb.create_sheet(_nome_aba(titulo))
+    for col in range(1, len(colunas) + 1):
+        ws.column_dimensions[chr(64 + col)].width = 25
+    
+    celula_titulo = WriteOnlyCell(ws, value=titulo)
+    celula_titulo.font = Font(bold=True, size=14)
+    ws.append([celula_titulo])
+    ws.append([f'Gerado em: {datetime.now().strftime("%d/%m/%Y às %H:%M:%S")}'])
+    ws.append([f'Total de registros: {len(dados) if total is None else total}'])
+    for informacao in informacoes or []:
+        ws.append([informacao])
+    ws.append([''])
+    
+    cabecalho = []
+    for coluna in colunas:
+        celula = WriteOnlyCell(ws, value=coluna)
+        celula.font = Font(bold=True, color="FFFFFF")
+        celula.fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+        celula.alignment = Alignment(horizontal="center")
+        cabecalho.append(celula)
+    ws.append(cabecalho)
+    
+    for usuario in dados:
+        ws.append([usuario.get(coluna, 'N/A') for coluna in colunas])
+
+def gerar_pacote_auditoria(conexao):
+    """
+    Gera todos os relatórios como abas de uma única planilha, mais uma aba de
+    resumo e as abas de qualidade dos dados. Os usuários são buscados uma única vez com a união dos atributos
+    de todos os relatórios, os predicados de todas as abas são avaliados juntos
+    pelo motor de regras e a planilha é gravada em modo streaming (write_only).
+    """
+    if not OPENPYXL_DISPONIVEL:
+        print("❌ ERRO: Biblioteca openpyxl não está disponível.")
+        return
+    
+    print("\n📦 GERANDO PACOTE CONSOLIDADO DE AUDITORIA")
+    especificacoes = {nome: RELATORIOS[nome] for nome in RELATORIOS_PACOTE}
+    atributos = sorted({a for especificacao in especificacoes.values() for a in atributos_relatorio(especificacao)}
+                       | set(ATRIBUTOS_QUALIDADE))
+    
+    base_dn = get_base_dn(conexao)
+    tabela = buscar_tabela_usuarios(conexao, base_dn, FILTRO_USUARIOS, atributos)
+    if not tabela['n']:
+        print("❌ Nenhum usuário encontrado.")
+        return
+    
+    regras = dict(REGRAS_AUDITORIA_2024)
+    regras.update({nome: especificacao['incluir'] for nome, especificacao in especificacoes.items()})
+    mascaras = avaliar_regras(compilar_regras(regras), tabela)
+    
+    processados = tabela['n']
+    incluidos = contar_mascara(mascaras['auditoria'])
+    ativos = contar_mascara(mascaras['ativas'])
+    resumo = [
+        {'Indicador': 'Usuários processados', 'Quantidade': processados},
+        {'Indicador': 'Incluídos na auditoria 2024', 'Quantidade': incluidos},
+        {'Indicador': 'Excluídos da auditoria 2024', 'Quantidade': processados - incluidos},
+        {'Indicador': 'Usuários ativos (auditoria)', 'Quantidade': ativos},
+        {'Indicador': 'Usuários inativos (auditoria)', 'Quantidade': incluidos - ativos},
+    ]
+    
+    nome_arquivo = f"Pacote_Auditoria_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    print(f"📝 Criando planilha: {nome_arquivo}")
+    
+    try:
+        wb = Workbook(write_only=True)
+        for nome, especificacao in especificacoes.items():
+            resumo.append({'Indicador': f"Aba {especificacao['titulo']}", 'Quantidade': contar_mascara(mascaras[nome])})
+        
+        # O resumo fica na primeira aba; cada aba seguinte é montada e gravada antes da próxima
+        _escrever_aba(wb, 'RESUMO', ['Indicador', 'Quantidade'], resumo)
+        for nome, especificacao in especificacoes.items():
+            dados = iterar_linhas_tabela(especificacao, tabela, mascaras[nome])
+            total = contar_mascara(mascaras[nome])
+            _escrever_aba(wb, especificacao['titulo'], especificacao['colunas'], dados, total=total)
+            print(f"   ✓ {especificacao['titulo']}: {total} registros")
+        escrever_abas_qualidade(wb, tabela, verificar_qualidade(tabela))
+        print("   ✓ Qualidade dos dados: duplicidades e campos ausentes")
+        
+        wb.save(nome_arquivo)
+        
+        print(f"✅ Pacote gerado com sucesso!")
+        print(f"   📄 Arquivo: {nome_arquivo}")
+        print(f"   📑 Abas: {len(especificacoes) + 4}")
+        
+        os.startfile(nome_arquivo)
+        print("✓ Arquivo aberto")
+    except Exception as e:
+        print(f"❌ Erro ao criar planilha: {e}")
+    
+    return resumo
+
+# ============================================================
+# IDADE E VENCIMENTO DE SENHAS
+# ============================================================
+
+TICKS_POR_DIA = 24 * 60 * 60 * 10**7
+
+# pwdLastSet e a data de vencimento calculada pelo próprio DC (já considera PSOs), na mesma busca
+ATRIBUTOS_SENHAS = ['sAMAccountName', 'displayName', 'userAccountControl', 'pwdLastSet',
+                    'msDS-UserPasswordExpiryTimeComputed']
+
+# Faixas: limites em dias (bisect_right) e um rótulo por faixa; o último rótulo é o das contas sem valor
+FAIXAS_IDADE_SENHA = (
+    [30, 90, 180, 365, 730],
+    ['Até 29 dias', '30 a 89 dias', '90 a 179 dias', '180 a 364 dias', '1 a 2 anos', 'Mais de 2 anos',
+     'Troca obrigatória no próximo logon'],
+)
+FAIXAS_VENCIMENTO_SENHA = (
+    [0, 8, 15, 31, 91],
+    ['Vencida', 'Vence em até 7 dias', 'Vence em 8 a 14 dias', 'Vence em 15 a 30 dias', 'Vence em 31 a 90 dias',
+     'Vence em mais de 90 dias', 'Não expira'],
+)
+
+P_SENHA_NUNCA_EXPIRA = ('flag', 'userAccountControl', 0x10000)  # Flag DONT_EXPIRE_PASSWORD
+
+REGRAS_SENHAS = {
+    'Senha nunca expira': P_SENHA_NUNCA_EXPIRA,
+    'Senha nunca expira (contas ativas)': ('e', P_ATIVA, P_SENHA_NUNCA_EXPIRA),
+    'Senha não obrigatória': ('flag', 'userAccountControl', 0x0020),  # PASSWD_NOTREQD
+    'Criptografia reversível': ('flag', 'userAccountControl', 0x0080),  # ENCRYPTED_TEXT_PWD_ALLOWED
+    'Cartão inteligente obrigatório': ('flag', 'userAccountControl', 0x40000),  # SMARTCARD_REQUIRED
+    'Contas desabilitadas': P_DESABILITADA,
+}
+
+_REGRAS_SENHAS_COMPILADAS = compilar_regras(REGRAS_SENHAS)
+
+def classificar_coluna(coluna, limites):
+    """Faixa de cada valor da coluna (bisect nos limites) em um bytearray; None vai para a última faixa"""
+    sem_valor = len(limites) + 1
+    return bytearray(sem_valor if valor is None else bisect.bisect_right(limites, valor) for valor in coluna)
+
+def contar_classes(classes, rotulos):
+    """Histograma de um bytearray de faixas: rótulo -> quantidade"""
+    return {rotulo: classes.count(indice) for indice, rotulo in enumerate(rotulos)}
+
+def _idade_maxima_senha(conexao, base_dn):
+    """maxPwdAge do domínio em ticks (positivo), ou None se as senhas do domínio não expiram"""
+    try:
+        with _sem_formatacao(conexao):
+            conexao.search(base_dn, '(objectClass=domain)', BASE, attributes=['maxPwdAge'])
+        valores = conexao.response[0]['raw_attributes'].get('maxPwdAge') if conexao.response else None
+        idade = -int(valores[0]) if valores else 0
+    except (LDAPException, ValueError, KeyError, IndexError):
+        return None
+    return idade if 0 < idade < FILETIME_NUNCA else None
+
+def analisar_senhas(tabela, idade_maxima=None, agora=None):
+    """
+    Calcula idade, vencimento e sinalizações das senhas de toda a tabela.
+
+    Tudo é feito por coluna em ticks inteiros: uma passada calcula as idades
+    em dias, outra o vencimento (o calculado pelo DC ou, na falta dele,
+    pwdLastSet + maxPwdAge), e as faixas saem de um bisect por valor em um
+    bytearray contado em C. As sinalizações de userAccountControl passam
+    pelo motor de regras como máscaras de bits.
+    """
+    agora = agora or datetime.now()
+    agora_ticks = datetime_para_filetime(agora)
+    colunas = tabela['colunas']
+    definidas = colunas['pwdLastSet']
+    controles = colunas['userAccountControl']
+    calculados = colunas.get('msDS-UserPasswordExpiryTimeComputed') or [None] * tabela['n']
+    
+    idades = [(agora_ticks - definida) // TICKS_POR_DIA if definida else None for definida in definidas]
+    
+    vencimentos = []
+    for definida, controle, calculado in zip(definidas, controles, calculados):
+        if (controle or 0) & 0x10000:
+            vencimentos.append(None)
+        elif calculado is not None:
+            vencimentos.append(None if calculado >= FILETIME_NUNCA else calculado)
+        elif not definida:
+            vencimentos.append(0)
+        else:
+            vencimentos.append(definida + idade_maxima if idade_maxima else None)
+    # Senha com troca obrigatória (0) conta como vencida
+    dias_vencimento = [None if vencimento is None else (vencimento - agora_ticks) // TICKS_POR_DIA if vencimento else -1
+                       for vencimento in vencimentos]
+    
+    classes_idade = classificar_coluna(idades, FAIXAS_IDADE_SENHA[0])
+    classes_vencimento = classificar_coluna(dias_vencimento, FAIXAS_VENCIMENTO_SENHA[0])
+    sinalizacoes = avaliar_regras(_REGRAS_SENHAS_COMPILADAS, tabela)
+    
+    return {
+        'n': tabela['n'],
+        'idades': idades,
+        'vencimentos': vencimentos,
+        'dias_vencimento': dias_vencimento,
+        'classes_idade': classes_idade,
+        'classes_vencimento': classes_vencimento,
+        'histograma_idade': contar_classes(classes_idade, FAIXAS_IDADE_SENHA[1]),
+        'histograma_vencimento': contar_classes(classes_vencimento, FAIXAS_VENCIMENTO_SENHA[1]),
+        'sinalizacoes': sinalizacoes,
+    }
+
+def _resumo_senhas(analise):
+    total = analise['n']
+    resumo = [{'Indicador': 'Usuários analisados', 'Quantidade': total, 'Percentual': '100.0%'}]
+    grupos = [
+        ('Idade da senha', analise['histograma_idade']),
+        ('Previsão de vencimento', analise['histograma_vencimento']),
+        ('Sinalização', {nome: contar_mascara(mascara) for nome, mascara in analise['sinalizacoes'].items()}),
+    ]
+    for grupo, contagens in grupos:
+        resumo.append({'Indicador': '', 'Quantidade': '', 'Percentual': ''})
+        for rotulo, quantidade in contagens.items():
+            resumo.append({
+                'Indicador': f'{grupo}: {rotulo}',
+                'Quantidade': quantidade,
+                'Percentual': f'{quantidade / total * 100:.1f}%' if total else '0.0%',
+            })
+    return resumo
+
+@functools.lru_cache(maxsize=4096)
+def _formatar_dia_filetime(dia):
+    return (_EPOCA_FILETIME + timedelta(days=dia)).strftime('%d/%m/%Y')
+
+def _formatar_ticks(ticks, padrao):
+    """Data (dd/mm/aaaa) de ticks do Windows; memoizada por dia, já que milhares de contas caem no mesmo dia"""
+    if not ticks or ticks >= FILETIME_NUNCA:
+        return padrao
+    return _formatar_dia_filetime(ticks // TICKS_POR_DIA)
+
+COLUNAS_SENHAS = ['Login', 'Nome', 'Status', 'Senha Definida em', 'Idade (dias)', 'Faixa de Idade',
+                  'Vencimento', 'Previsão', 'Sinalizações']
+
+def _detalhe_senhas(tabela, analise):
+    """Linhas da aba de detalhe, das senhas mais antigas para as mais novas (troca obrigatória primeiro)"""
+    colunas = tabela['colunas']
+    sinalizacoes = [(nome, set(indices_mascara(mascara))) for nome, mascara in analise['sinalizacoes'].items()
+                    if nome in ('Senha nunca expira', 'Senha não obrigatória', 'Criptografia reversível')]
+    rotulos_idade, rotulos_vencimento = FAIXAS_IDADE_SENHA[1], FAIXAS_VENCIMENTO_SENHA[1]
+    idades = analise['idades']
+    ordem = sorted(range(analise['n']), key=lambda i: (idades[i] is not None, -(idades[i] or 0)))
+    
+    detalhe = []
+    for i in ordem:
+        vencimento = analise['vencimentos'][i]
+        detalhe.append({
+            'Login': colunas['sAMAccountName'][i] or 'N/A',
+            'Nome': colunas['displayName'][i] or colunas['sAMAccountName'][i] or 'N/A',
+            'Status': 'Inativo' if (colunas['userAccountControl'][i] or 0) & 0x0002 else 'Ativo',
+            'Senha Definida em': _formatar_ticks(colunas['pwdLastSet'][i], 'Troca obrigatória'),
+            'Idade (dias)': idades[i] if idades[i] is not None else 'N/A',
+            'Faixa de Idade': rotulos_idade[analise['classes_idade'][i]],
+            'Vencimento': _formatar_ticks(vencimento, 'Nunca' if vencimento is None else 'Vencida'),
+            'Previsão': rotulos_vencimento[analise['classes_vencimento'][i]],
+            'Sinalizações': ', '.join(nome for nome, marcados in sinalizacoes if i in marcados) or '-',
+        })
+    return detalhe
+
+def gerar_relatorio_senhas(conexao):
+    """
+    Relatório de idade e vencimento de senhas: aba de resumo com as faixas de
+    idade, a previsão de vencimento e as sinalizações de userAccountControl,
+    e aba de detalhe por usuário. Uma única busca paginada traz os três atributos.
+    """
+    if not OPENPYXL_DISPONIVEL:
+        print("❌ ERRO: Biblioteca openpyxl não está disponível.")
+        return
+    
+    print("\n🔑 GERANDO RELATÓRIO DE IDADE E VENCIMENTO DE SENHAS")
+    base_dn = get_base_dn(conexao)
+    idade_maxima = _idade_maxima_senha(conexao, base_dn)
+    if idade_maxima:
+        print(f"   • Idade máxima de senha do domínio: {idade_maxima // TICKS_POR_DIA} dias")
+    else:
+        print("   • Senhas do domínio não expiram por padrão (maxPwdAge = 0)")
+    
+    try:
+        tabela = buscar_tabela_usuarios(conexao, base_dn, FILTRO_USUARIOS, ATRIBUTOS_SENHAS)
+    except Exception as e:
+        print(f"❌ Erro ao buscar usuários: {e}")
+        return
+    if not tabela['n']:
+        print("❌ Nenhum usuário encontrado.")
+        return
+    
+    inicio = time.perf_counter()
+    analise = analisar_senhas(tabela, idade_maxima)
+    resumo = _resumo_senhas(analise)
+    print(f"✓ Análise de {tabela['n']} usuários em {time.perf_counter() - inicio:.3f}s")
+    for rotulo, quantidade in analise['histograma_vencimento'].items():
+        print(f"   • {rotulo}: {quantidade}")
+    
+    nome_arquivo = f"Senhas_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    print(f"📝 Criando planilha: {nome_arquivo}")
+    try:
+        wb = Workbook(write_only=True)
+        informacoes = [f'Idade máxima de senha do domínio: {idade_maxima // TICKS_POR_DIA} dias' if idade_maxima
+                       else 'Idade máxima de senha do domínio: senhas não expiram']
+        _escrever_aba(wb, 'RESUMO SENHAS', ['Indicador', 'Quantidade', 'Percentual'], resumo, informacoes)
+        _escrever_aba(wb, 'DETALHE SENHAS', COLUNAS_SENHAS, _detalhe_senhas(tabela, analise))
+        wb.save(nome_arquivo)
+        
+        print(f"✅ Relatório gerado com sucesso!")
+        print(f"   📄 Arquivo: {nome_arquivo}")
+        
+        os.startfile(nome_arquivo)
+        print("✓ Arquivo aberto")
+    except Exception as e:
+        print(f"❌ Erro ao criar planilha: {e}")
+    
+    return resumo
+
+# ============================================================
+# HIERARQUIA ORGANIZACIONAL (GESTOR / DEPARTAMENTO)
+# ============================================================
+
+ATRIBUTOS_HIERARQUIA = ['distinguishedName', 'sAMAccountName', 'displayName', 'title', 'userAccountControl',
+                        'manager', 'department', 'company', 'memberOf']
+
+# Prestadores de serviço são identificados pelo grupo de organização (o mesmo usado na renovação de contas)
+GRUPO_PRESTADORES = 'CN=12 - Prestadores,'
+
+def montar_hierarquia(tabela):
+    """
+    Materializa a árvore gestor -> subordinados a partir do atributo manager.
+
+    Os DNs são indexados uma vez (DN -> linha) e cada linha aponta para a
+    linha do gestor. Gestores fora da busca viram raízes marcadas como
+    órfãs; ciclos (A gerencia B que gerencia A) são detectados em uma
+    passada e cortados no primeiro nó revisitado, que vira raiz. A ordem
+    em largura a partir das raízes permite acumular as contagens de cada
+    subárvore percorrendo-a de trás para frente, sem recursão.
+    """
+    n = tabela['n']
+    colunas = tabela['colunas']
+    indice = {(dn or '').lower(): i for i, dn in enumerate(colunas['distinguishedName'])}
+    
+    pai = [-1] * n
+    situacao = [''] * n
+    for i, gestor in enumerate(colunas['manager']):
+        if gestor:
+            pai[i] = indice.get(gestor.lower(), -1)
+            if pai[i] == -1:
+                situacao[i] = 'Gestor fora da base'
+            elif pai[i] == i:
+                pai[i] = -1
+                situacao[i] = 'Gestor de si mesmo'
+    
+    # 0 = não visitado, 1 = no caminho atual, 2 = concluído
+    estado = bytearray(n)
+    ciclos = []
+    for i in range(n):
+        caminho = []
+        j = i
+        while j != -1 and not estado[j]:
+            estado[j] = 1
+            caminho.append(j)
+            j = pai[j]
+        if j != -1 and estado[j] == 1:
+            ciclos.append(caminho[caminho.index(j):])
+            pai[j] = -1
+            situacao[j] = 'Ciclo de gestores'
+        for k in caminho:
+            estado[k] = 2
+    
+    # Percorrer as linhas na ordem do índice de nomes já deixa raízes e subordinados em ordem alfabética
+    por_nome = indice_ordenacao(tabela, 'Nome')
+    filhos = [[] for _ in range(n)]
+    for i in por_nome:
+        if pai[i] != -1:
+            filhos[pai[i]].append(i)
+    
+    raizes = [i for i in por_nome if pai[i] == -1]
+    ordem = list(raizes)
+    profundidade = [0] * n
+    posicao = 0
+    while posicao < len(ordem):
+        i = ordem[posicao]
+        for filho in filhos[i]:
+            profundidade[filho] = profundidade[i] + 1
+            ordem.append(filho)
+        posicao += 1
+    
+    desabilitadas = [bool((controle or 0) & 0x0002) for controle in colunas['userAccountControl']]
+    prestadores = [any(grupo.startswith(GRUPO_PRESTADORES) for grupo in grupos or ()) for grupos in colunas['memberOf']]
+    equipe = [1] * n
+    inativos = [int(d) for d in desabilitadas]
+    terceiros = [int(p) for p in prestadores]
+    for i in reversed(ordem):
+        p = pai[i]
+        if p != -1:
+            equipe[p] += equipe[i]
+            inativos[p] += inativos[i]
+            terceiros[p] += terceiros[i]
+    
+    return {
+        'n': n,
+        'pai': pai,
+        'filhos': filhos,
+        'raizes': raizes,
+        'profundidade': profundidade,
+        'situacao': situacao,
+        'ciclos': ciclos,
+        'desabilitadas': desabilitadas,
+        'prestadores': prestadores,
+        'equipe': equipe,
+        'inativos': inativos,
+        'terceiros': terceiros,
+    }
+
+def contagem_departamentos(tabela, hierarquia):
+    """Pessoas, ativos, inativos e prestadores por (empresa, departamento)"""
+    contagens = {}
+    colunas = tabela['colunas']
+    for empresa, departamento, desabilitada, prestador in zip(colunas['company'], colunas['department'],
+                                                               hierarquia['desabilitadas'], hierarquia['prestadores']):
+        chave = (empresa or 'Não informada', departamento or 'Não informado')
+        contagem = contagens.get(chave)
+        if contagem is None:
+            contagem = contagens[chave] = [0, 0, 0]
+        contagem[0] += 1
+        contagem[1] += desabilitada
+        contagem[2] += prestador
+    return [
+        {'Empresa': empresa, 'Departamento': departamento, 'Pessoas': pessoas, 'Ativos': pessoas - inativos,
+         'Inativos': inativos, 'Prestadores': prestadores}
+        for (empresa, departamento), (pessoas, inativos, prestadores) in sorted(contagens.items())
+    ]
+
+COLUNAS_ORGANOGRAMA = ['Nível', 'Gestor', 'Login', 'Cargo', 'Departamento', 'Subordinados Diretos',
+                       'Equipe Total', 'Ativos', 'Inativos', 'Prestadores']
+COLUNAS_EXCECOES_HIERARQUIA = ['Login', 'Nome', 'Gestor (manager)', 'Situação']
+
+def linhas_organograma(tabela, hierarquia):
+    """Organograma em pré-ordem (cada gestor seguido da sua equipe), só com quem tem subordinados"""
+    colunas = tabela['colunas']
+    filhos = hierarquia['filhos']
+    linhas = []
+    pilha = [i for i in reversed(hierarquia['raizes']) if filhos[i]]
+    while pilha:
+        i = pilha.pop()
+        equipe = hierarquia['equipe'][i] - 1
+        inativos = hierarquia['inativos'][i] - hierarquia['desabilitadas'][i]
+        nome = colunas['displayName'][i] or colunas['sAMAccountName'][i] or 'N/A'
+        linhas.append({
+            'Nível': hierarquia['profundidade'][i] + 1,
+            'Gestor': '    ' * hierarquia['profundidade'][i] + nome,
+            'Login': colunas['sAMAccountName'][i] or 'N/A',
+            'Cargo': colunas['title'][i] or 'Não informado',
+            'Departamento': colunas['department'][i] or 'Não informado',
+            'Subordinados Diretos': len(filhos[i]),
+            'Equipe Total': equipe,
+            'Ativos': equipe - inativos,
+            'Inativos': inativos,
+            'Prestadores': hierarquia['terceiros'][i] - hierarquia['prestadores'][i],
+        })
+        pilha.extend(filho for filho in reversed(filhos[i]) if filhos[filho])
+    return linhas
+
+def gerar_relatorio_hierarquia(conexao):
+    """
+    Organograma com contagens por subárvore de gestor e por departamento,
+    a partir de uma única busca paginada de manager, department e company.
+    """
+    if not OPENPYXL_DISPONIVEL:
+        print("❌ ERRO: Biblioteca openpyxl não está disponível.")
+        return
+    
+    print("\n🏢 GERANDO ORGANOGRAMA E CONTAGENS POR DEPARTAMENTO")
+    base_dn = get_base_dn(conexao)
+    try:
+        tabela = buscar_tabela_usuarios(conexao, base_dn, FILTRO_USUARIOS, ATRIBUTOS_HIERARQUIA)
+    except Exception as e:
+        print(f"❌ Erro ao buscar usuários: {e}")
+        return
+    if not tabela['n']:
+        print("❌ Nenhum usuário encontrado.")
+        return
+    
+    inicio = time.perf_counter()
+    hierarquia = montar_hierarquia(tabela)
+    departamentos = contagem_departamentos(tabela, hierarquia)
+    organograma = linhas_organograma(tabela, hierarquia)
+    print(f"✓ Hierarquia de {tabela['n']} usuários montada em {time.perf_counter() - inicio:.3f}s")
+    
+    colunas = tabela['colunas']
+    excecoes = [
+        {'Login': colunas['sAMAccountName'][i] or 'N/A',
+         'Nome': colunas['displayName'][i] or colunas['sAMAccountName'][i] or 'N/A',
+         'Gestor (manager)': colunas['manager'][i] or 'N/A',
+         'Situação': situacao}
+        for i, situacao in enumerate(hierarquia['situacao']) if situacao
+    ]
+    sem_gestor = sum(1 for i in hierarquia['raizes'] if not colunas['manager'][i])
+    resumo = [
+        {'Indicador': 'Usuários processados', 'Quantidade': tabela['n']},
+        {'Indicador': 'Gestores (com ao menos um subordinado)', 'Quantidade': len(organograma)},
+        {'Indicador': 'Usuários sem gestor', 'Quantidade': sem_gestor},
+        {'Indicador': 'Gestor fora da base', 'Quantidade': hierarquia['situacao'].count('Gestor fora da base')},
+        {'Indicador': 'Ciclos de gestores (cortados)', 'Quantidade': len(hierarquia['ciclos'])},
+        {'Indicador': 'Departamentos', 'Quantidade': len(departamentos)},
+        {'Indicador': 'Níveis hierárquicos', 'Quantidade': max(hierarquia['profundidade']) + 1},
+    ]
+    for linha in resumo:
+        print(f"   • {linha['Indicador']}: {linha['Quantidade']}")
+    
+    nome_arquivo = f"Organograma_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    print(f"📝 Criando planilha: {nome_arquivo}")
+    try:
+        wb = Workbook(write_only=True)
+        _escrever_aba(wb, 'RESUMO ORGANIZACIONAL', ['Indicador', 'Quantidade'], resumo)
+        _escrever_aba(wb, 'ORGANOGRAMA', COLUNAS_ORGANOGRAMA, organograma)
+        _escrever_aba(wb, 'POR DEPARTAMENTO', ['Empresa', 'Departamento', 'Pessoas', 'Ativos', 'Inativos', 'Prestadores'],
+                      departamentos)
+        _escrever_aba(wb, 'ÓRFÃOS E CICLOS', COLUNAS_EXCECOES_HIERARQUIA, excecoes)
+        wb.save(nome_arquivo)
+        
+        print(f"✅ Relatório gerado com sucesso!")
+        print(f"   📄 Arquivo: {nome_arquivo}")
+        
+        os.startfile(nome_arquivo)
+        print("✓ Arquivo aberto")
+    except Exception as e:
+        print(f"❌ Erro ao criar planilha: {e}")
+    
+    return resumo
+
+# ============================================================
+# QUALIDADE DOS DADOS E DUPLICIDADES
+# ============================================================
+
+# Atributos que deveriam ser únicos: atributo -> (rótulo, normalização da chave)
+CHAVES_DUPLICIDADE = {
+    'mail': ('E-mail', lambda valor: valor.strip().lower()),
+    'employeeID': ('Matrícula', lambda valor: valor.strip().lstrip('0') or '0'),
+    'displayName': ('Nome de exibição', _sem_acentos),
+}
+
+# Campos obrigatórios de uma conta: atributo -> rótulo
+CAMPOS_OBRIGATORIOS = {
+    'displayName': 'Nome',
+    'mail': 'E-mail',
+    'title': 'Cargo',
+    'department': 'Departamento',
+    'employeeID': 'Matrícula',
+    'manager': 'Gestor',
+}
+
+ATRIBUTOS_QUALIDADE = sorted({'sAMAccountName', 'userAccountControl'} | set(CHAVES_DUPLICIDADE) | set(CAMPOS_OBRIGATORIOS))
+
+COLUNAS_DUPLICIDADES = ['Campo', 'Valor', 'Ocorrências', 'Login', 'Nome', 'Status']
+COLUNAS_CAMPOS_AUSENTES = ['Login', 'Nome', 'Status', 'Campos Ausentes']
+
+def verificar_qualidade(tabela):
+    """
+    Verifica duplicidades e campos obrigatórios ausentes em tempo linear.
+
+    Cada atributo de CHAVES_DUPLICIDADE ganha um índice (valor normalizado ->
+    linhas) montado em uma passada pela coluna; os grupos com mais de uma
+    linha são as duplicidades. Os campos ausentes são contados na mesma
+    tabela, separando as contas ativas das desabilitadas.
+    """
+    colunas = tabela['colunas']
+    desabilitadas = [bool((controle or 0) & 0x0002) for controle in colunas['userAccountControl']]
+    
+    duplicidades = {}
+    for atributo, (_, normalizar) in CHAVES_DUPLICIDADE.items():
+        indice = {}
+        for i, valor in enumerate(colunas[atributo]):
+            if valor:
+                indice.setdefault(normalizar(valor), []).append(i)
+        duplicidades[atributo] = sorted(
+            ((colunas[atributo][linhas[0]], linhas) for linhas in indice.values() if len(linhas) > 1),
+            key=lambda grupo: (-len(grupo[1]), _sem_acentos(grupo[0])),
+        )
+    
+    ausentes = {}
+    for atributo in CAMPOS_OBRIGATORIOS:
+        ausentes[atributo] = [i for i, valor in enumerate(colunas[atributo]) if valor is None or valor == '']
+    
+    return {
+        'n': tabela['n'],
+        'desabilitadas': desabilitadas,
+        'duplicidades': duplicidades,
+        'ausentes': ausentes,
+    }
+
+def resumo_qualidade(qualidade):
+    """Linhas da aba de resumo: grupos/contas duplicadas por chave e campos ausentes (todas e só ativas)"""
+    desabilitadas = qualidade['desabilitadas']
+    resumo = [{'Indicador': 'Usuários verificados', 'Todas as contas': qualidade['n'],
+               'Contas ativas': qualidade['n'] - sum(desabilitadas)}]
+    for atributo, grupos in qualidade['duplicidades'].items():
+        rotulo = CHAVES_DUPLICIDADE[atributo][0]
+        linhas = [i for _, indices in grupos for i in indices]
+        resumo.append({'Indicador': f'Duplicidade de {rotulo}: grupos', 'Todas as contas': len(grupos),
+                       'Contas ativas': sum(1 for _, indices in grupos
+                                            if sum(1 for i in indices if not desabilitadas[i]) > 1)})
+        resumo.append({'Indicador': f'Duplicidade de {rotulo}: contas', 'Todas as contas': len(linhas),
+                       'Contas ativas': sum(1 for i in linhas if not desabilitadas[i])})
+    for atributo, linhas in qualidade['ausentes'].items():
+        resumo.append({'Indicador': f'Sem {CAMPOS_OBRIGATORIOS[atributo]}', 'Todas as contas': len(linhas),
+                       'Contas ativas': sum(1 for i in linhas if not desabilitadas[i])})
+    return resumo
+
+def linhas_duplicidades(tabela, qualidade):
+    """Uma linha por conta de cada grupo de duplicidade, agrupadas por campo e valor"""
+    colunas = tabela['colunas']
+    linhas = []
+    for atributo, grupos in qualidade['duplicidades'].items():
+        rotulo = CHAVES_DUPLICIDADE[atributo][0]
+        for valor, indices in grupos:
+            for i in indices:
+                linhas.append({
+                    'Campo': rotulo,
+                    'Valor': valor,
+                    'Ocorrências': len(indices),
+                    'Login': colunas['sAMAccountName'][i] or 'N/A',
+                    'Nome': colunas['displayName'][i] or 'N/A',
+                    'Status': 'Inativo' if qualidade['desabilitadas'][i] else 'Ativo',
+                })
+    return linhas
+
+def linhas_campos_ausentes(tabela, qualidade):
+    """Contas ativas com ao menos um campo obrigatório ausente, com a lista dos campos"""
+    colunas = tabela['colunas']
+    faltando = {}
+    for atributo, indices in qualidade['ausentes'].items():
+        for i in indices:
+            if not qualidade['desabilitadas'][i]:
+                faltando.setdefault(i, []).append(CAMPOS_OBRIGATORIOS[atributo])
+    return [
+        {'Login': colunas['sAMAccountName'][i] or 'N/A',
+         'Nome': colunas['displayName'][i] or colunas['sAMAccountName'][i] or 'N/A',
+         'Status': 'Ativo',
+         'Campos Ausentes': ', '.join(faltando[i])}
+        for i in indice_ordenacao(tabela, 'Login') if i in faltando
+    ]
+
+def escrever_abas_qualidade(wb, tabela, qualidade):
+    """Abas de resumo, duplicidades e campos ausentes; usada pelo relatório próprio e pelo pacote"""
+    _escrever_aba(wb, 'QUALIDADE DOS DADOS', ['Indicador', 'Todas as contas', 'Contas ativas'], resumo_qualidade(qualidade))
+    _escrever_aba(wb, 'DUPLICIDADES', COLUNAS_DUPLICIDADES, linhas_duplicidades(tabela, qualidade))
+    _escrever_aba(wb, 'CAMPOS AUSENTES', COLUNAS_CAMPOS_AUSENTES, linhas_campos_ausentes(tabela, qualidade))
+
+def gerar_relatorio_qualidade(conexao):
+    """Relatório de qualidade dos dados: duplicidades de e-mail, matrícula e nome e campos obrigatórios ausentes"""
+    if not OPENPYXL_DISPONIVEL:
+        print("❌ ERRO: Biblioteca openpyxl não está disponível.")
+        return
+    
+    print("\n🧹 VERIFICANDO QUALIDADE DOS DADOS")
+    base_dn = get_base_dn(conexao)
+    try:
+        tabela = buscar_tabela_usuarios(conexao, base_dn, FILTRO_USUARIOS, ATRIBUTOS_QUALIDADE)
+    except Exception as e:
+        print(f"❌ Erro ao buscar usuários: {e}")
+        return
+    if not tabela['n']:
+        print("❌ Nenhum usuário encontrado.")
+        return
+    
+    inicio = time.perf_counter()
+    qualidade = verificar_qualidade(tabela)
+    print(f"✓ Verificação de {tabela['n']} usuários em {time.perf_counter() - inicio:.3f}s")
+    resumo = resumo_qualidade(qualidade)
+    for linha in resumo:
+        print(f"   • {linha['Indicador']}: {linha['Todas as contas']} ({linha['Contas ativas']} ativas)")
+    
+    nome_arquivo = f"Qualidade_Dados_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    print(f"📝 Criando planilha: {nome_arquivo}")
+    try:
+        wb = Workbook(write_only=True)
+        escrever_abas_qualidade(wb, tabela, qualidade)
+        wb.save(nome_arquivo)
+        
+        print(f"✅ Relatório gerado com sucesso!")
+        print(f"   📄 Arquivo: {nome_arquivo}")
         
-        # Abre o arquivo automaticamente
         os.startfile(nome_arquivo)
         print("✓ Arquivo aberto")
-        
     except Exception as e:
         print(f"❌ Erro ao criar planilha: {e}")
+    
+    return resumo
 
-def gerar_auditoria_2024(conexao):
-    """Gera relatório de auditoria 2024 com critérios específicos"""
-    if not OPENPYXL_DISPONIVEL:
-        print("❌ ERRO: Biblioteca openpyxl não está disponível.")
-        print("Para usar esta função, instale com: pip install openpyxl")
-        return
+# ============================================================
+# BASE SQL DA TABELA DE USUÁRIOS (CONSULTAS AD HOC)
+# ============================================================
+
+# A tabela de usuários é gravada em um SQLite local com índices; perguntas novas viram uma consulta SQL
+ARQUIVO_BASE_CONSULTAS = 'usuarios.db'
+
+ATRIBUTOS_BASE_CONSULTAS = ['objectGUID', 'distinguishedName', 'sAMAccountName', 'displayName', 'mail', 'title',
+                            'department', 'company', 'employeeID', 'manager', 'userAccountControl', 'whenCreated',
+                            'lastLogon', 'lastLogonTimestamp', 'accountExpires', 'pwdLastSet', 'memberOf']
+
+# Colunas da tabela 'usuarios': nome -> (tipo SQL, valor a partir da linha tipada)
+# Datas são gravadas como texto ISO (AAAA-MM-DD hh:mm:ss), comparáveis diretamente: criado_em >= '2024-07-01'
+def _data_sql(valor):
+    return valor.isoformat(sep=' ', timespec='seconds') if valor else None
+
+COLUNAS_BASE_CONSULTAS = {
+    'guid': ('TEXT PRIMARY KEY', lambda l: l.get('objectGUID')),
+    'login': ('TEXT COLLATE NOCASE', lambda l: l.get('sAMAccountName')),
+    'nome': ('TEXT', lambda l: l.get('displayName') or l.get('sAMAccountName')),
+    'email': ('TEXT COLLATE NOCASE', lambda l: l.get('mail')),
+    'cargo': ('TEXT', lambda l: l.get('title')),
+    'departamento': ('TEXT', lambda l: l.get('department')),
+    'empresa': ('TEXT', lambda l: l.get('company')),
+    'matricula': ('TEXT', lambda l: l.get('employeeID')),
+    'status': ('TEXT', lambda l: 'Inativo' if (l.get('userAccountControl') or 0) & 0x0002 else 'Ativo'),
+    'uac': ('INTEGER', lambda l: l.get('userAccountControl')),
+    'prestador': ('INTEGER', lambda l: int(any(g.startswith(GRUPO_PRESTADORES) for g in l.get('memberOf') or []))),
+    'criado_em': ('TEXT', lambda l: _data_sql(l.get('whenCreated'))),
+    'ultimo_logon': ('TEXT', lambda l: _data_sql(valor_campo(l, 'ultimoLogon'))),
+    'expira_em': ('TEXT', lambda l: _data_sql(l.get('accountExpires'))),
+    'senha_definida_em': ('TEXT', lambda l: _data_sql(filetime_para_datetime(l.get('pwdLastSet')))),
+    'gestor': ('TEXT', lambda l: l.get('manager')),
+    'dn': ('TEXT', lambda l: l.get('distinguishedName')),
+}
+
+ESQUEMA_BASE_CONSULTAS = f"""
+    CREATE TABLE usuarios ({', '.join(f'{nome} {tipo}' for nome, (tipo, _) in COLUNAS_BASE_CONSULTAS.items())},
+                           ordem_nome INTEGER);
+    CREATE TABLE grupos (guid TEXT NOT NULL, grupo TEXT NOT NULL COLLATE NOCASE, grupo_dn TEXT NOT NULL);
+    CREATE TABLE metadados (chave TEXT PRIMARY KEY, valor TEXT);
+    CREATE INDEX idx_usuarios_login ON usuarios (login);
+    CREATE INDEX idx_usuarios_status ON usuarios (status, criado_em);
+    CREATE INDEX idx_usuarios_criado_em ON usuarios (criado_em);
+    CREATE INDEX idx_usuarios_ultimo_logon ON usuarios (ultimo_logon);
+    CREATE INDEX idx_usuarios_expira_em ON usuarios (expira_em);
+    CREATE INDEX idx_usuarios_ordem_nome ON usuarios (ordem_nome);
+    CREATE INDEX idx_grupos_grupo ON grupos (grupo, guid);
+    CREATE INDEX idx_grupos_guid ON grupos (guid);
+"""
+
+# Consultas prontas, usadas pelo nome (@nome) no menu e em --consulta
+CONSULTAS_SALVAS = {
+    'prestadores_sem_email_3tri': (
+        "SELECT login, nome, departamento, criado_em FROM usuarios "
+        "WHERE prestador = 1 AND email IS NULL AND criado_em >= '2024-07-01' AND criado_em < '2024-10-01' "
+        "ORDER BY ordem_nome"
+    ),
+    'ativas_sem_logon_90_dias': (
+        "SELECT login, nome, cargo, ultimo_logon FROM usuarios "
+        "WHERE status = 'Ativo' AND (ultimo_logon IS NULL OR ultimo_logon < datetime('now', '-90 days')) "
+        "ORDER BY ultimo_logon"
+    ),
+    'membros_por_grupo': (
+        "SELECT grupo, COUNT(*) AS membros, SUM(u.status = 'Ativo') AS ativos FROM grupos g "
+        "JOIN usuarios u USING (guid) GROUP BY grupo ORDER BY membros DESC"
+    ),
+}
+
+def _nome_grupo(dn):
+    """CN de um grupo a partir do DN (primeiro RDN, sem o prefixo CN=)"""
+    rdn = re.split(r'(?<!\\),', dn, maxsplit=1)[0]
+    return rdn.split('=', 1)[-1].replace('\\,', ',')
+
+def gravar_base_consultas(tabela, caminho=None):
+    """
+    Grava a tabela de usuários na base SQLite, substituindo a anterior.
+    A base nova é montada em um arquivo temporário e só então troca de lugar com a atual,
+    de modo que consultas em andamento nunca veem uma carga pela metade.
+    """
+    caminho = caminho or ARQUIVO_BASE_CONSULTAS
+    temporario = caminho + '.novo'
+    if os.path.exists(temporario):
+        os.remove(temporario)
     
-    base_dn = get_base_dn(conexao)
+    formatadores = [formatar for _, formatar in COLUNAS_BASE_CONSULTAS.values()]
+    banco = sqlite3.connect(temporario)
+    try:
+        banco.executescript("PRAGMA journal_mode = OFF; PRAGMA synchronous = OFF;" + ESQUEMA_BASE_CONSULTAS)
+        grupos = []
+        with banco:
+            # Gravadas na ordem do índice de nomes: ordem_nome traz a colação sem acentos para o SQL (ORDER BY ordem_nome)
+            def _usuarios():
+                for posicao, indice in enumerate(indice_ordenacao(tabela, 'Nome')):
+                    linha = linha_tabela(tabela, indice)
+                    valores = [formatar(linha) for formatar in formatadores]
+                    grupos.extend((valores[0], _nome_grupo(dn), dn) for dn in linha.get('memberOf') or [])
+                    valores.append(posicao)
+                    yield valores
+            banco.executemany(f"INSERT OR REPLACE INTO usuarios VALUES ({', '.join('?' * (len(formatadores) + 1))})", _usuarios())
+            banco.executemany("INSERT INTO grupos VALUES (?, ?, ?)", grupos)
+            banco.executemany("INSERT INTO metadados VALUES (?, ?)", [
+                ('carregado_em', datetime.now().isoformat(sep=' ', timespec='seconds')),
+                ('usuarios', str(tabela['n'])),
+            ])
+        banco.execute("ANALYZE")
+    finally:
+        banco.close()
+    os.replace(temporario, caminho)
+    return caminho
+
+def carregar_base_consultas(conexao, caminho=None):
+    """Busca todos os usuários uma única vez e grava a base de consultas"""
+    print("\n🗄 CARREGANDO BASE DE CONSULTAS")
+    tabela = buscar_tabela_usuarios(conexao, get_base_dn(conexao), FILTRO_USUARIOS, ATRIBUTOS_BASE_CONSULTAS)
+    inicio = time.perf_counter()
+    caminho = gravar_base_consultas(tabela, caminho)
+    print(f"✓ Base {caminho} gravada em {time.perf_counter() - inicio:.2f}s ({tabela['n']} usuários)")
+    return caminho
+
+def data_base_consultas(caminho=None):
+    """Data da última carga da base de consultas (None se ainda não existe)"""
+    caminho = caminho or ARQUIVO_BASE_CONSULTAS
+    if not os.path.exists(caminho):
+        return None
+    banco = sqlite3.connect(f"file:{urllib.parse.quote(os.path.abspath(caminho))}?mode=ro", uri=True)
+    try:
+        return banco.execute("SELECT valor FROM metadados WHERE chave = 'carregado_em'").fetchone()[0]
+    finally:
+        banco.close()
+
+def executar_consulta(sql, parametros=(), caminho=None):
+    """
+    Executa uma consulta na base (aberta somente para leitura) e devolve (colunas, linhas).
+    '@nome' executa uma das CONSULTAS_SALVAS.
+    """
+    if sql.startswith('@'):
+        if sql[1:] not in CONSULTAS_SALVAS:
+            raise ValueError(f"Consulta salva desconhecida: {sql[1:]} (disponíveis: {', '.join(CONSULTAS_SALVAS)})")
+        sql = CONSULTAS_SALVAS[sql[1:]]
+    caminho = caminho or ARQUIVO_BASE_CONSULTAS
+    banco = sqlite3.connect(f"file:{urllib.parse.quote(os.path.abspath(caminho))}?mode=ro", uri=True)
+    try:
+        cursor = banco.execute(sql, parametros)
+        colunas = [descricao[0] for descricao in cursor.description or []]
+        return colunas, cursor.fetchall()
+    finally:
+        banco.close()
+
+def exportar_consulta(sql, colunas, linhas):
+    """Exporta o resultado de uma consulta com a mesma formatação dos demais relatórios"""
+    nome_arquivo = f"Consulta_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    dados = [dict(zip(colunas, linha)) for linha in linhas]
+    gerar_planilha(dados, nome_arquivo, 'CONSULTA SQL', colunas,
+                   [f'Consulta: {sql}', f'Base carregada em: {data_base_consultas()}'])
+    return nome_arquivo
+
+def consulta_sql(conexao, sql=None, exportar=None):
+    """
+    Consulta interativa (ou única, com `sql`) à base de usuários.
+    A base é carregada do AD na primeira vez e, depois, só quando o usuário pede.
+    """
+    carregada_em = data_base_consultas()
+    if carregada_em is None:
+        carregar_base_consultas(conexao)
+    elif sql is None and input(f"Base carregada em {carregada_em}. Recarregar do AD? (S/N) [N]: ").strip().upper() == 'S':
+        carregar_base_consultas(conexao)
     
-    print("\n📊 GERANDO AUDITORIA 2024")
-    print("Aplicando critérios específicos de data e status...")
+    if sql is None:
+        print("\n🔎 CONSULTA SQL - tabelas: usuarios, grupos (guid, grupo, grupo_dn), metadados")
+        print(f"   Colunas de usuarios: {', '.join(COLUNAS_BASE_CONSULTAS)}, ordem_nome")
+        print(f"   Consultas salvas: {', '.join('@' + nome for nome in CONSULTAS_SALVAS)}")
     
-    # Define as datas de corte
-    data_inicio_2024 = datetime(2024, 1, 1)
-    data_fim_periodo = datetime(2025, 1, 1)
+    while True:
+        texto = sql if sql is not None else input("\nSQL (em branco para voltar): ").strip()
+        if not texto:
+            return
+        try:
+            inicio = time.perf_counter()
+            colunas, linhas = executar_consulta(texto)
+        except (sqlite3.Error, ValueError) as e:
+            print(f"❌ Erro na consulta: {e}")
+            if sql is not None:
+                return
+            continue
+        print(f"✓ {len(linhas)} linha(s) em {(time.perf_counter() - inicio) * 1000:.1f} ms")
+        for linha in linhas[:20]:
+            print("   " + " | ".join('' if valor is None else str(valor) for valor in linha))
+        if len(linhas) > 20:
+            print(f"   ... mais {len(linhas) - 20} linha(s)")
+        
+        if linhas and colunas and OPENPYXL_DISPONIVEL:
+            if sql is None:
+                exportar = input("Exportar para Excel? (S/N) [N]: ").strip().upper() == 'S'
+            if exportar:
+                exportar_consulta(texto, colunas, linhas)
+        if sql is not None:
+            return colunas, linhas
+
+# ============================================================
+# ESPELHO EM MEMÓRIA ATUALIZADO POR NOTIFICAÇÕES DO AD
+# ============================================================
+
+# Controles LDAP do AD: notificação de mudanças e inclusão de objetos excluídos
+OID_NOTIFICACAO = '1.2.840.113556.1.4.528'
+OID_MOSTRAR_EXCLUIDOS = '1.2.840.113556.1.4.417'
+
+ATRIBUTOS_ESPELHO = ATRIBUTOS_SNAPSHOT + ['memberOf']
+
+def criar_espelho():
+    """Estrutura do espelho: usuários por chave (objectGUID) e índices por DN, login e grupo"""
+    return {
+        'usuarios': {},
+        'dns': {},
+        'logins': {},
+        'grupos': {},
+        'versao': 0,
+        'atualizado_em': None,
+        'tabela': None,
+        'trava': threading.RLock(),
+    }
+
+def _chave_espelho(linha, dn):
+    # Servidores de teste sem objectGUID (OpenLDAP, 389-ds) usam o DN como chave
+    return linha.get('objectGUID') or dn.lower()
+
+def _espelho_remover(espelho, chave):
+    anterior = espelho['usuarios'].pop(chave, None)
+    if anterior is None:
+        return False
+    espelho['dns'].pop(anterior['dn'].lower(), None)
+    if anterior.get('sAMAccountName'):
+        espelho['logins'].pop(anterior['sAMAccountName'].lower(), None)
+    for grupo in anterior.get('memberOf') or []:
+        membros = espelho['grupos'].get(grupo.lower())
+        if membros:
+            membros.discard(chave)
+    return True
+
+def _espelho_inserir(espelho, linha, dn):
+    chave = _chave_espelho(linha, dn)
+    _espelho_remover(espelho, chave)
+    linha['dn'] = dn
+    espelho['usuarios'][chave] = linha
+    espelho['dns'][dn.lower()] = chave
+    if linha.get('sAMAccountName'):
+        espelho['logins'][linha['sAMAccountName'].lower()] = chave
+    for grupo in linha.get('memberOf') or []:
+        espelho['grupos'].setdefault(grupo.lower(), set()).add(chave)
+
+def _espelho_atualizar_grupo(espelho, dn_grupo, membros):
+    """Atualiza o índice de um grupo: o memberOf dos usuários não gera notificação própria no AD"""
+    atuais = {espelho['dns'][membro.lower()] for membro in membros if membro.lower() in espelho['dns']}
+    anteriores = espelho['grupos'].get(dn_grupo.lower(), set())
+    if atuais == anteriores:
+        return False
+    for chave in anteriores - atuais:
+        usuario = espelho['usuarios'].get(chave)
+        if usuario:
+            usuario['memberOf'] = [g for g in usuario.get('memberOf') or [] if g.lower() != dn_grupo.lower()]
+    for chave in atuais - anteriores:
+        usuario = espelho['usuarios'][chave]
+        usuario['memberOf'] = (usuario.get('memberOf') or []) + [dn_grupo]
+    espelho['grupos'][dn_grupo.lower()] = atuais
+    return True
+
+def ler_membros_grupo(conexao, dn_grupo):
+    """
+    Lê todos os membros de um grupo. Acima de 1.500 valores o AD devolve o
+    atributo em faixas (member;range=0-1499), que são pedidas até a última
+    (terminada em '*'). Retorna None se o grupo não puder ser lido.
+    """
+    membros, atributo = [], 'member'
+    while True:
+        conexao.search(dn_grupo, '(objectClass=group)', BASE, attributes=[atributo])
+        respostas = [r for r in conexao.response or [] if r.get('type') == 'searchResEntry']
+        if not respostas:
+            return None
+        brutos = respostas[0].get('raw_attributes', {})
+        if 'member' in brutos:
+            # Grupo pequeno, ou faixas já unidas pelo auto_range do ldap3
+            return membros + _decodificar_lista(brutos['member'])
+        chave = next((nome for nome in brutos if nome.lower().startswith('member;range=')), None)
+        if chave is None:
+            return membros
+        membros.extend(_decodificar_lista(brutos[chave]))
+        fim = chave.rpartition('-')[2]
+        if fim == '*':
+            return membros
+        atributo = f'member;range={int(fim) + 1}-*'
+
+def _membros_notificacao(mudanca, conexao):
+    """
+    Membros de um grupo recebido por notificação. Se o atributo vier ausente
+    ou em faixas, relê o grupo; sem conexão, retorna None para manter o índice.
+    """
+    brutos = mudanca.get('raw_attributes', {})
+    if 'member' in brutos and not any(';range=' in nome for nome in brutos):
+        return _decodificar_lista(brutos['member'])
+    if conexao is None:
+        return None
+    try:
+        return ler_membros_grupo(conexao, mudanca['dn'])
+    except LDAPException as e:
+        print(f"⚠ Não foi possível reler os membros de {mudanca['dn']}: {e}")
+        return None
+
+def _espelho_alterado(espelho):
+    espelho['versao'] += 1
+    espelho['atualizado_em'] = datetime.now()
+    espelho['tabela'] = None
+
+def carregar_espelho(espelho, conexao, base_dn):
+    """Carrega o snapshot completo dos usuários no espelho"""
+    dados_usuarios = buscar_usuarios_com_paginacao(conexao, base_dn, FILTRO_USUARIOS, ATRIBUTOS_ESPELHO)
+    with espelho['trava']:
+        for indice in ('usuarios', 'dns', 'logins', 'grupos'):
+            espelho[indice].clear()
+        for resposta in dados_usuarios:
+            _espelho_inserir(espelho, decodificar_resposta(resposta, ATRIBUTOS_ESPELHO), resposta['dn'])
+        _espelho_alterado(espelho)
+    print(f"✅ Espelho carregado: {len(espelho['usuarios'])} usuários, {len(espelho['grupos'])} grupos")
+
+def aplicar_notificacao(espelho, mudanca, filtrado_no_servidor=False, conexao=None):
+    """
+    Aplica ao espelho uma entrada recebida pela busca de notificações.
+
+    No AD cada notificação traz o objeto inteiro (sem indicar o tipo de
+    mudança): objetos com isDeleted são exclusões, objetos já conhecidos são
+    alterações (inclusive renomeações/movimentações) e os demais são inclusões.
+    Na busca persistente (psearch) o tipo vem no controle de resposta.
+    Grupos com membros em faixas são relidos por `conexao`, que deve ser
+    exclusiva da thread de notificações.
+    """
+    if mudanca.get('type') != 'searchResEntry':
+        return None
+    dn = mudanca['dn']
+    linha = decodificar_resposta(mudanca, ATRIBUTOS_ESPELHO + ['objectClass', 'isDeleted'])
+    classes = [classe.lower() for classe in linha.pop('objectClass') or []]
+    excluido = linha.pop('isDeleted') or mudanca.get('changeType') == 'delete'
+    # No psearch o ldap3 entrega o previousDN como LDAPDN do pyasn1, não como str
+    anterior = str(mudanca['previousDN']) if mudanca.get('previousDN') else None
     
-    # Busca TODOS os usuários (ativos e inativos, mas não computadores)
-    filtro = '(&(objectClass=user)(!(sAMAccountName=*$)))'
-    atributos = ['sAMAccountName', 'displayName', 'title', 'userAccountControl', 'whenCreated', 'mail', 'lastLogon', 'lastLogonTimestamp', 'accountExpires']
+    e_grupo = 'group' in classes and not filtrado_no_servidor
+    membros = [] if excluido or not e_grupo else _membros_notificacao(mudanca, conexao)
+    if e_grupo and membros is None:
+        # Membros desconhecidos: manter o índice é melhor que esvaziar o grupo
+        return None
     
-    try:
-        # Busca com paginação para lidar com muitos usuários
-        print("🔍 Buscando TODOS os usuários do Active Directory...")
+    with espelho['trava']:
+        if e_grupo:
+            if _espelho_atualizar_grupo(espelho, dn, membros):
+                _espelho_alterado(espelho)
+                return 'group'
+            return None
         
-        todas_entradas = []
-        cookie = None
-        pagina = 0
+        chave = linha.get('objectGUID') or espelho['dns'].get((anterior or dn).lower()) or dn.lower()
+        e_usuario = filtrado_no_servidor or ('user' in classes and 'computer' not in classes)
         
+        if excluido or not e_usuario:
+            tipo = 'delete' if _espelho_remover(espelho, chave) else None
+        else:
+            tipo = 'modify' if chave in espelho['usuarios'] else 'add'
+            if anterior:
+                _espelho_remover(espelho, espelho['dns'].get(anterior.lower(), chave))
+            _espelho_inserir(espelho, linha, dn)
+        
+        if tipo:
+            _espelho_alterado(espelho)
+    return tipo
+
+def assinar_notificacoes(conexao, base_dn, ao_mudar, modo='ad'):
+    """
+    Abre uma conexão assíncrona (ASYNC_STREAM) que recebe as mudanças do
+    diretório e chama `ao_mudar` para cada entrada.
+
+    modo 'ad': controle LDAP_SERVER_NOTIFICATION + SHOW_DELETED (o AD exige o
+    filtro (objectClass=*), por isso usuários são filtrados localmente).
+    modo 'psearch': busca persistente padrão, para servidores LDAP de teste.
+    """
+    notificacoes = Connection(
+        conexao.server,
+        user=conexao.user,
+        password=conexao.password,
+        authentication=conexao.authentication,
+        client_strategy=ASYNC_STREAM,
+        auto_bind=True
+    )
+    atributos = ATRIBUTOS_ESPELHO + ['objectClass', 'isDeleted', 'member']
+    if modo == 'ad':
+        # Sem tipos de evento o ldap3 não acrescenta o controle de psearch, que o AD rejeitaria
+        return notificacoes.extend.standard.persistent_search(
+            base_dn, '(objectClass=*)', SUBTREE, attributes=atributos,
+            controls=[(OID_NOTIFICACAO, True, None), (OID_MOSTRAR_EXCLUIDOS, True, None)],
+            show_additions=False, show_deletions=False, show_modifications=False, show_dn_modifications=False,
+            callback=ao_mudar
+        )
+    return notificacoes.extend.standard.persistent_search(
+        base_dn, FILTRO_USUARIOS, SUBTREE, attributes=atributos, changes_only=True, callback=ao_mudar
+    )
+
+def tabela_espelho(espelho):
+    """Tabela por colunas do espelho, reconstruída apenas quando houve mudança"""
+    with espelho['trava']:
+        if espelho['tabela'] is None:
+            espelho['tabela'] = montar_tabela_usuarios(list(espelho['usuarios'].values()), ATRIBUTOS_ESPELHO + ['dn'])
+        return espelho['tabela']
+
+def buscar_no_espelho(espelho, login):
+    """Consulta instantânea de um usuário pelo login"""
+    with espelho['trava']:
+        chave = espelho['logins'].get(login.lower())
+        return dict(espelho['usuarios'][chave]) if chave else None
+
+def gerar_relatorio_tabela(especificacao, tabela, gravar=True):
+    """Gera o relatório da especificação a partir de uma tabela já carregada, sem buscar no AD"""
+    mascara = avaliar_regras(compilar_regras({'incluir': especificacao['incluir']}), tabela)['incluir']
+    dados = list(iterar_linhas_tabela(especificacao, tabela, mascara))
+    if gravar:
+        nome_arquivo = f"{especificacao['arquivo']}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+        gerar_planilha(dados, nome_arquivo, especificacao['titulo'], especificacao['colunas'])
+    return dados
+
+def executar_espelho(modo='ad'):
+    """
+    Modo daemon: mantém o espelho em memória atualizado pelas notificações do
+    AD e atende relatórios e consultas a partir dele, sem novas buscas.
+    """
+    conexao = get_conexao()
+    base_dn = get_base_dn(conexao)
+    espelho = criar_espelho()
+    
+    print("\n🪞 MODO ESPELHO - carregando snapshot inicial...")
+    carregar_espelho(espelho, conexao, base_dn)
+    
+    # Conexão própria da thread de notificações, para reler grupos grandes
+    conexao_grupos = _clonar_conexao(conexao)
+    
+    def _ao_mudar(mudanca):
+        tipo = aplicar_notificacao(espelho, mudanca, filtrado_no_servidor=(modo == 'psearch'), conexao=conexao_grupos)
+        if tipo:
+            print(f"\n   🔔 {tipo}: {mudanca['dn']}")
+    
+    busca = assinar_notificacoes(conexao, base_dn, _ao_mudar, modo)
+    print(f"✓ Assinatura de notificações ativa ({modo})")
+    
+    comandos = "Comandos: r <relatório> | u <login> | s (status) | q (sair)"
+    print(comandos)
+    print(f"Relatórios: {', '.join(RELATORIOS)}")
+    try:
         while True:
-            pagina += 1
-            print(f"   Buscando página {pagina}...")
+            comando = input("\n🪞 espelho> ").strip()
+            if not comando:
+                continue
+            acao, _, argumento = comando.partition(' ')
             
-            # Busca com paginação
-            conexao.search(
-                base_dn,
-                filtro,
-                attributes=atributos,
-                paged_size=1000,
-                paged_cookie=cookie,
-                search_scope='SUBTREE',
-                time_limit=0,
-                size_limit=0
-            )
+            # Conexão de notificações caiu: recarrega tudo e assina de novo
+            if busca.connection.closed:
+                print("⚠ Conexão de notificações encerrada. Recarregando espelho...")
+                carregar_espelho(espelho, conexao, base_dn)
+                busca = assinar_notificacoes(conexao, base_dn, _ao_mudar, modo)
             
-            if not conexao.entries:
-                print(f"   Nenhum resultado na página {pagina}")
+            if acao == 'q':
                 break
-            
-            # Adiciona os resultados à lista
-            todas_entradas.extend(list(conexao.entries))
-            print(f"   ✓ Página {pagina}: {len(conexao.entries)} usuários | Total: {len(todas_entradas)}")
-            
-            # Verifica se há mais páginas
-            try:
-                controls = conexao.result.get('controls', {})
-                if isinstance(controls, dict):
-                    paged_control = controls.get('1.2.840.113556.1.4.319', {})
-                    if isinstance(paged_control, dict):
-                        cookie = paged_control.get('value', {}).get('cookie')
-                    else:
-                        cookie = None
+            elif acao == 's':
+                print(f"   Usuários: {len(espelho['usuarios'])} | Grupos: {len(espelho['grupos'])}")
+                print(f"   Versão: {espelho['versao']} | Atualizado em: {espelho['atualizado_em']:%d/%m/%Y %H:%M:%S}")
+            elif acao == 'u':
+                usuario = buscar_no_espelho(espelho, argumento.strip())
+                if not usuario:
+                    print("Nenhum usuário encontrado.")
                 else:
-                    cookie = None
-            except:
-                cookie = None
-                
-            if not cookie:
-                print(f"   Busca concluída após {pagina} páginas")
-                break
-        
-        if not todas_entradas:
-            print("❌ Nenhum usuário encontrado.")
-            return
-        
-        print(f"✅ Total de usuários encontrados: {len(todas_entradas)}")
-        print("� Organizando usuários em ordem alfabética...")
-        
-        # Ordena as entradas por sAMAccountName em ordem alfabética
-        todas_entradas.sort(key=lambda x: x.sAMAccountName.value.lower() if hasattr(x, 'sAMAccountName') and x.sAMAccountName.value else 'zzz')
-        
-        print("�🔄 Aplicando critérios de auditoria 2024...")
-        
-        # Prepara dados para a planilha
-        dados_usuarios = []
-        usuarios_processados = 0
-        usuarios_incluidos = 0
-        
-        for entry in todas_entradas:
-            try:
-                usuarios_processados += 1
-                
-                # Mostra progresso a cada 500 usuários
-                if usuarios_processados % 500 == 0:
-                    print(f"   📊 Processados: {usuarios_processados}/{len(todas_entradas)} usuários | Incluídos: {usuarios_incluidos}")
-                
-                login = entry.sAMAccountName.value if hasattr(entry, 'sAMAccountName') and entry.sAMAccountName.value else 'N/A'
-                nome = entry.displayName.value if hasattr(entry, 'displayName') and entry.displayName.value else login
-                
-                # Verifica se o campo title existe e tem valor
-                cargo = 'Não informado'
-                if hasattr(entry, 'title') and entry.title.value:
-                    cargo = entry.title.value
-                
-                # Verifica se o usuário está ativo
-                user_account_control = int(entry.userAccountControl.value) if hasattr(entry, 'userAccountControl') and entry.userAccountControl.value else 0
-                is_disabled = bool(user_account_control & 0x0002)  # Flag ACCOUNTDISABLE
-                status = 'Inativo' if is_disabled else 'Ativo'
-                
-                # Converte data de criação
-                data_criacao = 'N/A'
-                created_dt = None
-                if hasattr(entry, 'whenCreated') and entry.whenCreated.value:
-                    try:
-                        created_raw = entry.whenCreated.value
-                        if isinstance(created_raw, datetime):
-                            # Já é um objeto datetime, remove timezone se presente
-                            created_dt = created_raw.replace(tzinfo=None)
-                            data_criacao = created_dt.strftime('%d/%m/%Y')
-                        else:
-                            # Formato não esperado
-                            data_criacao = 'Formato inválido'
-                    except (ValueError, TypeError):
-                        data_criacao = 'Erro ao converter'
-                
-                # Extrai e-mail
-                email = 'N/A'
-                if hasattr(entry, 'mail') and entry.mail.value:
-                    email = entry.mail.value
-                
-                # Converte data de expiração da conta do AD
-                data_expiracao_ad = 'Nunca expira'
-                account_expires_dt = None
-                tem_data_expiracao_valida = False
-                
-                if hasattr(entry, 'accountExpires') and entry.accountExpires.value:
-                    try:
-                        expires_raw = entry.accountExpires.value
-                        
-                        # Caso 1: Valor convertido incorretamente para 1601 (valor 0 no AD = nunca expira)
-                        if isinstance(expires_raw, datetime) and expires_raw.year == 1601:
-                            # Verifica se realmente é 0 acessando o valor bruto
-                            try:
-                                raw_value = entry.accountExpires.raw_values[0] if entry.accountExpires.raw_values else None
-                                if raw_value:
-                                    if isinstance(raw_value, bytes):
-                                        expires_ticks = int(raw_value.decode('utf-8'))
-                                    else:
-                                        expires_ticks = int(raw_value)
-                                    
-                                    if expires_ticks == 0:
-                                        # Valor 0 = nunca expira
-                                        data_expiracao_ad = 'Nunca expira'
-                                        tem_data_expiracao_valida = False
-                                    elif expires_ticks != 9223372036854775807:
-                                        # Valor válido, converte
-                                        temp_dt = datetime(1601, 1, 1) + timedelta(seconds=expires_ticks/10000000)
-                                        if temp_dt.year == 9999:
-                                            data_expiracao_ad = 'Nunca expira'
-                                            tem_data_expiracao_valida = False
-                                        else:
-                                            data_expiracao_ad = temp_dt.strftime('%d/%m/%Y')
-                                            account_expires_dt = temp_dt
-                                            tem_data_expiracao_valida = True
-                                    else:
-                                        # Valor máximo = nunca expira
-                                        data_expiracao_ad = 'Nunca expira'
-                                        tem_data_expiracao_valida = False
-                                else:
-                                    data_expiracao_ad = 'Nunca expira'
-                                    tem_data_expiracao_valida = False
-                            except (ValueError, TypeError, AttributeError):
-                                data_expiracao_ad = 'Nunca expira'
-                                tem_data_expiracao_valida = False
-                        
-                        # Caso 2: Datetime já convertido corretamente
-                        elif isinstance(expires_raw, datetime):
-                            account_expires_dt = expires_raw.replace(tzinfo=None)
-                            if account_expires_dt.year == 9999:
-                                data_expiracao_ad = 'Nunca expira'
-                                tem_data_expiracao_valida = False
-                            else:
-                                data_expiracao_ad = account_expires_dt.strftime('%d/%m/%Y')
-                                tem_data_expiracao_valida = True
-                        
-                        # Caso 3: Valor em ticks do Windows
-                        elif isinstance(expires_raw, (int, str)):
-                            expires_ticks = int(expires_raw)
-                            if expires_ticks == 0:
-                                data_expiracao_ad = 'Nunca expira'
-                                tem_data_expiracao_valida = False
-                            elif expires_ticks != 9223372036854775807:
-                                temp_dt = datetime(1601, 1, 1) + timedelta(seconds=expires_ticks/10000000)
-                                if temp_dt.year == 9999:
-                                    data_expiracao_ad = 'Nunca expira'
-                                    tem_data_expiracao_valida = False
-                                else:
-                                    data_expiracao_ad = temp_dt.strftime('%d/%m/%Y')
-                                    account_expires_dt = temp_dt
-                                    tem_data_expiracao_valida = True
-                            else:
-                                data_expiracao_ad = 'Nunca expira'
-                                tem_data_expiracao_valida = False
-                        else:
-                            data_expiracao_ad = 'Nunca expira'
-                            tem_data_expiracao_valida = False
-                    except (ValueError, TypeError, OverflowError):
-                        data_expiracao_ad = 'Nunca expira'
-                        tem_data_expiracao_valida = False
-                
-                # Obtém datas de último logon
-                last_logon_dt = None
-                last_logon_timestamp_dt = None
-                
-                # Processa lastLogon
-                if hasattr(entry, 'lastLogon') and entry.lastLogon.value:
-                    try:
-                        last_logon_raw = entry.lastLogon.value
-                        if isinstance(last_logon_raw, datetime):
-                            # Já é um objeto datetime, remove timezone se presente
-                            last_logon_dt = last_logon_raw.replace(tzinfo=None)
-                        elif isinstance(last_logon_raw, (int, str)):
-                            # Valor em ticks do Windows
-                            last_logon_ticks = int(last_logon_raw)
-                            if last_logon_ticks > 0:
-                                temp_dt = datetime(1601, 1, 1) + timedelta(seconds=last_logon_ticks/10000000)
-                                if temp_dt.year != 1601 and temp_dt.year != 9999:
-                                    last_logon_dt = temp_dt
-                    except (ValueError, TypeError, OverflowError):
-                        pass
-                
-                # Processa lastLogonTimestamp
-                if hasattr(entry, 'lastLogonTimestamp') and entry.lastLogonTimestamp.value:
-                    try:
-                        last_logon_timestamp_raw = entry.lastLogonTimestamp.value
-                        if isinstance(last_logon_timestamp_raw, datetime):
-                            # Já é um objeto datetime, remove timezone se presente
-                            last_logon_timestamp_dt = last_logon_timestamp_raw.replace(tzinfo=None)
-                        elif isinstance(last_logon_timestamp_raw, (int, str)):
-                            # Valor em ticks do Windows
-                            last_logon_timestamp_ticks = int(last_logon_timestamp_raw)
-                            if last_logon_timestamp_ticks > 0:
-                                temp_dt = datetime(1601, 1, 1) + timedelta(seconds=last_logon_timestamp_ticks/10000000)
-                                if temp_dt.year != 1601 and temp_dt.year != 9999:
-                                    last_logon_timestamp_dt = temp_dt
-                    except (ValueError, TypeError, OverflowError):
-                        pass
-                
-                # Obtém a data mais recente entre lastLogon e lastLogonTimestamp
-                data_ultimo_logon_mais_recente = None
-                if last_logon_dt and last_logon_timestamp_dt:
-                    data_ultimo_logon_mais_recente = max(last_logon_dt, last_logon_timestamp_dt)
-                elif last_logon_dt:
-                    data_ultimo_logon_mais_recente = last_logon_dt
-                elif last_logon_timestamp_dt:
-                    data_ultimo_logon_mais_recente = last_logon_timestamp_dt
-                
-                # APLICAÇÃO DOS CRITÉRIOS DE AUDITORIA 2024
-                incluir_usuario = False
-                motivo_exclusao = ""
-                
-                # REGRA 1: Todas as contas atualmente ativas devem ser exibidas
-                if status == 'Ativo':
-                    incluir_usuario = True
-                    motivo_exclusao = "Conta ativa - incluída automaticamente"
-                
-                # REGRA 2: Para contas inativas, aplicar critérios específicos
-                elif status == 'Inativo':
-                    # Critério A: Data de criação >= 01/01/2024
-                    if created_dt and created_dt >= data_inicio_2024 and created_dt < datetime(2025, 1, 1):
-                        incluir_usuario = True
-                        motivo_exclusao = f"Conta inativa criada em 2024 ou posterior ({created_dt.strftime('%d/%m/%Y')})"
-                    
-                    # Critério B: Último logon >= 01/01/2024 e < 01/01/2025
-                    if not incluir_usuario and data_ultimo_logon_mais_recente:
-                        if data_ultimo_logon_mais_recente >= data_inicio_2024 and data_ultimo_logon_mais_recente < datetime(2025, 1, 1):
-                            incluir_usuario = True
-                            motivo_exclusao = f"Conta inativa com último logon em 2024 ({data_ultimo_logon_mais_recente.strftime('%d/%m/%Y')})"
-                    
-                    # Critério C: Contas sem data de expiração válida (nunca expira)
-                    # Só incluir se tiver login em 2024
-                    if not incluir_usuario and not tem_data_expiracao_valida:
-                        if data_ultimo_logon_mais_recente and data_ultimo_logon_mais_recente >= data_inicio_2024 and data_ultimo_logon_mais_recente < datetime(2025, 1, 1):
-                            incluir_usuario = True
-                            motivo_exclusao = f"Conta inativa sem data de expiração, mas com logon em 2024 ({data_ultimo_logon_mais_recente.strftime('%d/%m/%Y')})"
-                        else:
-                            motivo_exclusao = "Conta inativa sem data de expiração válida e sem logon em 2024 - excluída"
-                    
-                    # Critério D: Exclusão de contas criadas em 2025 ou posterior
-                    if incluir_usuario and created_dt >= datetime(2025, 1, 1):
-                        incluir_usuario = False
-                        motivo_exclusao = f"Conta inativa criada em 2025 ou posterior ({created_dt.strftime('%d/%m/%Y')}) - excluída"
-                    
-                    # Critério E: Exclusão de contas com login em 2025 ou posterior
-                    if incluir_usuario and data_ultimo_logon_mais_recente >= datetime(2025, 1, 1):
-                        incluir_usuario = False
-                        motivo_exclusao = f"Conta inativa com último logon em 2025 ou posterior ({data_ultimo_logon_mais_recente.strftime('%d/%m/%Y')}) - excluída"
-                    
-                    # Critério F: Exclusão de contas sem atividade em 2024
-                    if incluir_usuario and (data_ultimo_logon_mais_recente < data_inicio_2024 or data_ultimo_logon_mais_recente > data_fim_periodo):
-                        incluir_usuario = False
-                        motivo_exclusao = "Conta inativa sem atividade em 2024 - excluída"
-
-                    # Não atende nenhum critério
-                    if not incluir_usuario:
-                        if data_ultimo_logon_mais_recente:
-                            if data_ultimo_logon_mais_recente < data_inicio_2024:
-                                motivo_exclusao = f"Último logon anterior a 2024 ({data_ultimo_logon_mais_recente.strftime('%d/%m/%Y')}) - excluída"
-                        else:
-                            motivo_exclusao = "Conta inativa sem atividade em 2024 - excluída"
-
-                # Debug: mostra informações detalhadas para os primeiros 350 usuários
-                if usuarios_processados <= 350:
-                    print(f"  DEBUG {usuarios_processados} - {login}:")
-                    print(f"    Status: {status}")
-                    print(f"    Criação: {created_dt.strftime('%d/%m/%Y') if created_dt else 'N/A'}")
-                    print(f"    Último logon: {data_ultimo_logon_mais_recente.strftime('%d/%m/%Y') if data_ultimo_logon_mais_recente else 'Nunca'}")
-                    print(f"    Expiração AD: {data_expiracao_ad}")
-                    print(f"    Expiração DT: {account_expires_dt.strftime('%d/%m/%Y') if account_expires_dt else 'Nunca expira'}")
-                    print(f"    Tem data válida: {'✅ SIM' if tem_data_expiracao_valida else '❌ NÃO'}")
-                    print(f"    Incluir: {'✅ SIM' if incluir_usuario else '❌ NÃO'}")
-                    print(f"    Motivo: {motivo_exclusao}")
-                    print(f"    ---")
-                
-                # Se deve incluir o usuário, adiciona aos dados
-                if incluir_usuario:
-                    # Calcula a data de expiração personalizada para a planilha
-                    data_expiracao_personalizada = data_expiracao_ad
-                    
-                    # Se há data de último logon mais recente no período, usa ela como referência
-                    if data_ultimo_logon_mais_recente and data_inicio_2024 <= data_ultimo_logon_mais_recente <= data_fim_periodo:
-                        data_expiracao_personalizada = data_ultimo_logon_mais_recente.strftime('%d/%m/%Y')
-                    
-                    dados_usuarios.append({
-                        'Login': login,
-                        'Nome': nome,
-                        'E-mail': email,
-                        'Cargo': cargo,
-                        'Status': status,
-                        'Data de Criação': data_criacao,
-                        'Data de Expiração': data_expiracao_personalizada
-                    })
-                    usuarios_incluidos += 1
-                    
-            except Exception as e:
-                print(f"⚠ Erro ao processar usuário {login}: {e}")
+                    for atributo, valor in usuario.items():
+                        print(f"   {atributo:20}: {valor}")
+            elif acao == 'r' and argumento.strip() in RELATORIOS:
+                gerar_relatorio_tabela(RELATORIOS[argumento.strip()], tabela_espelho(espelho))
+            else:
+                print(comandos)
+    except KeyboardInterrupt:
+        print("\n\n👋 Espelho interrompido pelo usuário.")
+    finally:
+        busca.stop()
+        conexao_grupos.unbind()
+
+# ============================================================
+# MÉTRICAS PARA O PROMETHEUS (TEXTFILE E /metrics)
+# ============================================================
+
+PASTA_METRICAS = 'metricas'
+# Arquivo lido pelo textfile collector do node_exporter (aponte AD_METRICAS_ARQUIVO para o diretório do coletor)
+ARQUIVO_METRICAS = os.environ.get('AD_METRICAS_ARQUIVO', os.path.join(PASTA_METRICAS, 'ad_usuarios.prom'))
+# Tabela de usuários, USN e histogramas guardados entre execuções: a próxima coleta só busca o que mudou
+ARQUIVO_ESTADO_METRICAS = os.path.join(PASTA_METRICAS, 'estado.pickle')
+
+# lastLogon fica de fora: não é replicado e mudaria a cada logon; lastLogonTimestamp basta para "nunca logou"
+ATRIBUTOS_METRICAS = ['objectGUID', 'userAccountControl', 'accountExpires', 'lastLogonTimestamp']
+DIAS_EXPIRANDO = 30
+
+# Limites (segundos) dos buckets dos histogramas de latência por etapa
+LIMITES_LATENCIA = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+def regras_metricas(agora):
+    """Conjuntos contados a cada coleta; as janelas de expiração são relativas ao momento da coleta"""
+    nunca_logou = ('nao', ('existe', 'lastLogonTimestamp'))
+    return {
+        'ativas': P_ATIVA,
+        'desabilitadas': P_DESABILITADA,
+        'expirando': ('e', P_ATIVA, ('entre', 'accountExpires', agora, agora + timedelta(days=DIAS_EXPIRANDO))),
+        'expiradas': ('e', P_ATIVA, ('entre', 'accountExpires', None, agora)),
+        'nunca_logaram_ativas': ('e', P_ATIVA, nunca_logou),
+        'nunca_logaram_desabilitadas': ('e', P_DESABILITADA, nunca_logou),
+    }
+
+def agregar_metricas(tabela, agora=None):
+    """Contagens da coleta: cada condição é uma passada por coluna e os conjuntos são operações entre máscaras"""
+    mascaras = avaliar_regras(compilar_regras(regras_metricas(agora or datetime.now())), tabela)
+    contagens = {nome: contar_mascara(mascara) for nome, mascara in mascaras.items()}
+    contagens['total'] = tabela['n']
+    return contagens
+
+def observar_latencia(histogramas, etapa, segundos):
+    """Acumula uma duração no histograma da etapa (buckets cumulativos no formato do Prometheus)"""
+    histograma = histogramas.setdefault(etapa, {'buckets': [0] * len(LIMITES_LATENCIA), 'soma': 0.0, 'contagem': 0})
+    for i in range(bisect.bisect_left(LIMITES_LATENCIA, segundos), len(LIMITES_LATENCIA)):
+        histograma['buckets'][i] += 1
+    histograma['soma'] += segundos
+    histograma['contagem'] += 1
+
+@contextlib.contextmanager
+def medir_etapa(histogramas, etapa):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        observar_latencia(histogramas, etapa, time.perf_counter() - inicio)
+
+def formatar_metricas(contagens, histogramas, coleta=None):
+    """Texto no formato de exposição do Prometheus (o mesmo para o textfile e para /metrics)"""
+    linhas = []
+    def _metrica(nome, tipo, ajuda, amostras):
+        linhas.append(f"# HELP {nome} {ajuda}")
+        linhas.append(f"# TYPE {nome} {tipo}")
+        for rotulos, valor in amostras:
+            texto = ','.join(f'{chave}="{valor_rotulo}"' for chave, valor_rotulo in rotulos)
+            linhas.append(f"{nome}{{{texto}}} {valor}" if texto else f"{nome} {valor}")
+    
+    _metrica('ad_usuarios', 'gauge', 'Contas de usuário por situação', [
+        ((('situacao', 'ativa'),), contagens['ativas']),
+        ((('situacao', 'desabilitada'),), contagens['desabilitadas']),
+    ])
+    _metrica('ad_usuarios_expirando', 'gauge', 'Contas ativas que expiram dentro da janela (dias)',
+             [((('dias', DIAS_EXPIRANDO),), contagens['expirando'])])
+    _metrica('ad_usuarios_expiradas', 'gauge', 'Contas ativas com accountExpires no passado', [((), contagens['expiradas'])])
+    _metrica('ad_usuarios_nunca_logaram', 'gauge', 'Contas sem lastLogonTimestamp, por situação', [
+        ((('situacao', 'ativa'),), contagens['nunca_logaram_ativas']),
+        ((('situacao', 'desabilitada'),), contagens['nunca_logaram_desabilitadas']),
+    ])
+    
+    linhas.append("# HELP ad_coleta_duracao_segundos Duração de cada etapa da coleta")
+    linhas.append("# TYPE ad_coleta_duracao_segundos histogram")
+    for etapa, histograma in sorted(histogramas.items()):
+        for limite, acumulado in zip(LIMITES_LATENCIA, histograma['buckets']):
+            linhas.append(f'ad_coleta_duracao_segundos_bucket{{etapa="{etapa}",le="{float(limite)!r}"}} {acumulado}')
+        linhas.append(f'ad_coleta_duracao_segundos_bucket{{etapa="{etapa}",le="+Inf"}} {histograma["contagem"]}')
+        linhas.append(f'ad_coleta_duracao_segundos_sum{{etapa="{etapa}"}} {histograma["soma"]!r}')
+        linhas.append(f'ad_coleta_duracao_segundos_count{{etapa="{etapa}"}} {histograma["contagem"]}')
+    
+    if coleta:
+        _metrica('ad_coleta_execucoes_total', 'counter', 'Coletas realizadas, por tipo de sincronização',
+                 [((('tipo', tipo),), total) for tipo, total in sorted(coleta['execucoes'].items())])
+        _metrica('ad_coleta_objetos_alterados', 'gauge', 'Usuários recebidos na última sincronização',
+                 [((), coleta['alterados'])])
+        _metrica('ad_coleta_ultima_execucao_timestamp_segundos', 'gauge', 'Horário (Unix) da última coleta',
+                 [((), round(coleta['horario'], 3))])
+    return '\n'.join(linhas) + '\n'
+
+def gravar_arquivo_metricas(texto, caminho=None):
+    """Grava o textfile de forma atômica: o coletor nunca lê um arquivo pela metade"""
+    caminho = caminho or ARQUIVO_METRICAS
+    os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+    temporario = caminho + '.tmp'
+    with open(temporario, 'w', encoding='utf-8') as arquivo:
+        arquivo.write(texto)
+    os.replace(temporario, caminho)
+
+def _ler_estado_metricas():
+    if not os.path.exists(ARQUIVO_ESTADO_METRICAS):
+        return {'dc': None, 'usn': None, 'usuarios': {}, 'histogramas': {},
+                'execucoes': {}, 'alterados': 0, 'horario': 0}
+    with open(ARQUIVO_ESTADO_METRICAS, 'rb') as arquivo:
+        return pickle.load(arquivo)
+
+def _gravar_estado_metricas(estado):
+    os.makedirs(PASTA_METRICAS, exist_ok=True)
+    temporario = ARQUIVO_ESTADO_METRICAS + '.tmp'
+    with open(temporario, 'wb') as arquivo:
+        pickle.dump(estado, arquivo, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporario, ARQUIVO_ESTADO_METRICAS)
+
+def sincronizar_usuarios_metricas(conexao, estado):
+    """
+    Atualiza a tabela guardada no estado: busca completa na primeira vez (ou se o DC mudou,
+    ou se o servidor não informa USN); depois, só os usuários com uSNChanged acima do último
+    visto, incluindo os excluídos. Devolve o tipo de sincronização e quantos usuários vieram.
+    """
+    base_dn = get_base_dn(conexao)
+    versao = versao_diretorio(conexao)
+    if versao and estado['usuarios'] and versao[0] == estado['dc'] and estado['usn'] is not None:
+        if versao[1] <= estado['usn']:
+            return 'incremental', 0
+        filtro = f"(&{FILTRO_USUARIOS}(uSNChanged>={estado['usn'] + 1}))"
+        atributos = ATRIBUTOS_METRICAS + ['isDeleted']
+        respostas = conexao.extend.standard.paged_search(base_dn, filtro, SUBTREE, attributes=atributos,
+                                                         controls=[(OID_MOSTRAR_EXCLUIDOS, False, None)],
+                                                         paged_size=1000, generator=True)
+        alterados = 0
+        for resposta in respostas:
+            if resposta.get('type') != 'searchResEntry':
                 continue
-        
-        print(f"✓ Processados: {usuarios_processados} usuários")
-        print(f"✓ Incluídos na auditoria: {usuarios_incluidos} usuários")
-        
-        if not dados_usuarios:
-            print("❌ Nenhum usuário atende aos critérios de auditoria 2024.")
+            linha = decodificar_resposta(resposta, atributos)
+            chave = linha.get('objectGUID') or resposta['dn'].lower()
+            if linha.pop('isDeleted'):
+                estado['usuarios'].pop(chave, None)
+            else:
+                estado['usuarios'][chave] = linha
+            alterados += 1
+        estado['usn'] = versao[1]
+        return 'incremental', alterados
+    
+    usuarios = {}
+    for pagina in paginas_usuarios(conexao, base_dn, FILTRO_USUARIOS, ATRIBUTOS_METRICAS):
+        for resposta in pagina:
+            linha = decodificar_resposta(resposta, ATRIBUTOS_METRICAS)
+            usuarios[linha.get('objectGUID') or resposta['dn'].lower()] = linha
+    estado['usuarios'] = usuarios
+    estado['dc'], estado['usn'] = versao or (None, None)
+    return 'completa', len(usuarios)
+
+def coletar_metricas(conexao, caminho=None):
+    """Uma coleta: sincroniza, agrega, grava o textfile e guarda o estado para a próxima"""
+    estado = _ler_estado_metricas()
+    histogramas = estado['histogramas']
+    with medir_etapa(histogramas, 'total'):
+        with medir_etapa(histogramas, 'sincronizacao'):
+            tipo, alterados = sincronizar_usuarios_metricas(conexao, estado)
+        with medir_etapa(histogramas, 'tabela'):
+            tabela = montar_tabela_usuarios(list(estado['usuarios'].values()), ATRIBUTOS_METRICAS)
+        with medir_etapa(histogramas, 'agregacao'):
+            contagens = agregar_metricas(tabela)
+        estado['execucoes'][tipo] = estado['execucoes'].get(tipo, 0) + 1
+        estado['alterados'] = alterados
+        estado['horario'] = time.time()
+        with medir_etapa(histogramas, 'escrita'):
+            gravar_arquivo_metricas(formatar_metricas(contagens, histogramas, estado), caminho)
+    # A duração da escrita e o total entram nos histogramas gravados pela próxima coleta
+    _gravar_estado_metricas(estado)
+    print(f"📈 Métricas ({tipo}, {alterados} usuário(s) recebido(s)): {contagens['ativas']} ativas, "
+          f"{contagens['desabilitadas']} desabilitadas, {contagens['expirando']} expirando em {DIAS_EXPIRANDO} dias, "
+          f"{contagens['nunca_logaram_ativas']} ativas sem logon -> {caminho or ARQUIVO_METRICAS}")
+    return contagens
+
+def executar_metricas(intervalo=None, caminho=None):
+    """Modo métricas: uma coleta (para o agendador) ou, com `intervalo`, uma coleta a cada `intervalo` segundos"""
+    conexao = get_conexao()
+    while True:
+        try:
+            coletar_metricas(conexao, caminho)
+        except LDAPException as e:
+            print(f"❌ Falha na coleta de métricas: {e}")
+            if not intervalo:
+                raise
+        if not intervalo:
             return
-        
-        # Ordena por nome
-        dados_usuarios.sort(key=lambda x: x['Nome'] or 'ZZZ')
-        
-        # Cria a planilha
-        nome_arquivo = f"Auditoria_2024_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        
-        print(f"📝 Criando planilha: {nome_arquivo}")
+        time.sleep(intervalo)
+
+# ============================================================
+# SERVIÇO LOCAL DE RELATÓRIOS (HTTP/JSON)
+# ============================================================
+
+def _planilha_em_memoria(especificacao, dados):
+    """Monta o .xlsx de um relatório em memória (modo write_only) para envio pela rede"""
+    wb = Workbook(write_only=True)
+    _escrever_aba(wb, especificacao['titulo'], especificacao['colunas'], dados)
+    saida = io.BytesIO()
+    wb.save(saida)
+    return saida.getvalue()
+
+def _contagem_grupos(espelho, nome_grupo=None):
+    """Membros (usuários) por grupo a partir do índice do espelho, filtrando pelo CN se informado"""
+    contagem = {}
+    with espelho['trava']:
+        for dn_grupo, membros in espelho['grupos'].items():
+            cn = dn_grupo.split(',', 1)[0].split('=', 1)[-1]
+            if nome_grupo is None or cn == nome_grupo.lower():
+                contagem[dn_grupo] = len(membros)
+    return contagem
+
+class _ManipuladorServico(BaseHTTPRequestHandler):
+    """
+    Rotas:
+      GET  /saude                          status do espelho
+      GET  /relatorios                     relatórios disponíveis
+      GET  /relatorios/<nome>?formato=     json (padrão), csv ou xlsx
+      GET  /usuarios/<login>               consulta de usuário
+      GET  /grupos?cn=<nome>               contagem de membros por grupo
+      GET  /metrics                        contagens e latências no formato do Prometheus
+      POST /recarregar                     recarrega o snapshot completo
+    """
+    servico = None  # definido em executar_servico
+    
+    def log_message(self, formato, *args):
+        print(f"   🌐 {self.address_string()} - {formato % args}")
+    
+    def _responder_json(self, dados, status=200):
+        corpo = json.dumps(dados, ensure_ascii=False, default=lambda valor: str(_serializar_valor(valor))).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+    
+    def _responder_csv(self, especificacao, dados):
+        # Sem Content-Length: as linhas são enviadas conforme são formatadas (HTTP/1.0 fecha ao final)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/csv; charset=utf-8')
+        self.send_header('Content-Disposition', f"attachment; filename={especificacao['arquivo']}.csv")
+        self.end_headers()
+        saida = io.TextIOWrapper(self.wfile, encoding='utf-8-sig', newline='', write_through=True)
+        escritor = csv.writer(saida, delimiter=';')
+        escritor.writerow(especificacao['colunas'])
+        for usuario in dados:
+            escritor.writerow([usuario.get(coluna, 'N/A') for coluna in especificacao['colunas']])
+        saida.detach()
+    
+    def do_GET(self):
+        espelho = self.servico['espelho']
+        url = urllib.parse.urlsplit(self.path)
+        parametros = dict(urllib.parse.parse_qsl(url.query))
+        partes = [urllib.parse.unquote(parte) for parte in url.path.strip('/').split('/') if parte]
         
         try:
-            # Cria workbook e worksheet
-            wb = Workbook()
-            ws = wb.active
-            ws.title = "Auditoria 2024"
-            
-            # Adiciona informações do cabeçalho
-            ws['A1'] = 'AUDITORIA 2024 - ACTIVE DIRECTORY'
-            ws['A1'].font = Font(bold=True, size=14)
-            ws['A2'] = f'Gerado em: {datetime.now().strftime("%d/%m/%Y às %H:%M:%S")}'
-            ws['A3'] = f'Critérios: Contas ativas + inativas com criação/logon em 2024'
-            ws['A4'] = f'Total de usuários na auditoria: {len(dados_usuarios)}'
-            
-            # Conta usuários ativos e inativos
-            ativos = sum(1 for u in dados_usuarios if u['Status'] == 'Ativo')
-            inativos = len(dados_usuarios) - ativos
-            ws['A5'] = f'Usuários ativos: {ativos} | Usuários inativos: {inativos}'
-            
-            # Adiciona informações sobre usuários excluídos
-            ws['A6'] = f'Total de usuários processados: {usuarios_processados}'
-            ws['A7'] = f'Usuários excluídos da auditoria: {usuarios_processados - usuarios_incluidos}'
-            
-            # Linha vazia
-            ws.append([''])
-            
-            # Define cabeçalhos
-            colunas = ['Login', 'Nome', 'E-mail', 'Cargo', 'Status', 'Data de Criação', 'Data de Expiração']
-            ws.append(colunas)
-            
-            # Formata cabeçalho
-            header_row = ws.max_row
-            for col in range(1, len(colunas) + 1):
-                cell = ws.cell(row=header_row, column=col)
-                cell.font = Font(bold=True, color="FFFFFF")
-                cell.fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-                cell.alignment = Alignment(horizontal="center")
-            
-            # Adiciona dados
-            for usuario in dados_usuarios:
-                ws.append([
-                    usuario['Login'],
-                    usuario['Nome'],
-                    usuario['E-mail'],
-                    usuario['Cargo'],
-                    usuario['Status'],
-                    usuario['Data de Criação'],
-                    usuario['Data de Expiração']
-                ])
-            
-            # Ajusta largura das colunas
-            ws.column_dimensions['A'].width = 18  # Login
-            ws.column_dimensions['B'].width = 35  # Nome
-            ws.column_dimensions['C'].width = 30  # E-mail
-            ws.column_dimensions['D'].width = 25  # Cargo
-            ws.column_dimensions['E'].width = 10  # Status
-            ws.column_dimensions['F'].width = 15  # Data de Criação
-            ws.column_dimensions['G'].width = 15  # Data de Expiração
-            
-            # Salva o arquivo
-            wb.save(nome_arquivo)
-            
-            print(f"✅ Auditoria 2024 gerada com sucesso!")
-            print(f"   📄 Arquivo: {nome_arquivo}")
-            print(f"   👥 Total de usuários: {len(dados_usuarios)}")
-            print(f"   ✅ Usuários ativos: {ativos}")
-            print(f"   ❌ Usuários inativos: {inativos}")
-            print(f"   📊 Colunas: {', '.join(colunas)}")
-            
-            # Abre o arquivo automaticamente
-            os.startfile(nome_arquivo)
-            print("✓ Arquivo aberto")
-            
+            if partes == ['saude']:
+                self._responder_json({
+                    'usuarios': len(espelho['usuarios']),
+                    'grupos': len(espelho['grupos']),
+                    'versao': espelho['versao'],
+                    'atualizado_em': espelho['atualizado_em'],
+                })
+            elif partes == ['relatorios']:
+                self._responder_json({nome: especificacao['titulo'] for nome, especificacao in RELATORIOS.items()})
+            elif len(partes) == 2 and partes[0] == 'relatorios' and partes[1] in RELATORIOS:
+                especificacao = RELATORIOS[partes[1]]
+                dados = gerar_relatorio_tabela(especificacao, tabela_espelho(espelho), gravar=False)
+                formato = parametros.get('formato', 'json')
+                if formato == 'csv':
+                    self._responder_csv(especificacao, dados)
+                elif formato == 'xlsx':
+                    corpo = _planilha_em_memoria(especificacao, dados)
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+                    self.send_header('Content-Disposition', f"attachment; filename={especificacao['arquivo']}.xlsx")
+                    self.send_header('Content-Length', str(len(corpo)))
+                    self.end_headers()
+                    self.wfile.write(corpo)
+                else:
+                    self._responder_json({'titulo': especificacao['titulo'], 'total': len(dados), 'dados': dados})
+            elif len(partes) == 2 and partes[0] == 'usuarios':
+                usuario = buscar_no_espelho(espelho, partes[1])
+                if usuario:
+                    self._responder_json(usuario)
+                else:
+                    self._responder_json({'erro': 'Nenhum usuário encontrado.'}, 404)
+            elif partes == ['grupos']:
+                self._responder_json(_contagem_grupos(espelho, parametros.get('cn')))
+            elif partes == ['metrics']:
+                # Contagens sobre a tabela do espelho, que já está atualizada pelas notificações: nenhuma busca no AD
+                inicio = time.perf_counter()
+                contagens = agregar_metricas(tabela_espelho(espelho))
+                with self.servico['trava_metricas']:
+                    observar_latencia(self.servico['histogramas'], 'agregacao', time.perf_counter() - inicio)
+                    corpo = formatar_metricas(contagens, self.servico['histogramas']).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(corpo)))
+                self.end_headers()
+                self.wfile.write(corpo)
+            else:
+                self._responder_json({'erro': 'Rota não encontrada.'}, 404)
         except Exception as e:
-            print(f"❌ Erro ao criar planilha: {e}")
-            
-    except Exception as e:
-        print(f"❌ Erro ao buscar usuários: {e}")
-        print("Verifique se você tem permissões para listar usuários no AD.")
+            self._responder_json({'erro': str(e)}, 500)
+    
+    def do_POST(self):
+        if self.path.rstrip('/') != '/recarregar':
+            self._responder_json({'erro': 'Rota não encontrada.'}, 404)
+            return
+        try:
+            recarregar_servico(self.servico)
+            self._responder_json({'usuarios': len(self.servico['espelho']['usuarios']), 'versao': self.servico['espelho']['versao']})
+        except Exception as e:
+            self._responder_json({'erro': str(e)}, 500)
 
-def gerar_auditoria_2024(conexao):
+def recarregar_servico(servico):
+    """Recarrega o snapshot completo usando uma conexão do pool"""
+    conexao = servico['pool'].get()
+    inicio = time.perf_counter()
+    try:
+        carregar_espelho(servico['espelho'], conexao, servico['base_dn'])
+    finally:
+        servico['pool'].put(conexao)
+        with servico['trava_metricas']:
+            observar_latencia(servico['histogramas'], 'recarga', time.perf_counter() - inicio)
+
+def executar_servico(host='127.0.0.1', porta=8080, modo_notificacao='ad', intervalo_recarga=300, tamanho_pool=4):
     """
-    Gera auditoria completa 2024 com critério original
+    Modo serviço: mantém um espelho quente e atende os relatórios por HTTP.
+    O espelho é atualizado pelas notificações do AD; se a assinatura não for
+    possível (ou cair), é recarregado a cada `intervalo_recarga` segundos.
     """
-    print("\n📋 Critérios aplicados:")
-    print("   • Todas as contas ATIVAS são incluídas")
-    print("   • Contas INATIVAS são incluídas SE:")
-    print("     - Data de criação >= 01/01/2024 OU")
-    print("     - Último logon >= 01/01/2024 e < 01/01/2025")
-    print("   • EXCLUSÃO: contas inativas antigas sem atividade em 2024")
-    
-    # Buscar todos os usuários
-    usuarios = buscar_usuarios_com_paginacao(conexao)
+    conexao = get_conexao()
+    base_dn = get_base_dn(conexao)
     
-    # Definir datas de referência
-    inicio_2024 = datetime(2024, 1, 1)
-    fim_2024 = datetime(2024, 12, 31, 23, 59, 59)
+    # Pool de conexões já autenticadas para recargas concorrentes com as requisições
+    pool = queue.Queue()
+    pool.put(conexao)
+    for _ in range(tamanho_pool - 1):
+        pool.put(_clonar_conexao(conexao))
     
-    usuarios_incluidos = []
+    servico = {'espelho': criar_espelho(), 'pool': pool, 'base_dn': base_dn,
+               'histogramas': {}, 'trava_metricas': threading.Lock()}
+    print("\n🌐 MODO SERVIÇO - carregando snapshot inicial...")
+    recarregar_servico(servico)
     
-    for usuario in usuarios:
-        # Obter atributos do usuário
-        attrs = usuario.entry_attributes_as_dict
-        
-        # Verificar se a conta está ativa
-        uac = attrs.get('userAccountControl', [0])[0]
-        conta_ativa = not (uac & 0x00000002)  # Bit 1 = ACCOUNTDISABLE
-        
-        # Se a conta está ativa, incluir sempre
-        if conta_ativa:
-            usuarios_incluidos.append(usuario)
-            continue
-        
-        # Para contas inativas, verificar critérios de 2024
-        incluir_conta = False
-        
-        # Verificar data de criação
-        when_created = attrs.get('whenCreated', [])
-        if when_created:
-            try:
-                data_criacao = when_created[0]
-                if isinstance(data_criacao, str):
-                    data_criacao = datetime.strptime(data_criacao, '%Y-%m-%d %H:%M:%S%z')
-                elif hasattr(data_criacao, 'replace'):
-                    data_criacao = data_criacao.replace(tzinfo=None)
-                
-                if data_criacao >= inicio_2024:
-                    incluir_conta = True
-            except:
-                pass
-        
-        # Verificar último logon
-        if not incluir_conta:
-            for attr_logon in ['lastLogon', 'lastLogonTimestamp']:
-                if incluir_conta:
-                    break
-                
-                logon_values = attrs.get(attr_logon, [])
-                if logon_values:
-                    try:
-                        logon_timestamp = logon_values[0]
-                        if isinstance(logon_timestamp, int) and logon_timestamp > 0:
-                            data_logon = datetime.utcfromtimestamp(
-                                (logon_timestamp - 116444736000000000) / 10000000
-                            )
-                            if inicio_2024 <= data_logon <= fim_2024:
-                                incluir_conta = True
-                                break
-                    except:
-                        pass
-        
-        if incluir_conta:
-            usuarios_incluidos.append(usuario)
+    busca = conexao_grupos = None
+    try:
+        conexao_grupos = _clonar_conexao(conexao)
+        busca = assinar_notificacoes(conexao, base_dn, lambda mudanca: aplicar_notificacao(
+            servico['espelho'], mudanca, filtrado_no_servidor=(modo_notificacao == 'psearch'),
+            conexao=conexao_grupos), modo_notificacao)
+        print(f"✓ Assinatura de notificações ativa ({modo_notificacao})")
+    except Exception as e:
+        print(f"⚠ Notificações indisponíveis ({e}); recarga a cada {intervalo_recarga}s")
     
-    # Gerar planilha
-    filename = f"Auditoria_2024_Completa_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    gerar_planilha(usuarios_incluidos, filename)
+    def _recarga_periodica():
+        while True:
+            time.sleep(intervalo_recarga)
+            if busca is None or busca.connection.closed:
+                try:
+                    recarregar_servico(servico)
+                except Exception as e:
+                    print(f"⚠ Falha ao recarregar espelho: {e}")
+    threading.Thread(target=_recarga_periodica, daemon=True).start()
     
-    print(f"\n✅ Auditoria 2024 gerada com sucesso!")
-    print(f"📄 Arquivo: {filename}")
-    print(f"👥 Total de usuários incluídos: {len(usuarios_incluidos)}")
+    _ManipuladorServico.servico = servico
+    servidor = ThreadingHTTPServer((host, porta), _ManipuladorServico)
+    print(f"✅ Serviço disponível em http://{host}:{porta}/relatorios")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        print("\n\n👋 Serviço interrompido pelo usuário.")
+    finally:
+        servidor.server_close()
+        if busca:
+            busca.stop()
+        if conexao_grupos:
+            conexao_grupos.unbind()
 
 def menu():
     print("\n" + "="*60)
@@ -1155,11 +3996,21 @@ def menu():
             print("4️⃣  Contas de usuários desabilitadas somente em 2024")
             print("5️⃣  Relação de todos os e-mails (Nome, E-mail, Cargo)")
             print("6️⃣  Auditoria 2024 (Critério completo original)")
+            print("7️⃣  Salvar snapshot do diretório")
+            print("8️⃣  Relatório de mudanças entre os dois últimos snapshots")
+            print("9️⃣  Pacote consolidado de auditoria (todas as abas em um arquivo)")
+            print("🔟  Idade e vencimento de senhas")
+            print("1️⃣1️⃣ Organograma e contagens por departamento")
+            print("1️⃣2️⃣ Qualidade dos dados (duplicidades e campos ausentes)")
+            print("1️⃣3️⃣ Histórico: contas ativas por mês e linha do tempo de um usuário")
+            print("1️⃣4️⃣ Consulta SQL sobre a base de usuários")
+            print("1️⃣5️⃣ Inventário de computadores (todos ou só os inativos)")
+            print("1️⃣6️⃣ Contas de serviço (gMSA, sMSA e usuários com SPN)")
             print("0️⃣  Sair")
             print("="*40)
             
             try:
-                opcao = input("\n🔍 Escolha uma opção (0-6): ").strip()
+                opcao = input("\n🔍 Escolha uma opção (0-16): ").strip()
                 
                 if opcao == '0':
                     print("\n👋 Encerrando o programa...")
@@ -1182,8 +4033,37 @@ def menu():
                 elif opcao == '6':
                     print("\n🔄 Gerando auditoria 2024 (critério completo)...")
                     gerar_auditoria_2024(conexao)
+                elif opcao == '7':
+                    print("\n🔄 Salvando snapshot do diretório...")
+                    capturar_snapshot(conexao)
+                elif opcao == '8':
+                    print("\n🔄 Comparando snapshots...")
+                    gerar_relatorio_mudancas()
+                elif opcao == '9':
+                    print("\n🔄 Gerando pacote consolidado de auditoria...")
+                    gerar_pacote_auditoria(conexao)
+                elif opcao == '10':
+                    print("\n🔄 Gerando relatório de senhas...")
+                    gerar_relatorio_senhas(conexao)
+                elif opcao == '11':
+                    print("\n🔄 Gerando organograma...")
+                    gerar_relatorio_hierarquia(conexao)
+                elif opcao == '12':
+                    print("\n🔄 Verificando qualidade dos dados...")
+                    gerar_relatorio_qualidade(conexao)
+                elif opcao == '13':
+                    gerar_relatorio_historico()
+                elif opcao == '14':
+                    consulta_sql(conexao)
+                elif opcao == '15':
+                    resposta = input(f"Somente computadores sem logon há quantos dias? (Enter = todos, ex.: {DIAS_COMPUTADOR_INATIVO}): ").strip()
+                    print("\n🔄 Gerando inventário de computadores...")
+                    gerar_inventario_computadores(conexao, int(resposta) if resposta.isdigit() else None)
+                elif opcao == '16':
+                    print("\n🔄 Gerando relatório de contas de serviço...")
+                    gerar_contas_servico(conexao)
                 else:
-                    print("❌ Opção inválida! Escolha uma opção entre 0 e 6.")
+                    print("❌ Opção inválida! Escolha uma opção entre 0 e 16.")
                     continue
                 
                 print("\n" + "="*60)
@@ -1202,5 +4082,46 @@ def menu():
     finally:
         print("\n🔚 Programa finalizado.")
 
+def main():
+    parser = argparse.ArgumentParser(description="Relatórios e auditoria do Active Directory")
+    parser.add_argument('--espelho', action='store_true', help="mantém um espelho em memória atualizado por notificações do AD")
+    parser.add_argument('--notificacao', choices=['ad', 'psearch'], default='ad',
+                        help="mecanismo de notificação do espelho (psearch para servidores LDAP de teste)")
+    parser.add_argument('--servico', action='store_true', help="inicia o serviço HTTP de relatórios sobre o espelho")
+    parser.add_argument('--host', default='127.0.0.1', help="endereço do serviço HTTP (padrão: 127.0.0.1)")
+    parser.add_argument('--porta', type=int, default=8080, help="porta do serviço HTTP (padrão: 8080)")
+    parser.add_argument('--medir-decodificacao', action='store_true', help="compara o caminho Entry do ldap3 com o decodificador bruto")
+    parser.add_argument('--floresta', action='store_true', help="relatórios de toda a floresta pelo catálogo global (3268/3269)")
+    parser.add_argument('--checkpoint', action='store_true', help="grava as páginas recebidas em checkpoints/ para retomar buscas interrompidas")
+    parser.add_argument('--metricas', action='store_true', help="coleta as contagens de contas e grava o textfile do Prometheus")
+    parser.add_argument('--intervalo', type=int, metavar='SEGUNDOS', help="com --metricas, repete a coleta a cada N segundos")
+    parser.add_argument('--arquivo-metricas', metavar='CAMINHO', help=f"com --metricas, arquivo de saída (padrão: {ARQUIVO_METRICAS})")
+    parser.add_argument('--consulta', metavar='SQL', help="executa uma consulta SQL (ou @nome de uma consulta salva) na base de usuários")
+    parser.add_argument('--recarregar', action='store_true', help="com --consulta, recarrega a base do AD antes de consultar")
+    parser.add_argument('--exportar', action='store_true', help="com --consulta, exporta o resultado para Excel")
+    argumentos = parser.parse_args()
+    
+    if argumentos.floresta:
+        global MODO_FLORESTA
+        MODO_FLORESTA = True
+    if argumentos.checkpoint:
+        PAGINACAO['checkpoint'] = True
+    
+    if argumentos.medir_decodificacao:
+        medir_decodificacao(get_conexao())
+    elif argumentos.metricas:
+        executar_metricas(argumentos.intervalo, argumentos.arquivo_metricas)
+    elif argumentos.consulta:
+        # A conexão só é aberta quando a base precisa ser carregada
+        if argumentos.recarregar or data_base_consultas() is None:
+            carregar_base_consultas(get_conexao())
+        consulta_sql(None, argumentos.consulta, argumentos.exportar)
+    elif argumentos.servico:
+        executar_servico(argumentos.host, argumentos.porta, argumentos.notificacao)
+    elif argumentos.espelho:
+        executar_espelho(argumentos.notificacao)
+    else:
+        menu()
+
 if __name__ == "__main__":
-    menu()
+    main()